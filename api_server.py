@@ -0,0 +1,221 @@
+import argparse
+import gzip
+from flask import Flask, g, jsonify, request
+import db_manager
+import ip_allocator
+import telemetry
+
+# --- JSON API ---
+# A small Flask service for automation, so scripts don't have to drive the
+# Streamlit app. Every endpoint is a thin wrapper over a db_manager query; the
+# only writes are IP reservations (ip_allocator.py).
+#   - ETag is the collection generation (bumped whenever collected data or
+#     reservations change), so a client's If-None-Match costs one single-row
+#     read and returns 304 until new data lands
+#   - JSON bodies of GZIP_MIN_BYTES or more are gzipped for clients that accept it
+#   - list endpoints take ?limit=&offset= and return
+#     {"items", "total", "limit", "offset", "next_offset"}
+#
+#   GET /api/health
+#   GET /api/hosts                       hosts with latest metrics
+#   GET /api/hosts/<ip>                  one host
+#   GET /api/hosts/<ip>/vms              VMs of a host
+#   GET /api/vms?ip=<ip> | ?name=<text>  VM lookup by exact IP or name substring
+#   GET /api/subnets                     configured subnets (CIDR)
+#   GET /api/subnets/<cidr>/free         free IPs (not pinged, not on a VM, not reserved)
+#   POST /api/subnets/<cidr>/allocate?count=N&owner=&ttl=
+#                                        reserve N free IPs (409 if not enough)
+#   DELETE /api/reservations/<ip>        release a reservation early
+#   GET /metrics                         last_cycle_stats as Prometheus gauges
+
+API_HOST = "127.0.0.1"
+API_PORT = 8600
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+GZIP_MIN_BYTES = 1024
+GZIP_LEVEL = 5
+
+app = Flask(__name__)
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+@app.errorhandler(ApiError)
+def _api_error(e):
+    return jsonify(error=e.message), e.status
+
+
+@app.errorhandler(404)
+def _not_found(e):
+    return jsonify(error="not found"), 404
+
+
+# Served without a generation ETag: their data changes without a generation bump
+UNVERSIONED_ENDPOINTS = {'metrics'}
+
+
+@app.before_request
+def _check_etag():
+    """Answers 304 before any query runs if the client already has this generation."""
+    if request.method != 'GET' or request.endpoint in UNVERSIONED_ENDPOINTS:
+        return None
+    ip_allocator.sweep_expired()    # A lapsed reservation frees its IP: new generation
+    generation = str(db_manager.get_generation())
+    g.etag = f'W/"{generation}"'
+    if request.if_none_match.contains_weak(generation):
+        response = app.response_class(status=304)
+        response.headers['ETag'] = g.etag
+        return response
+
+
+@app.after_request
+def _finish(response):
+    etag = g.get('etag')
+    if etag and response.status_code == 200:
+        response.headers['ETag'] = etag
+        response.headers['Cache-Control'] = 'no-cache'     # Cache, but revalidate
+    if (response.status_code == 200 and response.mimetype == 'application/json'
+            and 'gzip' in request.headers.get('Accept-Encoding', '')):
+        body = response.get_data()
+        if len(body) >= GZIP_MIN_BYTES:
+            response.set_data(gzip.compress(body, GZIP_LEVEL))
+            response.headers['Content-Encoding'] = 'gzip'
+        response.vary.add('Accept-Encoding')
+    return response
+
+
+@app.teardown_request
+def _close_connections(exc):
+    # The threaded server runs each request on a new thread; don't leave its
+    # pooled connections for the garbage collector.
+    db_manager.close_thread_connections()
+
+
+def _page_args():
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        raise ApiError(400, "limit and offset must be integers")
+    if not 1 <= limit <= MAX_PAGE_SIZE or offset < 0:
+        raise ApiError(400, f"limit must be 1-{MAX_PAGE_SIZE} and offset >= 0")
+    return limit, offset
+
+
+def _page(items, total, limit, offset):
+    next_offset = offset + limit if offset + limit < total else None
+    return jsonify(items=[dict(item) for item in items], total=total, limit=limit,
+                   offset=offset, next_offset=next_offset)
+
+
+@app.get("/api/health")
+def health():
+    return jsonify(status="ok", generation=db_manager.get_generation())
+
+
+@app.get("/api/hosts")
+def hosts():
+    limit, offset = _page_args()
+    rows = db_manager.hosts_with_metrics()
+    return _page(rows[offset:offset + limit], len(rows), limit, offset)
+
+
+@app.get("/api/hosts/<ip>")
+def host(ip):
+    rows = db_manager.hosts_with_metrics(ip)
+    if not rows:
+        raise ApiError(404, f"unknown host {ip}")
+    return jsonify(dict(rows[0]))
+
+
+@app.get("/api/hosts/<ip>/vms")
+def host_vms(ip):
+    limit, offset = _page_args()
+    if not db_manager.hosts_with_metrics(ip):
+        raise ApiError(404, f"unknown host {ip}")
+    vms, total = db_manager.host_vms(ip, limit, offset)
+    return _page(vms, total, limit, offset)
+
+
+@app.get("/api/vms")
+def vms():
+    limit, offset = _page_args()
+    if request.args.get('ip'):
+        query, by = request.args['ip'], "IP"
+    elif request.args.get('name'):
+        query, by = request.args['name'], "Name"
+    else:
+        raise ApiError(400, "pass ?ip= or ?name=")
+    found, total = db_manager.search_vms(query, by, limit, offset)
+    return _page(found, total, limit, offset)
+
+
+@app.get("/api/subnets")
+def subnets():
+    return jsonify(items=db_manager.get_all_subnets())
+
+
+def _configured_subnet(text):
+    """Normalized CIDR of a configured subnet ("10.0.0.0/22", or legacy "10.0.0")."""
+    try:
+        subnet = str(db_manager.parse_subnet(text))
+    except ValueError as e:
+        raise ApiError(400, f"invalid subnet {text}: {e}")
+    if subnet not in db_manager.get_all_subnets():
+        raise ApiError(404, f"unknown subnet {subnet}")
+    return subnet
+
+
+@app.get("/api/subnets/<path:subnet>/free")
+def subnet_free_ips(subnet):
+    limit, offset = _page_args()
+    subnet = _configured_subnet(subnet)
+    free = ip_allocator.free_ips(subnet)
+    return _page([{'ip': ip} for ip in free[offset:offset + limit]], len(free), limit, offset)
+
+
+@app.post("/api/subnets/<path:subnet>/allocate")
+def subnet_allocate(subnet):
+    subnet = _configured_subnet(subnet)
+    try:
+        count = int(request.args.get('count', 1))
+        ttl = int(request.args.get('ttl', ip_allocator.RESERVATION_TTL_SECONDS))
+    except ValueError:
+        raise ApiError(400, "count and ttl must be integers")
+    exclude = [ip for ip in request.args.get('exclude', '').split(',') if ip]
+    try:
+        ips = ip_allocator.allocate(subnet, count, request.args.get('owner'), ttl, exclude)
+    except ValueError as e:
+        raise ApiError(400, str(e))
+    if ips is None:
+        raise ApiError(409, f"fewer than {count} free IPs in {subnet}")
+    return jsonify(items=ips, ttl=ttl)
+
+
+@app.delete("/api/reservations/<ip>")
+def release_reservation(ip):
+    if not ip_allocator.release([ip]):
+        raise ApiError(404, f"no reservation for {ip}")
+    return jsonify(released=ip)
+
+
+@app.get("/metrics")
+def metrics():
+    # Latest phase timings of every collector process (the DB copy, see telemetry.py)
+    return app.response_class(telemetry.render_last_cycle(telemetry.last_cycle_stats()),
+                              mimetype="text/plain")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Read-only JSON API over the monitoring DB")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    args = parser.parse_args()
+    db_manager.init_db()
+    print(f"Serving read API on http://{args.host}:{args.port}/api/")
+    app.run(host=args.host, port=args.port, threaded=True)
@@ -0,0 +1,623 @@
+import asyncio
+import ssl
+import threading
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from xml.sax.saxutils import escape
+import data_collector
+import db_manager
+import session_pool
+import telemetry
+
+# --- Asyncio Collector ---
+# The pyVmomi collector needs one OS thread, blocked on its own TLS session, per
+# host in flight. This collector drives every host from a single event loop:
+#   - it sends the same SOAP calls as the pyVmomi path (RetrieveServiceContent,
+#     Login, CreateContainerView, then one RetrievePropertiesEx plus its
+#     ContinueRetrievePropertiesEx pages) over a small keep-alive HTTP/1.1 client
+#     on asyncio streams, at most ASYNC_MAX_CONNECTIONS connections open at once
+#   - responses are parsed incrementally while they arrive (XMLPullParser); each
+#     ObjectContent is converted and dropped as soon as its closing tag is read
+#   - rows are built by data_collector's builders, so host_metrics / vms get the
+#     same values the threaded collector writes
+#   - fetched hosts go through a bounded asyncio.Queue to a single writer, which
+#     stores whatever is queued (up to ASYNC_WRITER_BATCH_HOSTS hosts) in one
+#     transaction on a dedicated DB thread, off the event loop
+#   - a host past HOST_DEADLINE_SECONDS is cancelled, which closes its connection
+#   - session cookies and container views are kept between cycles; connections
+#     are not, since every cycle runs its own event loop
+# Only the standard library is used. Enable with data_collector.COLLECTOR_ASYNC
+# (background_job.py --async).
+
+ASYNC_MAX_CONNECTIONS = 200         # Hosts in flight, one connection each
+ASYNC_WRITER_BATCH_HOSTS = 16       # Hosts per write transaction, at most
+ASYNC_WRITE_QUEUE_HOSTS = 64        # Fetched hosts waiting for the writer before fetchers pause
+READ_CHUNK_BYTES = 64 * 1024
+VIM_VERSION = "6.7"                 # SOAPAction API version; every property read exists in it
+
+SOAP_ENV = "http://schemas.xmlsoap.org/soap/envelope/"
+XSI = "http://www.w3.org/2001/XMLSchema-instance"
+_XSI_TYPE = f"{{{XSI}}}type"
+
+_lock = threading.Lock()            # One cycle at a time (sessions are shared)
+
+
+def host_endpoint(ip):
+    """(address, port, TLS context or None) of a host's /sdk endpoint. Replaced by
+    benchmarks to point the collector at a local fake (vsphere_simulator.SoapEndpoint)."""
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE     # Same as the pyVmomi path: ESXi certs are self-signed
+    return ip, 443, context
+
+
+class SoapFault(Exception):
+    """A SOAP fault returned by the host; `name` is the fault type, e.g. 'NotAuthenticated'."""
+
+    def __init__(self, name, message):
+        super().__init__(f"{name}: {message}" if message else name)
+        self.name = name
+
+
+# --- HTTP Client ---
+
+class _StaleConnection(ConnectionError):
+    """The connection was closed before any response byte arrived."""
+
+
+async def _io(awaitable, ip):
+    """Awaits one socket operation, giving up after HOST_SOCKET_TIMEOUT_SECONDS."""
+    try:
+        return await asyncio.wait_for(awaitable, data_collector.HOST_SOCKET_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        raise ConnectionError(f"no data from {ip} for {data_collector.HOST_SOCKET_TIMEOUT_SECONDS}s") from None
+
+
+class ConnectionPool:
+    """Keep-alive HTTP/1.1 connections to the hosts' SOAP endpoints.
+
+    A host's requests reuse one connection; at most `limit` connections are open
+    at once, and callers wait for a free slot.
+    """
+
+    def __init__(self, limit=ASYNC_MAX_CONNECTIONS):
+        self._slots = asyncio.Semaphore(limit)
+        self._idle = {}      # ip -> (reader, writer)
+
+    async def _open(self, ip):
+        address, port, context = host_endpoint(ip)
+        await self._slots.acquire()
+        try:
+            return await _io(asyncio.open_connection(address, port, ssl=context), ip)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _close(self, connection):
+        connection[1].close()
+        self._slots.release()
+
+    async def post(self, ip, body, cookie=None, sink=None):
+        """POSTs a SOAP envelope to the host's /sdk.
+
+        Body chunks of a 200 response are passed to `sink(chunk)` as they arrive
+        (if given); otherwise the body is buffered. Returns (status, headers,
+        buffered body).
+        """
+        connection = self._idle.pop(ip, None)
+        if connection is not None:
+            try:
+                return await self._post_on(connection, ip, body, cookie, sink)
+            except _StaleConnection:
+                pass    # The host closed the idle connection; retry once on a new one
+        return await self._post_on(await self._open(ip), ip, body, cookie, sink)
+
+    async def _post_on(self, connection, ip, body, cookie, sink):
+        keep = False
+        try:
+            status, headers, buffered, keep = await self._exchange(connection, ip, body, cookie, sink)
+            return status, headers, buffered
+        finally:
+            if keep:
+                self._idle[ip] = connection
+            else:
+                self._close(connection)
+
+    async def _exchange(self, connection, ip, body, cookie, sink):
+        reader, writer = connection
+        payload = body.encode()
+        head = [
+            "POST /sdk HTTP/1.1", f"Host: {ip}", "Content-Type: text/xml; charset=utf-8",
+            f'SOAPAction: "urn:vim25/{VIM_VERSION}"', f"Content-Length: {len(payload)}", "Connection: keep-alive",
+        ]
+        if cookie:
+            head.append(f"Cookie: {cookie}")
+        try:
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + payload)
+            await _io(writer.drain(), ip)
+            status_line = await _io(reader.readline(), ip)
+        except (ConnectionResetError, BrokenPipeError) as e:
+            raise _StaleConnection(f"{ip} closed the connection: {e}") from None
+        if not status_line:
+            raise _StaleConnection(f"{ip} closed the connection")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await _io(reader.readline(), ip)
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        buffered = []
+        emit = sink if sink is not None and status == 200 else buffered.append
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                size = int((await _io(reader.readline(), ip)).split(b";")[0], 16)
+                if size == 0:
+                    await _io(reader.readline(), ip)     # Ends the (empty) trailer
+                    break
+                emit(await _io(reader.readexactly(size), ip))
+                await _io(reader.readexactly(2), ip)
+        elif "content-length" in headers:
+            remaining = int(headers["content-length"])
+            while remaining:
+                chunk = await _io(reader.read(min(remaining, READ_CHUNK_BYTES)), ip)
+                if not chunk:
+                    raise ConnectionError(f"{ip} closed the connection mid-response")
+                emit(chunk)
+                remaining -= len(chunk)
+        else:
+            while True:
+                chunk = await _io(reader.read(READ_CHUNK_BYTES), ip)
+                if not chunk:
+                    break
+                emit(chunk)
+            headers["connection"] = "close"
+        keep = headers.get("connection", "").lower() != "close"
+        return status, headers, b"".join(buffered), keep
+
+    def discard(self, ip):
+        """Closes a host's idle connection (the host is done for this cycle)."""
+        connection = self._idle.pop(ip, None)
+        if connection is not None:
+            self._close(connection)
+
+    def close(self):
+        for ip in list(self._idle):
+            self.discard(ip)
+
+
+# --- SOAP Messages ---
+
+def _envelope(method, this_type, this_id, body=""):
+    return (f'<?xml version="1.0" encoding="UTF-8"?>'
+            f'<soapenv:Envelope xmlns:soapenv="{SOAP_ENV}" xmlns:xsi="{XSI}" '
+            f'xmlns:xsd="http://www.w3.org/2001/XMLSchema"><soapenv:Body>'
+            f'<{method} xmlns="urn:vim25"><_this type="{this_type}">{escape(this_id)}</_this>{body}</{method}>'
+            f'</soapenv:Body></soapenv:Envelope>')
+
+
+def _property_spec(type_name, paths):
+    return f"<propSet><type>{type_name}</type>{''.join(f'<pathSet>{path}</pathSet>' for path in paths)}</propSet>"
+
+
+def _traversal(name, type_name, path, inner=""):
+    return (f'<selectSet xsi:type="TraversalSpec"><name>{name}</name><type>{type_name}</type>'
+            f'<path>{path}</path><skip>false</skip>{inner}</selectSet>')
+
+
+def _inventory_filter_spec(vm_view, host_view):
+    """XML of data_collector._build_inventory_filter_spec: the VMs of `vm_view`,
+    the HostSystem of `host_view` and, through HostSystem.datastore, its datastores."""
+    return (
+        "<specSet>"
+        + _property_spec("VirtualMachine", data_collector.VM_PROPERTIES)
+        + _property_spec("HostSystem", data_collector.HOST_PROPERTIES)
+        + _property_spec("Datastore", data_collector.DATASTORE_PROPERTIES)
+        + f'<objectSet><obj type="ContainerView">{escape(vm_view)}</obj><skip>true</skip>'
+        + _traversal("traverseVms", "ContainerView", "view") + "</objectSet>"
+        + f'<objectSet><obj type="ContainerView">{escape(host_view)}</obj><skip>true</skip>'
+        + _traversal("traverseHosts", "ContainerView", "view",
+                     _traversal("hostToDatastore", "HostSystem", "datastore")) + "</objectSet>"
+        + "</specSet><options/>"
+    )
+
+
+_local_names = {}
+
+
+def _local(tag):
+    """Tag without its namespace (memoized: responses repeat a few dozen tags)."""
+    name = _local_names.get(tag)
+    if name is None:
+        name = _local_names[tag] = tag.rsplit("}", 1)[-1]
+    return name
+
+
+_OBJECTS, _PROP_SET, _OBJ, _NAME, _VAL, _TOKEN = (
+    f"{{urn:vim25}}{tag}" for tag in ("objects", "propSet", "obj", "name", "val", "token"))
+
+
+def _returnval(body):
+    """The returnval element of a buffered response body (None if there is none)."""
+    for elem in ET.fromstring(body).iter():
+        if _local(elem.tag) == "returnval":
+            return elem
+    return None
+
+
+def _fault(body):
+    """SoapFault for a fault response body."""
+    try:
+        root = ET.fromstring(body)
+    except ET.ParseError:
+        return SoapFault("InvalidResponse", body[:200].decode("utf-8", "replace"))
+    message, name = "", "Fault"
+    for elem in root.iter():
+        tag = _local(elem.tag)
+        if tag == "faultstring":
+            message = elem.text or ""
+        elif tag == "detail" and len(elem):
+            name = _local(elem[0].get(_XSI_TYPE, elem[0].tag)).split(":")[-1]
+            name = name[:-len("Fault")] if name.endswith("Fault") else name
+    return SoapFault(name, message)
+
+
+# --- Response Values ---
+# ESXi tags top-level property values (and subclassed data objects, like the
+# VirtualDisk entries of config.hardware.device) with xsi:type, but not the fields
+# nested inside them, so the few nested fields the row builders read need hints.
+
+_INT_FIELDS = frozenset({'capacityInKB', 'capacityInBytes', 'prefixLength', 'key', 'controllerKey', 'unitNumber'})
+_ARRAY_FIELDS = frozenset({('ipConfig', 'ipAddress'), ('GuestNicInfo', 'ipAddress')})   # (parent, field)
+_SCALARS = {'int': int, 'long': int, 'short': int, 'byte': int, 'double': float, 'float': float,
+            'boolean': lambda text: text == 'true'}
+
+
+class ManagedObjectRef:
+    """A moref from a response; `_wsdlName`/`_moId` as on pyVmomi's, for
+    data_collector.managed_object_type and vm_identity."""
+
+    def __init__(self, type_name, mo_id):
+        self._wsdlName = type_name
+        self._moId = mo_id
+
+    def __repr__(self):
+        return f"'vim.{self._wsdlName}:{self._moId}'"
+
+
+class SoapObject:
+    """A data object from a response. Unset fields read as None, as on pyVmomi
+    objects; `_wsdlName` is the xsi:type if one was sent."""
+
+    def __init__(self, type_name, fields):
+        self._wsdlName = type_name
+        self.__dict__.update(fields)
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return None
+
+
+def _value(elem):
+    """Python value of a response element: list, SoapObject, ManagedObjectRef or scalar."""
+    xsi_type = elem.get(_XSI_TYPE)
+    type_name = xsi_type[xsi_type.find(':') + 1:] if xsi_type else None
+    if not len(elem):
+        # Leaf: most values are one of these, so it is checked first
+        text = elem.text or ''
+        if type_name is None:
+            if elem.get('type') is not None:
+                return ManagedObjectRef(elem.get('type'), text)
+            return int(text) if _local(elem.tag) in _INT_FIELDS else text
+        convert = _SCALARS.get(type_name)
+        if convert is not None:
+            return convert(text)
+        if type_name.startswith('ArrayOf'):
+            return []
+        if type_name == 'ManagedObjectReference':
+            return ManagedObjectRef(elem.get('type'), text)
+        return text
+    if type_name is not None and type_name.startswith('ArrayOf'):
+        return [_value(child) for child in elem]
+    tag = _local(elem.tag)
+    fields, arrays = {}, set()
+    for child in elem:
+        name = _local(child.tag)
+        value = _value(child)
+        if name in arrays:
+            fields[name].append(value)
+        elif name in fields or (tag, name) in _ARRAY_FIELDS:
+            # A repeated (or known array) field is a list
+            fields[name] = [fields[name], value] if name in fields else [value]
+            arrays.add(name)
+        else:
+            fields[name] = value
+    return SoapObject(type_name, fields)
+
+
+class _ObjectStream:
+    """Incremental parser of a RetrievePropertiesEx / ContinueRetrievePropertiesEx
+    response: calls on_object(obj, {path: value}) for every ObjectContent as soon
+    as it is complete, then drops it; the continuation token ends up in `token`."""
+
+    def __init__(self, on_object):
+        self.on_object = on_object
+        self.token = None
+        self._parser = ET.XMLPullParser(events=('end',))
+
+    def feed(self, chunk):
+        self._parser.feed(chunk)
+        self._drain()
+
+    def close(self):
+        self._parser.close()
+        self._drain()
+
+    def _drain(self):
+        # Only ObjectContent and the token carry these tags; none of the retrieved
+        # properties has a field named like them
+        for _, elem in self._parser.read_events():
+            if elem.tag == _OBJECTS:
+                obj, props = None, {}
+                for child in elem:
+                    if child.tag == _PROP_SET:
+                        path, val = child.findtext(_NAME), child.find(_VAL)
+                        props[path] = None if val is None else _value(val)
+                    elif child.tag == _OBJ:
+                        obj = _value(child)
+                self.on_object(obj, props)
+                elem.clear()    # Keeps only an empty <objects/> per object until the page is done
+            elif elem.tag == _TOKEN:
+                self.token = elem.text
+
+
+# --- Sessions ---
+
+class AsyncSession:
+    """A host's SOAP session: cookie, ServiceContent morefs and container views.
+    Kept across cycles in SESSIONS, like session_pool.HostSession."""
+
+    def __init__(self, ip, user, password):
+        self.ip = ip
+        self.user = user
+        self.password = password
+        self.cookie = None
+        self.content = {}          # ServiceContent field -> moref id (propertyCollector, viewManager, ...)
+        self.views = {}            # Type name -> ContainerView moref id
+        self.connect_seconds = 0.0
+        self.round_trips = 0
+
+    async def call(self, pool, method, this_type, this_id, body="", sink=None):
+        """Sends one request; returns (headers, buffered body). Raises SoapFault."""
+        self.round_trips += 1
+        status, headers, buffered = await pool.post(self.ip, _envelope(method, this_type, this_id, body),
+                                                    self.cookie, sink)
+        if status != 200:
+            raise _fault(buffered)
+        return headers, buffered
+
+    async def login(self, pool):
+        """RetrieveServiceContent + Login; returns False if the host refused or was unreachable."""
+        self.cookie = None
+        self.views = {}
+        start = time.perf_counter()
+        try:
+            _, body = await self.call(pool, 'RetrieveServiceContent', 'ServiceInstance', 'ServiceInstance')
+            self.content = {_local(child.tag): child.text for child in _returnval(body) if child.get('type')}
+            headers, _ = await self.call(pool, 'Login', 'SessionManager', self.content['sessionManager'],
+                                         f"<userName>{escape(self.user)}</userName>"
+                                         f"<password>{escape(self.password)}</password>")
+            self.cookie = headers.get('set-cookie', '').split(';')[0] or None
+            if self.cookie is None:
+                print(f"Failed to connect to {self.ip}: no session cookie in the Login response")
+        except (OSError, SoapFault, ET.ParseError, KeyError, TypeError) as e:
+            print(f"Failed to connect to {self.ip}: {e}")
+        finally:
+            self.connect_seconds = time.perf_counter() - start
+            telemetry.observe('host_connect', self.ip, self.connect_seconds)
+        return self.cookie is not None
+
+    async def view(self, pool, type_name):
+        """Cached recursive ContainerView of `type_name` under the root folder."""
+        if type_name not in self.views:
+            _, body = await self.call(pool, 'CreateContainerView', 'ViewManager', self.content['viewManager'],
+                                      f'<container type="Folder">{escape(self.content["rootFolder"])}</container>'
+                                      f'<type>{type_name}</type><recursive>true</recursive>')
+            self.views[type_name] = _returnval(body).text
+        return self.views[type_name]
+
+
+SESSIONS = {}    # ip -> AsyncSession
+
+
+def _session(host_row):
+    session = SESSIONS.get(host_row['ip'])
+    if session is None or (session.user, session.password) != (host_row['username'], host_row['password']):
+        session = SESSIONS[host_row['ip']] = AsyncSession(host_row['ip'], host_row['username'], host_row['password'])
+    return session
+
+
+async def _retrieve_inventory(pool, session):
+    """(host_props, datastores, vm_contents) as in data_collector._fetch_host_inventory,
+    parsed from the responses while they stream in."""
+    host_props = None
+    datastores = []
+    vm_contents = []
+
+    def on_object(obj, props):
+        nonlocal host_props
+        obj_type = data_collector.managed_object_type(obj)
+        if obj_type == 'VirtualMachine':
+            vm_contents.append((obj, props))
+        elif obj_type == 'HostSystem':
+            host_props = host_props or props
+        elif obj_type == 'Datastore':
+            datastores.append(props)
+
+    spec = _inventory_filter_spec(await session.view(pool, 'VirtualMachine'), await session.view(pool, 'HostSystem'))
+    collector = session.content['propertyCollector']
+    with telemetry.span('host_retrieve', session.ip):
+        method, body = 'RetrievePropertiesEx', spec
+        while True:
+            stream = _ObjectStream(on_object)
+            await session.call(pool, method, 'PropertyCollector', collector, body, sink=stream.feed)
+            stream.close()
+            if not stream.token:
+                break
+            method, body = 'ContinueRetrievePropertiesEx', f"<token>{escape(stream.token)}</token>"
+    if host_props is None:
+        raise RuntimeError("host returned no HostSystem properties")
+    return host_props, datastores, vm_contents
+
+
+def _store_batch(batch):
+    """DB thread: builds the rows of [(host_row, fetched)] and writes them in one transaction."""
+    rows = []
+    for host_row, (host_props, datastores, vm_contents, round_trips) in batch:
+        ip = host_row['ip']
+        try:
+            with telemetry.span('host_process', ip):
+                metrics_row, vm_rows = data_collector.build_host_rows(host_row['id'], host_props, datastores, vm_contents)
+        except Exception as e:
+            print(f"Error collecting data for host {ip}: {e}")
+            telemetry.incr('host_failures', ip)
+            continue
+        rows.append((ip, (metrics_row, vm_rows, round_trips)))
+    return data_collector.store_host_batch(rows)
+
+
+# --- Collection Cycle ---
+
+class _Cycle:
+    """State of one collect_all run; everything but the writes runs on its event loop."""
+
+    def __init__(self, total, progress_callback):
+        self.total = total
+        self.progress_callback = progress_callback
+        self.changes = {}
+        self.timed_out = {}
+        self.saved_seconds = 0.0
+        self.finished = 0
+
+    def _report(self, count=1):
+        self.finished += count
+        if self.progress_callback:
+            self.progress_callback(self.finished, self.total)
+
+    async def run(self, hosts):
+        # Created here: before Python 3.10 these bind to the loop current at construction
+        self.pool = ConnectionPool()
+        self.slots = asyncio.Semaphore(ASYNC_MAX_CONNECTIONS)
+        self.queue = asyncio.Queue(ASYNC_WRITE_QUEUE_HOSTS)
+        self.cycle_deadline = time.monotonic() + data_collector.CYCLE_DEADLINE_SECONDS
+        db_thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="async-collector-db")
+        writer = asyncio.ensure_future(self.write(db_thread))
+        try:
+            await asyncio.gather(*(self.collect_host(host) for host in hosts))
+            await self.queue.put(None)
+            await writer
+        finally:
+            writer.cancel()
+            self.pool.close()
+            db_thread.submit(db_manager.close_thread_connections)
+            db_thread.shutdown(wait=True)
+
+    async def fetch(self, host_row):
+        """Async fetch_host_data: (host_props, datastores, vm_contents, round_trips),
+        or None if the host could not be logged into."""
+        ip = host_row['ip']
+        session = _session(host_row)
+        start = session.round_trips
+        try:
+            for attempt in range(session_pool.SESSION_MAX_RETRIES + 1):
+                reused = session.cookie is not None
+                if reused:
+                    print(f"Reusing session for {ip} (saves ~{session.connect_seconds * 1000:.0f} ms connect)")
+                elif await session.login(self.pool):
+                    print(f"Connected to {ip} in {session.connect_seconds * 1000:.0f} ms (new session)")
+                else:
+                    return None
+                try:
+                    fetched = await _retrieve_inventory(self.pool, session)
+                except SoapFault as e:
+                    if e.name != 'NotAuthenticated' or attempt == session_pool.SESSION_MAX_RETRIES:
+                        raise
+                    print(f"Session for {ip} was no longer valid ({e}); logging in again.")
+                    session.cookie = None
+                    continue
+                if reused:
+                    self.saved_seconds += session.connect_seconds
+                return fetched + (session.round_trips - start,)
+        finally:
+            telemetry.incr('soap_round_trips', ip, session.round_trips - start)
+
+    async def collect_host(self, host_row):
+        ip = host_row['ip']
+        async with self.slots:
+            if time.monotonic() > self.cycle_deadline:
+                self.timed_out[ip] = f"not started within the {data_collector.CYCLE_DEADLINE_SECONDS}s cycle deadline"
+                telemetry.incr('host_timeouts', ip)
+                self._report()
+                return
+            print(f"Collecting data for host: {ip}")
+            task = asyncio.ensure_future(self.fetch(host_row))
+            try:
+                done, _ = await asyncio.wait({task}, timeout=data_collector.HOST_DEADLINE_SECONDS)
+                if not done:
+                    # Unlike a thread, the task really stops: its connection is closed
+                    task.cancel()
+                    await asyncio.wait({task})
+                    SESSIONS.pop(ip, None)
+                    self.timed_out[ip] = f"still running after {data_collector.HOST_DEADLINE_SECONDS}s"
+                    telemetry.incr('host_timeouts', ip)
+                    fetched = None
+                else:
+                    fetched = task.result()
+                    if fetched is None:
+                        print(f"Skipping {ip} due to connection failure.")
+                        telemetry.incr('host_failures', ip)
+            except Exception as e:
+                print(f"Error collecting data for host {ip}: {e}")
+                telemetry.incr('host_failures', ip)
+                fetched = None
+            finally:
+                self.pool.discard(ip)
+        if fetched is None:
+            self._report()
+        else:
+            await self.queue.put((host_row, fetched))
+
+    async def write(self, db_thread):
+        """Single writer: stores whatever is queued, up to ASYNC_WRITER_BATCH_HOSTS
+        hosts per transaction, on the DB thread."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < ASYNC_WRITER_BATCH_HOSTS and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            last = batch[-1] is None
+            batch = [item for item in batch if item is not None]
+            if batch:
+                self.changes.update(await loop.run_in_executor(db_thread, _store_batch, batch))
+                self._report(len(batch))
+            if last:
+                return
+
+
+def collect_all(hosts, progress_callback=None):
+    """Collects and stores every host from one event loop.
+
+    Returns, like collector_pool.CollectorPool.collect, ([VM change counts or None
+    per host, in `hosts` order], connect seconds saved by session reuse,
+    {ip: reason} of the hosts that timed out). `progress_callback(done, total)`
+    is called as hosts are written or fail.
+    """
+    hosts = [dict(host) for host in hosts]
+    with _lock:
+        cycle = _Cycle(len(hosts), progress_callback)
+        asyncio.run(cycle.run(hosts))
+    return [cycle.changes.get(host['ip']) for host in hosts], cycle.saved_seconds, cycle.timed_out
@@ -1,10 +1,10 @@
+import argparse
 import time
 from datetime import datetime
 import data_collector
 import db_manager
-
-# Configuration
-UPDATE_INTERVAL_SECONDS = 3600  # 1 Hour
+import scheduler
+import telemetry
 
 def job():
     print(f"[{datetime.now()}] Starting scheduled background update...")
@@ -14,16 +14,65 @@ def job():
     except Exception as e:
         print(f"[{datetime.now()}] Update failed: {e}")
 
+def run_stream_mode():
+    """Long-lived mode: one full sync per host, then WaitForUpdatesEx deltas.
+    The main thread meanwhile runs the dashboard's queued jobs."""
+    import change_stream
+    import jobs
+    threads, stop_event = change_stream.run_change_streams()
+    print(f"Streaming changes from {len(threads)} hosts. Press Ctrl+C to stop.")
+    try:
+        while any(t.is_alive() for t in threads):
+            jobs.run_pending()
+            time.sleep(jobs.JOB_POLL_SECONDS)
+    except KeyboardInterrupt:
+        stop_event.set()
+
+def run_scheduled_mode():
+    """Per-host adaptive cadence (see scheduler.py) plus periodic subnet scans."""
+    sched = scheduler.build_scheduler()
+    print(f"Starting adaptive scheduler for {len(sched.tasks)} tasks "
+          f"(hosts every {scheduler.HOST_INTERVAL_SECONDS}s, hot hosts every {scheduler.HOT_HOST_INTERVAL_SECONDS}s).")
+    try:
+        sched.run_until()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sched.shutdown()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Background collector: adaptive schedule by default")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--once", action="store_true", help="run a single full cycle over all hosts, e.g. from cron")
+    mode.add_argument("--stream", action="store_true", help="one full sync per host, then WaitForUpdatesEx deltas")
+    parser.add_argument("--processes", type=int, default=0, metavar="N",
+                        help="shard full cycles over N collector processes (collector_pool.py)")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="drive full cycles from one event loop (async_collector.py)")
+    parser.add_argument("--metrics-port", type=int, default=telemetry.METRICS_PORT, metavar="N")
+    parser.add_argument("--no-metrics", action="store_true", help="don't serve /metrics")
+    return parser.parse_args(argv)
+
 if __name__ == "__main__":
-    print(f"Starting background job scheduler. Updating every {UPDATE_INTERVAL_SECONDS} seconds.")
-    
+    args = parse_args()
     # Ensure DB is ready
     db_manager.init_db()
-    
-    # Run once on startup
-    job()
-
-    while True:
-        # Sleep for the interval
-        time.sleep(UPDATE_INTERVAL_SECONDS)
-        job()
\ No newline at end of file
+
+    if not args.once and not args.no_metrics:
+        # Phase timings and counters of this process for Prometheus scrapes
+        try:
+            telemetry.serve_metrics(port=args.metrics_port)
+        except OSError as e:
+            print(f"Metrics endpoint unavailable on port {args.metrics_port}: {e}")
+
+    # Full cycles (--once, dashboard refresh) shard hosts over N collector processes
+    data_collector.COLLECTOR_PROCESSES = args.processes
+    # Full cycles drive all hosts from one event loop (async_collector.py)
+    data_collector.COLLECTOR_ASYNC = args.use_async
+
+    if args.stream:
+        run_stream_mode()
+    elif args.once:
+        job()
+    else:
+        run_scheduled_mode()
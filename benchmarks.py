@@ -0,0 +1,980 @@
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import db_manager
+from pyVmomi import vim
+
+try:
+    import resource
+except ImportError:   # Not available on Windows; peak RSS is reported as null
+    resource = None
+
+# --- Benchmark Helpers ---
+# Run with: python benchmarks.py <benchmark> [options]
+# Every benchmark works on a throwaway database, never on monitoring.db.
+
+@contextmanager
+def temp_db():
+    """Points db_manager at a fresh, initialised database in a temp directory."""
+    original = db_manager.DB_FILE
+    tmp_dir = tempfile.mkdtemp(prefix="esxi-bench-")
+    db_manager.DB_FILE = os.path.join(tmp_dir, "bench.db")
+    try:
+        db_manager.init_db()
+        yield db_manager.DB_FILE
+    finally:
+        db_manager.DB_FILE = original
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def timed(fn, *args, **kwargs):
+    """Returns (seconds, result) for one call."""
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+def fail(message):
+    """Ends a benchmark whose numbers would be meaningless, with exit status 1."""
+    sys.exit(f"\nFAILED: {message}")
+
+def report(title, rows):
+    """Prints (label, row_count, seconds) tuples as a rows/sec table."""
+    print(f"\n{title}")
+    print(f"  {'case':<34}{'rows':>10}{'seconds':>10}{'rows/sec':>14}")
+    for label, count, seconds in rows:
+        rate = count / seconds if seconds else float('inf')
+        print(f"  {label:<34}{count:>10}{seconds:>10.3f}{rate:>14,.0f}")
+
+# --- bulk-writes: per-row execute vs executemany batches ---
+
+def _fake_vm_rows(host_id, count):
+    now = datetime.now()
+    return [
+        (host_id, f"uuid-{host_id}-{i}", f"vm-{host_id}-{i}", "Ubuntu Linux (64-bit)", 4, 2048, 8192,
+         int(now.timestamp()) - i * 3600, "poweredOn", now, (f"10.{host_id % 256}.{i // 256}.{i % 256}",), (("Hard disk 1", 40.0),))
+        for i in range(count)
+    ]
+
+def _vms_per_row(host_rows):
+    for host_id, rows in host_rows.items():
+        conn = db_manager.get_db_connection()
+        c = conn.cursor()
+        c.execute("DELETE FROM vms WHERE host_id = ?", (host_id,))
+        for row in rows:
+            c.execute('''
+                INSERT INTO vms (
+                    host_id, vm_uuid, name, os, cpu_count, ram_used_mb, ram_total_mb, created_ts, power_state, last_updated
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', row[:-2])
+            for ip in row[-2]:
+                c.execute('INSERT OR IGNORE INTO vm_ips (vm_id, ip) VALUES (?, ?)', (c.lastrowid, ip))
+            for position, (label, capacity_gb) in enumerate(row[-1]):
+                c.execute('INSERT INTO vm_disks (vm_id, position, label, capacity_gb) VALUES (?, ?, ?, ?)',
+                          (c.lastrowid, position, label, capacity_gb))
+        conn.commit()
+        conn.close()
+
+def _vms_bulk(host_rows):
+    for host_id, rows in host_rows.items():
+        db_manager.bulk_replace_vms(host_id, rows)
+
+def _vms_sync(host_rows):
+    for host_id, rows in host_rows.items():
+        db_manager.sync_vms(host_id, rows)
+
+def _scans_per_row(subnet_rows):
+    for rows in subnet_rows.values():
+        conn = db_manager.get_db_connection()
+        c = conn.cursor()
+        for ip, status, ts in rows:
+            c.execute('''
+                INSERT OR REPLACE INTO network_scans (ip, status, last_updated)
+                VALUES (?, ?, ?)
+            ''', (db_manager.ip_to_int(ip), status, int(ts.timestamp())))
+        conn.commit()
+        conn.close()
+
+def _scans_bulk(subnet_rows):
+    for rows in subnet_rows.values():
+        db_manager.bulk_upsert_scan_results(rows)
+
+def _hosts_per_row(rows):
+    conn = db_manager.get_db_connection()
+    c = conn.cursor()
+    for ip, user, password, group_name in rows:
+        c.execute('SELECT id FROM hosts WHERE ip = ?', (ip,))
+        if c.fetchone():
+            c.execute('UPDATE hosts SET username = ?, password = ?, group_name = ? WHERE ip = ?',
+                      (user, password, group_name, ip))
+        else:
+            c.execute('INSERT INTO hosts (ip, username, password, group_name) VALUES (?, ?, ?, ?)',
+                      (ip, user, password, group_name))
+    conn.commit()
+    conn.close()
+
+def bench_bulk_writes(args):
+    vms_per_host = max(1, args.vms // args.hosts)
+    host_rows = {host_id: _fake_vm_rows(host_id, vms_per_host) for host_id in range(1, args.hosts + 1)}
+    vm_count = vms_per_host * args.hosts
+    now = datetime.now()
+    subnet_rows = {
+        f"10.0.{n}.0/24": [(f"10.0.{n}.{i}", "taken" if i % 3 else "free", now) for i in range(256)]
+        for n in range(args.subnets)
+    }
+    scan_count = 256 * args.subnets
+    host_cfg = [(f"172.16.{i // 256}.{i % 256}", "root", "secret", f"group{i % 8}") for i in range(args.host_configs)]
+
+    results = []
+    for label, fn, payload, count in [
+        ("vms: per-row execute", _vms_per_row, host_rows, vm_count),
+        ("vms: bulk_replace_vms", _vms_bulk, host_rows, vm_count),
+        ("vms: sync_vms (no changes)", _vms_sync, host_rows, vm_count),
+        ("scans: per-row INSERT OR REPLACE", _scans_per_row, subnet_rows, scan_count),
+        ("scans: bulk_upsert_scan_results", _scans_bulk, subnet_rows, scan_count),
+        ("hosts: SELECT + UPDATE/INSERT", _hosts_per_row, host_cfg, len(host_cfg)),
+        ("hosts: bulk_upsert_hosts", db_manager.bulk_upsert_hosts, host_cfg, len(host_cfg)),
+    ]:
+        with temp_db():
+            # Second pass measures the steady state (rows already exist)
+            fn(payload)
+            seconds, _ = timed(fn, payload)
+        results.append((label, count, seconds))
+
+    report(f"Bulk write path ({vm_count} VMs on {args.hosts} hosts, {args.subnets} subnets)", results)
+
+# --- db-concurrency: many writer and reader threads on one DB ---
+
+_READ_QUERY = """
+    SELECT h.ip, count(v.id) AS vm_count, hm.cpu_usage
+    FROM hosts h
+    LEFT JOIN vms v ON v.host_id = h.id
+    LEFT JOIN host_metrics hm ON hm.host_id = h.id
+    GROUP BY h.id
+"""
+
+def _legacy_write(host_id, rows):
+    # Old behaviour: fresh connection, rollback journal, default 5s busy timeout
+    conn = sqlite3.connect(db_manager.DB_FILE)
+    try:
+        conn.execute("DELETE FROM vms WHERE host_id = ?", (host_id,))
+        conn.executemany(
+            f"INSERT INTO vms ({', '.join(db_manager.VM_COLUMNS)}) VALUES ({', '.join('?' * len(db_manager.VM_COLUMNS))})",
+            [row[:len(db_manager.VM_COLUMNS)] for row in rows]
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+def _legacy_read():
+    conn = sqlite3.connect(db_manager.DB_FILE)
+    try:
+        conn.execute(_READ_QUERY).fetchall()
+    finally:
+        conn.close()
+
+def _pooled_read():
+    with db_manager.read_connection() as conn:
+        conn.execute(_READ_QUERY).fetchall()
+
+def _run_concurrency(args, write, read):
+    stop = threading.Event()
+    counts = {"writes": 0, "reads": 0, "errors": 0}
+    lock = threading.Lock()
+
+    def bump(key):
+        with lock:
+            counts[key] += 1
+
+    def writer(host_id):
+        rows = _fake_vm_rows(host_id, args.vms_per_write)
+        for _ in range(args.writes):
+            try:
+                write(host_id, rows)
+                bump("writes")
+            except sqlite3.OperationalError:
+                bump("errors")
+        db_manager.close_thread_connections()
+
+    def reader():
+        while not stop.is_set():
+            try:
+                read()
+                bump("reads")
+            except sqlite3.OperationalError:
+                bump("errors")
+        db_manager.close_thread_connections()
+
+    db_manager.bulk_upsert_hosts([(f"10.0.0.{i}", "root", "x", "g") for i in range(1, args.writers + 1)])
+    readers = [threading.Thread(target=reader) for _ in range(args.readers)]
+    writers = [threading.Thread(target=writer, args=(i,)) for i in range(1, args.writers + 1)]
+    start = time.perf_counter()
+    for t in readers + writers:
+        t.start()
+    for t in writers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    for t in readers:
+        t.join()
+    return counts, elapsed
+
+def bench_db_concurrency(args):
+    print(f"\n{args.writers} writer threads x {args.writes} snapshots of {args.vms_per_write} VMs, {args.readers} reader threads")
+    print(f"  {'mode':<28}{'writes':>8}{'reads':>10}{'errors':>8}{'seconds':>10}{'reads/sec':>12}")
+    for label, legacy in (("legacy (rollback journal)", True), ("pooled WAL", False)):
+        with temp_db():
+            db_manager.close_thread_connections()
+            if legacy:
+                conn = sqlite3.connect(db_manager.DB_FILE)
+                conn.execute("PRAGMA journal_mode = DELETE")
+                conn.close()
+                counts, elapsed = _run_concurrency(args, _legacy_write, _legacy_read)
+            else:
+                counts, elapsed = _run_concurrency(args, db_manager.bulk_replace_vms, _pooled_read)
+            db_manager.close_thread_connections()
+        print(f"  {label:<28}{counts['writes']:>8}{counts['reads']:>10}{counts['errors']:>8}"
+              f"{elapsed:>10.2f}{counts['reads'] / elapsed:>12,.0f}")
+    # The legacy row shows the locking it had; the pooled WAL setup must have none
+    if counts['errors'] or counts['writes'] != args.writers * args.writes:
+        fail(f"pooled WAL: {counts['errors']} lock errors, {counts['writes']} of "
+             f"{args.writers * args.writes} writes landed")
+
+# --- change-stream: full RetrievePropertiesEx pull vs WaitForUpdatesEx deltas ---
+
+def _simulated_inventory(args):
+    from vsphere_simulator import VSphereSimulator
+    sim = VSphereSimulator(latency=args.latency)
+    sim.add_host("10.0.0.1", datastores=[(2048, 1024)] * 4)
+    vm_ids = [
+        sim.add_vm("10.0.0.1", f"vm-{i}", ips=[f"10.1.{i // 256}.{i % 256}"], disks_gb=(40, 100))
+        for i in range(args.vms)
+    ]
+    db_manager.bulk_upsert_hosts([("10.0.0.1", "root", "x", "bench")])
+    with db_manager.read_connection() as conn:
+        host_row = conn.execute("SELECT * FROM hosts WHERE ip = '10.0.0.1'").fetchone()
+    return sim, vm_ids, host_row
+
+def _mutate(sim, vm_ids, round_no, count):
+    """Changes up to `count` VMs; returns how many."""
+    changed = vm_ids[round_no * count % len(vm_ids):][:count]
+    for mo_id in changed:
+        sim.update_vm("10.0.0.1", mo_id, summary__quickStats__guestMemoryUsage=512 + round_no)
+    return len(changed)
+
+def _check_delta(mode, round_no, changes, expected):
+    """Both modes must write exactly the VMs _mutate changed, with the new value."""
+    if changes is None:
+        fail(f"{mode}: round {round_no + 1} failed to collect the host")
+    if (changes['inserted'], changes['updated'], changes['deleted']) != (0, expected, 0):
+        fail(f"{mode}: round {round_no + 1} wrote {changes}, expected {expected} updated VMs")
+    with db_manager.read_connection() as conn:
+        stored = conn.execute("SELECT count(*) FROM vms WHERE ram_used_mb = ?", (512 + round_no,)).fetchone()[0]
+    if stored != expected:
+        fail(f"{mode}: round {round_no + 1} stored the new value for {stored} of {expected} VMs")
+
+def bench_change_stream(args):
+    import change_stream
+    import data_collector
+    original_connect = data_collector.connect_host
+    print(f"\n{args.vms} VMs on one simulated host, {args.changes} VMs changed per round, {args.rounds} rounds")
+    print(f"  {'mode':<30}{'ms/round':>10}{'calls/round':>13}{'rows written':>14}")
+    try:
+        with temp_db():
+            sim, vm_ids, host_row = _simulated_inventory(args)
+            data_collector.connect_host = sim.connect
+            if data_collector.collect_host_data(host_row) is None:
+                fail("full pull: the initial collection failed")
+            sim.calls.clear()
+            seconds, written = 0.0, 0
+            for r in range(args.rounds):
+                expected = _mutate(sim, vm_ids, r, args.changes)
+                elapsed, changes = timed(data_collector.collect_host_data, host_row)
+                _check_delta("full pull", r, changes, expected)
+                seconds += elapsed
+                written += changes['inserted'] + changes['updated'] + changes['deleted']
+            print(f"  {'full pull (collect_host_data)':<30}{seconds / args.rounds * 1000:>10.1f}"
+                  f"{sim.total_calls() / args.rounds:>13.1f}{written:>14}")
+
+        with temp_db():
+            sim, vm_ids, host_row = _simulated_inventory(args)
+            stream = change_stream.HostChangeStream(host_row, sim.connect("10.0.0.1"))
+            stream.start()
+            stream.poll(0)
+            stream.flush()
+            sim.calls.clear()
+            seconds, written = 0.0, 0
+            for r in range(args.rounds):
+                expected = _mutate(sim, vm_ids, r, args.changes)
+                start = time.perf_counter()
+                stream.poll(0)
+                changes = stream.flush()
+                seconds += time.perf_counter() - start
+                _check_delta("change stream", r, changes, expected)
+                written += changes['inserted'] + changes['updated'] + changes['deleted']
+            print(f"  {'change stream (WaitForUpdatesEx)':<30}{seconds / args.rounds * 1000:>10.1f}"
+                  f"{sim.total_calls() / args.rounds:>13.1f}{written:>14}")
+            stream.stop()
+    finally:
+        data_collector.connect_host = original_connect
+        data_collector.SESSION_POOL.close_all()
+        db_manager.close_thread_connections()
+
+# --- host-fetch: SOAP round trips per host vs datastore count ---
+
+def _legacy_host_walk(session):
+    # Old behaviour: lazy attribute walk, one round trip per summary/datastore read
+    esxi_host = session.view(vim.HostSystem).view[0]
+    summary = esxi_host.summary
+    _ = (summary.quickStats.overallCpuUsage, summary.hardware.cpuMhz, summary.hardware.memorySize)
+    return [(ds.summary.capacity, ds.summary.freeSpace) for ds in esxi_host.datastore]
+
+def bench_host_fetch(args):
+    import data_collector
+    import session_pool
+    from vsphere_simulator import VSphereSimulator
+    print(f"\nSOAP round trips for one host with {args.vms} VMs, {args.page_size} objects per result page")
+    print("(the batched fetch must take exactly one round trip per result page, whatever the datastore count)")
+    print(f"  {'datastores':>10}{'host attr walk':>16}{'batched fetch':>15}{'result pages':>14}")
+    for count in (1, 4, 16, 64, 256):
+        with temp_db():
+            sim = VSphereSimulator(page_size=args.page_size)
+            sim.add_host("10.0.0.1", datastores=[(1024, 512)] * count)
+            for i in range(args.vms):
+                sim.add_vm("10.0.0.1", f"vm-{i}", ips=[f"10.1.{i // 256}.{i % 256}"])
+            session = session_pool.HostSession("10.0.0.1", "root", "x", sim.connect)
+            session.login()
+            session.view(vim.VirtualMachine)
+            session.view(vim.HostSystem)
+
+            start = session.round_trips
+            _legacy_host_walk(session)
+            walk_calls = session.round_trips - start
+
+            start = session.round_trips
+            metrics_row, vm_rows = data_collector._fetch_host_inventory(session, 1)
+            fetch_calls = session.round_trips - start
+            pages = -(-(args.vms + 1 + count) // args.page_size)   # VMs, the host and its datastores
+            print(f"  {count:>10}{walk_calls:>16}{fetch_calls:>15}{pages:>14}")
+            session.logout()
+        if fetch_calls != pages:
+            fail(f"{fetch_calls} round trips for {pages} result pages with {count} datastores")
+        if metrics_row[9] != count * 1024 or len(vm_rows) != args.vms:
+            fail(f"batched fetch returned {metrics_row[9]} GB of storage and {len(vm_rows)} VMs "
+                 f"(expected {count * 1024} GB and {args.vms})")
+
+# --- collector-pool: hosts/minute, threads vs worker processes ---
+
+@contextmanager
+def _inherited_stdout(log):
+    """Points file descriptor 1 at `log` while child processes are started, so
+    their output goes where this process's does."""
+    sys.stdout.flush()
+    saved = os.dup(1)
+    os.dup2(log.fileno(), 1)
+    try:
+        yield
+    finally:
+        os.dup2(saved, 1)
+        os.close(saved)
+
+def _rate(hosts, failed, seconds):
+    """Hosts/minute column; blank when hosts failed, since failures finish early."""
+    return f"{'-':>11}" if failed else f"{hosts / seconds * 60:>11,.0f}"
+
+def bench_collector_pool(args):
+    import collector_pool
+    import data_collector
+    from vsphere_simulator import SimulatedFarm
+    farm = SimulatedFarm(latency=args.latency, parse_cost=args.parse_cost, hosts=args.hosts, vms_per_host=args.vms)
+    host_rows = [{'id': h + 1, 'ip': ip, 'username': "root", 'password': "x"} for h, ip in enumerate(farm.host_ips())]
+    modes = [(0, args.threads)] + [(p, max(1, args.threads // p)) for p in (2, 4, 8) if p <= args.processes]
+    print(f"\n{args.hosts} simulated hosts x {args.vms} VMs, {args.latency * 1000:.1f} ms per SOAP call, "
+          f"{args.parse_cost * 1e6:.0f} us CPU per object, {os.cpu_count()} CPUs")
+    print(f"  {'mode':<28}{'cold s':>8}{'hosts/min':>11}{'warm s':>8}{'hosts/min':>11}{'failed':>8}{'VM rows':>9}")
+    original = data_collector.connect_host
+    log = sys.stdout if args.log else open(os.devnull, "w")
+    problems = []
+    try:
+        for processes, threads in modes:
+            with temp_db():
+                with db_manager.connection() as conn:
+                    conn.executemany("INSERT INTO hosts (id, ip, username, password) "
+                                     "VALUES (:id, :ip, :username, :password)", host_rows)
+                pool = None
+                if processes:
+                    # Workers swap in the farm as their data_collector.connect_host. They build
+                    # its inventory on first use, so the cold cycle includes that and their start-up
+                    with _inherited_stdout(log):
+                        pool = collector_pool.CollectorPool(processes, threads, connect=farm)
+                    collect = lambda: pool.collect(host_rows)[0]
+                else:
+                    data_collector.connect_host = farm
+                    def collect():
+                        with data_collector.ThreadPoolExecutor(max_workers=threads) as executor:
+                            return list(executor.map(data_collector.collect_host_data, host_rows))
+                try:
+                    with contextlib.redirect_stdout(log):
+                        # Cold: first login and full insert; warm: reused sessions, unchanged VMs
+                        cold, cold_results = timed(collect)
+                        warm, warm_results = timed(collect)
+                finally:
+                    if pool:
+                        pool.close()
+                    data_collector.connect_host = original
+                    data_collector.SESSION_POOL.close_all()
+                with db_manager.read_connection() as conn:
+                    vm_rows = conn.execute("SELECT count(*) FROM vms").fetchone()[0]
+                db_manager.close_thread_connections()
+            label = f"{processes} processes x {threads} threads" if processes else f"in-process, {threads} threads"
+            cold_failed = sum(1 for r in cold_results if r is None)
+            warm_failed = sum(1 for r in warm_results if r is None)
+            print(f"  {label:<28}{cold:>8.2f}{_rate(args.hosts, cold_failed, cold)}{warm:>8.2f}"
+                  f"{_rate(args.hosts, warm_failed, warm)}{max(cold_failed, warm_failed):>8}{vm_rows:>9}")
+            if cold_failed or warm_failed:
+                problems.append(f"{label}: {cold_failed} cold / {warm_failed} warm hosts failed")
+            elif vm_rows != args.hosts * args.vms:
+                problems.append(f"{label}: {vm_rows} VM rows stored, expected {args.hosts * args.vms}")
+    finally:
+        if log is not sys.stdout:
+            log.close()
+    if problems:
+        fail("; ".join(problems) + " (run with --log 1 for the errors)")
+
+# --- collector-cycle: end-to-end update_all_hosts cycles, saved as JSON ---
+
+def _peak_rss_mb():
+    """High-water mark of this process's resident memory, or None if unknown."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss   # KB on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+CYCLE_METRICS = ('wall_seconds', 'soap_calls', 'vm_rows_written', 'peak_rss_mb')
+
+def _compare_cycles(cycles, config, baseline_path, tolerance):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nAgainst {baseline_path} ({baseline.get('recorded_at')}), tolerance {tolerance:.0%}")
+    regressions = 0
+    for current, previous in zip(cycles, baseline['cycles']):
+        for metric in CYCLE_METRICS:
+            old, new = previous.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            change = new / old - 1
+            flag = "  REGRESSION" if change > tolerance else ""
+            regressions += bool(flag)
+            print(f"  cycle {current['cycle']} {metric:<16}{old:>12,.3f} -> {new:>12,.3f} ({change:+.1%}){flag}")
+    if baseline.get('config') != config:
+        print("  note: the baseline was recorded with a different configuration")
+    print(f"  {regressions} regression(s)")
+
+def bench_collector_cycle(args):
+    import data_collector
+    from vsphere_simulator import SimulatedFarm
+    farm = SimulatedFarm(latency=args.latency, parse_cost=args.parse_cost, hosts=args.hosts, vms_per_host=args.vms,
+                         datastores=args.datastores, nics_per_vm=args.nics, ips_per_nic=args.ips_per_nic)
+    sim = farm.sim   # Built up front, so cycle 1 doesn't pay for it
+    config = dict(farm.config, **farm.inventory, threads=data_collector.COLLECTOR_THREADS, changes=args.changes)
+    vm_refs = [(ip, mo_id) for ip, host in sim.hosts.items() for mo_id in host.vms]
+    print(f"\n{args.cycles} full collection cycles: {args.hosts} hosts x {args.vms} VMs, {args.datastores} datastores, "
+          f"{args.nics} NICs x {args.ips_per_nic} IPs, {args.latency * 1000:.1f} ms per SOAP call")
+    print(f"  {'cycle':<7}{'seconds':>9}{'SOAP calls':>12}{'hosts':>7}{'VM rows':>9}{'unchanged':>11}{'peak RSS MB':>13}")
+    cycles = []
+    original = data_collector.connect_host
+    data_collector.connect_host = farm
+    log = sys.stdout if args.log else open(os.devnull, "w")
+    try:
+        with temp_db():
+            db_manager.bulk_upsert_hosts([(ip, "root", "x", "bench") for ip in farm.host_ips()])
+            for n in range(args.cycles):
+                # Warm cycles: change some VMs so there is a delta to write
+                start = n * args.changes % len(vm_refs) if vm_refs and n else 0
+                for ip, mo_id in (vm_refs[start:start + args.changes] if n else []):
+                    sim.update_vm(ip, mo_id, summary__quickStats__guestMemoryUsage=100 + n)
+                sim.calls.clear()
+                cycle_start = datetime.now()
+                with contextlib.redirect_stdout(log):
+                    seconds, totals = timed(data_collector.update_all_hosts)
+                with db_manager.read_connection() as conn:
+                    hosts_written = conn.execute("SELECT COUNT(*) FROM host_metrics WHERE last_updated >= ?",
+                                                 (cycle_start.isoformat(" "),)).fetchone()[0]
+                cycle = {
+                    'cycle': n + 1,
+                    'wall_seconds': round(seconds, 4),
+                    'soap_calls': sim.total_calls(),
+                    'soap_calls_by_method': dict(sim.calls),
+                    'hosts_written': hosts_written,
+                    'vm_rows_written': totals['inserted'] + totals['updated'] + totals['deleted'],
+                    'vms_unchanged': totals['unchanged'],
+                    'peak_rss_mb': _peak_rss_mb(),
+                }
+                cycles.append(cycle)
+                print(f"  {n + 1:<7}{seconds:>9.3f}{cycle['soap_calls']:>12}{hosts_written:>7}"
+                      f"{cycle['vm_rows_written']:>9}{totals['unchanged']:>11}{cycle['peak_rss_mb'] or 0:>13.1f}")
+    finally:
+        if log is not sys.stdout:
+            log.close()
+        data_collector.connect_host = original
+        data_collector.SESSION_POOL.close_all()
+        db_manager.close_thread_connections()
+
+    # A cycle that collected nothing is fast for the wrong reason; don't record it
+    failed = [c['cycle'] for c in cycles if c['hosts_written'] < args.hosts]
+    if failed:
+        fail(f"cycle(s) {', '.join(map(str, failed))} did not write every host (run with --log 1 for the errors)")
+    if args.vms and not sum(c['vm_rows_written'] for c in cycles):
+        fail("no VM rows were written")
+
+    if args.baseline:
+        _compare_cycles(cycles, config, args.baseline, args.tolerance)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({'benchmark': "collector-cycle", 'recorded_at': datetime.now(timezone.utc).isoformat(),
+                       'python': sys.version.split()[0], 'config': config, 'cycles': cycles}, f, indent=2)
+        print(f"Saved results to {args.json}")
+
+# --- async-collector: hosts/minute as the farm grows, thread pool vs event loop ---
+
+def _peak_threads(fn):
+    """(seconds, result, most threads alive at once) for one call."""
+    peak, done = [threading.active_count()], threading.Event()
+
+    def sample():
+        while not done.wait(0.005):
+            peak.append(threading.active_count() - 1)
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        seconds, result = timed(fn)
+    finally:
+        done.set()
+        sampler.join()
+    return seconds, result, max(peak)
+
+def bench_async_collector(args):
+    import multiprocessing
+    import async_collector
+    import data_collector
+    import vsphere_simulator
+    # parse_cost only applies to the in-memory path; the asyncio path parses real XML
+    farm = vsphere_simulator.SimulatedFarm(latency=args.latency, page_size=args.page_size, parse_cost=args.parse_cost,
+                                           hosts=args.hosts, vms_per_host=args.vms)
+    # The SOAP endpoint gets its own process, so its XML serialization doesn't compete for our GIL
+    context = multiprocessing.get_context("spawn")
+    receiver, sender = context.Pipe(duplex=False)
+    server = context.Process(target=vsphere_simulator.run_soap_endpoint, args=(farm, sender), daemon=True)
+    server.start()
+    port = receiver.recv()
+    host_rows = [{'id': h + 1, 'ip': ip, 'username': "root", 'password': "x"} for h, ip in enumerate(farm.host_ips())]
+    counts = sorted({max(1, args.hosts * eighths // 8) for eighths in (1, 2, 4, 8)})
+    modes = [
+        (f"{args.threads} threads, pyVmomi (in-memory sim)",
+         lambda hosts: data_collector.collect_with_deadlines(hosts, threads=args.threads)[0]),
+        ("asyncio, SOAP over HTTP", lambda hosts: async_collector.collect_all(hosts)[0]),
+    ]
+    print(f"\n{args.vms} VMs per host, {args.latency * 1000:.1f} ms per SOAP call, {os.cpu_count()} CPUs "
+          f"(shared with the endpoint process); asyncio keeps up to {async_collector.ASYNC_MAX_CONNECTIONS} hosts in flight")
+    print(f"  {'hosts':<7}{'mode':<40}{'cold s':>8}{'warm s':>8}{'hosts/min':>11}{'threads':>9}{'failed':>8}")
+    original = (data_collector.connect_host, async_collector.host_endpoint)
+    farm.sim    # Build the in-memory inventory before the first timed cycle
+    data_collector.connect_host = farm
+    async_collector.host_endpoint = lambda ip: ("127.0.0.1", port, None)
+    log = sys.stdout if args.log else open(os.devnull, "w")
+    problems = []
+    try:
+        for count in counts:
+            for label, collect in modes:
+                with temp_db():
+                    with db_manager.connection() as conn:
+                        conn.executemany("INSERT INTO hosts (id, ip, username, password) "
+                                         "VALUES (:id, :ip, :username, :password)", host_rows[:count])
+                    with contextlib.redirect_stdout(log):
+                        # Cold: logins and full inserts; warm: reused sessions, unchanged VMs
+                        cold, cold_results = timed(collect, host_rows[:count])
+                        warm, warm_results, threads = _peak_threads(lambda: collect(host_rows[:count]))
+                    with db_manager.read_connection() as conn:
+                        vm_rows = conn.execute("SELECT count(*) FROM vms").fetchone()[0]
+                    data_collector.SESSION_POOL.close_all()
+                    async_collector.SESSIONS.clear()
+                    db_manager.close_thread_connections()
+                failed = max(sum(1 for r in results if r is None) for results in (cold_results, warm_results))
+                print(f"  {count:<7}{label:<40}{cold:>8.2f}{warm:>8.2f}{_rate(count, failed, warm)}{threads:>9}"
+                      f"{failed:>8}")
+                if failed:
+                    problems.append(f"{count} hosts, {label}: {failed} hosts failed")
+                elif vm_rows != count * args.vms:
+                    problems.append(f"{count} hosts, {label}: {vm_rows} VM rows stored, expected {count * args.vms}")
+    finally:
+        if log is not sys.stdout:
+            log.close()
+        data_collector.connect_host, async_collector.host_endpoint = original
+        server.terminate()
+    if problems:
+        fail("; ".join(problems) + " (run with --log 1 for the errors)")
+
+# --- metrics-history: a year of samples, rollup vs raw range queries ---
+
+def bench_metrics_history(args):
+    import random
+    import metrics_history
+    if args.quick:
+        args.hosts, args.days = 50, 90
+    rng = random.Random(42)
+    end = int(time.time()) // 86400 * 86400
+    start = end - args.days * 86400
+    steps = range(start, end, args.interval)
+    with temp_db():
+        # Ingest oldest first like the collector would, one batch per collection round
+        retention = metrics_history.RAW_RETENTION_SECONDS
+        metrics_history.RAW_RETENTION_SECONDS = args.days * 86400   # Keep raw rows to compare against
+        load = {host_id: rng.uniform(10, 80) for host_id in range(1, args.hosts + 1)}
+        t0 = time.perf_counter()
+        for ts in steps:
+            metrics_history.record_samples([
+                (host_id, ts, min(100, max(0, base + rng.gauss(0, 10))), base * 0.8, 55.0)
+                for host_id, base in load.items()
+            ], prune=False)
+        ingest = time.perf_counter() - t0
+        samples = len(steps) * args.hosts
+        with db_manager.read_connection() as conn:
+            tiers = conn.execute("SELECT tier, count(*) FROM metrics_rollup GROUP BY tier").fetchall()
+        report(f"Ingest ({args.hosts} hosts x {args.days} days every {args.interval}s)",
+               [("samples + rollups", samples, ingest)])
+        print("  rollup rows: " + ", ".join(f"{row[0]}s={row[1]:,}" for row in tiers))
+
+        print(f"\n  {'range (host 1)':<16}{'tier':>8}{'points':>8}{'rollup ms':>11}{'raw scan ms':>13}")
+        for label, days in (("1 day", 1), ("7 days", 7), ("30 days", 30), ("90 days", 90), ("365 days", 365)):
+            if days > args.days:
+                continue
+            q_start = end - days * 86400
+            tier = metrics_history.choose_tier(q_start, end, 500, now=end)
+            rollup_s, points = timed(metrics_history.query_range, 1, q_start, end, tier=tier, now=end)
+            bucket = tier or 1
+
+            def raw_scan():
+                with db_manager.read_connection() as conn:
+                    return conn.execute('''
+                        SELECT ts - ts % ? AS bucket, min(cpu_usage), avg(cpu_usage), max(cpu_usage),
+                               min(mem_usage), avg(mem_usage), max(mem_usage),
+                               min(storage_usage), avg(storage_usage), max(storage_usage)
+                        FROM metrics_raw WHERE host_id = 1 AND ts BETWEEN ? AND ? GROUP BY bucket
+                    ''', (bucket, q_start, end)).fetchall()
+            raw_s, _ = timed(raw_scan)
+            print(f"  {label:<16}{bucket:>8}{len(points):>8}{rollup_s * 1000:>11.2f}{raw_s * 1000:>13.2f}")
+
+        metrics_history.RAW_RETENTION_SECONDS = retention
+        prune_s, deleted = timed(metrics_history.prune_expired, end)
+        print(f"\n  retention prune: {deleted:,} rows deleted in {prune_s:.2f}s")
+        db_manager.close_thread_connections()
+
+# --- vm-search: Python-side filtering vs indexed search_vms ---
+
+def _python_search(query, by):
+    # Old fetch_all_vms: load every VM (with its joined IP string), then filter in Python
+    with db_manager.read_connection() as conn:
+        vms = conn.execute('''
+            SELECT v.*, h.ip as host_ip, group_concat(i.ip, ', ') AS ip
+            FROM vms v JOIN hosts h ON v.host_id = h.id LEFT JOIN vm_ips i ON i.vm_id = v.id
+            GROUP BY v.id
+        ''').fetchall()
+    if by == "Name":
+        return [dict(vm) for vm in vms if query.lower() in vm['name'].lower()]
+    return [dict(vm) for vm in vms if query in [ip.strip() for ip in (vm['ip'] or '').split(',')]]
+
+def bench_vm_search(args):
+    hosts = max(1, args.vms // 500)
+    with temp_db():
+        db_manager.bulk_upsert_hosts([(f"172.16.0.{h}", "root", "x", "g") for h in range(1, hosts + 1)])
+        for host_id in range(1, hosts + 1):
+            rows = _fake_vm_rows(host_id, args.vms // hosts)
+            # Every 10th VM gets a second NIC
+            rows = [row[:-2] + (row[-2] + (f"192.168.{i % 250}.{host_id % 250}",) if i % 10 == 0 else row[-2], row[-1])
+                    for i, row in enumerate(rows)]
+            db_manager.bulk_replace_vms(host_id, rows)
+        with db_manager.read_connection() as conn:
+            vm_count = conn.execute("SELECT count(*) FROM vms").fetchone()[0]
+            ip_count = conn.execute("SELECT count(*) FROM vm_ips").fetchone()[0]
+        print(f"\n{vm_count:,} VMs, {ip_count:,} vm_ips rows; mean of {args.repeat} runs")
+        print(f"  {'query':<32}{'matches':>9}{'python ms':>11}{'indexed ms':>12}")
+        for label, query, by in [
+            ("name substring 'vm-7-1'", "vm-7-1", "Name"),
+            ("name rare 'vm-99-42'", "vm-99-42", "Name"),
+            ("name short 'm-'", "m-", "Name"),
+            ("exact IP (primary)", "10.5.0.7", "IP"),
+            ("exact IP (second NIC)", "192.168.20.5", "IP"),
+            ("no match", "zzz-nothing", "Name"),
+        ]:
+            py = sum(timed(_python_search, query, by)[0] for _ in range(args.repeat)) / args.repeat
+            idx = 0.0
+            for _ in range(args.repeat):
+                seconds, (_, total) = timed(db_manager.search_vms, query, by)
+                idx += seconds / args.repeat
+            print(f"  {label:<32}{total:>9}{py * 1000:>11.2f}{idx * 1000:>12.2f}")
+        db_manager.close_thread_connections()
+
+# --- recent-vms: Python-side date filtering vs indexed range query ---
+
+def _python_recent(start_ts, end_ts):
+    # Old fetch_recent_vms: load every VM with a creation date, parse and filter in Python
+    with db_manager.read_connection() as conn:
+        vms = conn.execute('''
+            SELECT v.*, h.ip as host_ip, datetime(v.created_ts, 'unixepoch') AS created_date
+            FROM vms v JOIN hosts h ON v.host_id = h.id WHERE v.created_ts IS NOT NULL
+        ''').fetchall()
+    start, end = (datetime.fromtimestamp(ts, timezone.utc).replace(tzinfo=None) for ts in (start_ts, end_ts))
+    return [dict(vm) for vm in vms if start <= datetime.fromisoformat(vm['created_date']) <= end]
+
+def bench_recent_vms(args):
+    hosts = max(1, args.vms // 500)
+    with temp_db():
+        db_manager.bulk_upsert_hosts([(f"172.16.0.{h}", "root", "x", "g") for h in range(1, hosts + 1)])
+        for host_id in range(1, hosts + 1):
+            db_manager.bulk_replace_vms(host_id, _fake_vm_rows(host_id, args.vms // hosts))
+        now = int(datetime.now().timestamp())
+        print(f"\n{args.vms:,} VMs (created one per hour per host); mean of {args.repeat} runs")
+        print(f"  {'range':<24}{'matches':>9}{'python ms':>11}{'indexed ms':>12}")
+        for label, days in [("last day", 1), ("last 7 days", 7), ("last 30 days", 30), ("empty (future)", -1)]:
+            start_ts, end_ts = (now + 86400, now + 2 * 86400) if days < 0 else (now - days * 86400, now)
+            py = sum(timed(_python_recent, start_ts, end_ts)[0] for _ in range(args.repeat)) / args.repeat
+            idx = 0.0
+            for _ in range(args.repeat):
+                seconds, (_, total) = timed(db_manager.recent_vms, start_ts, end_ts)
+                idx += seconds / args.repeat
+            print(f"  {label:<24}{total:>9}{py * 1000:>11.2f}{idx * 1000:>12.2f}")
+        db_manager.close_thread_connections()
+
+# --- api-load: concurrent clients against the JSON read API ---
+
+def _api_client(base_url, paths, count, conditional, gzip_ok, results):
+    etags = {}
+    for i in range(count):
+        path = paths[i % len(paths)]
+        req = urllib.request.Request(base_url + path)
+        if gzip_ok:
+            req.add_header("Accept-Encoding", "gzip")
+        if conditional and path in etags:
+            req.add_header("If-None-Match", etags[path])
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req) as resp:
+                body = resp.read()
+                status = resp.status
+                etags[path] = resp.headers.get("ETag", "")
+        except urllib.error.HTTPError as e:
+            body, status = b"", e.code
+        results.append((time.perf_counter() - start, status, len(body)))
+
+def bench_api_load(args):
+    import logging
+    import api_server
+    from werkzeug.serving import make_server
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)   # No per-request access log
+    with temp_db():
+        db_manager.bulk_upsert_hosts([(f"172.16.0.{h}", "root", "x", "g") for h in range(1, args.hosts + 1)])
+        for host_id in range(1, args.hosts + 1):
+            db_manager.bulk_replace_vms(host_id, _fake_vm_rows(host_id, args.vms_per_host))
+        for i in range(4):
+            db_manager.add_subnet(f"10.99.{i}.0/24")
+        server = make_server("127.0.0.1", 0, api_server.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.server_port}"
+        paths = ["/api/hosts", "/api/hosts/172.16.0.1/vms?limit=100", "/api/vms?ip=10.2.0.7",
+                 "/api/vms?name=vm-3-1", "/api/subnets/10.99.1.0/24/free?limit=50"]
+        print(f"\n{args.clients} clients x {args.requests} requests over {len(paths)} endpoints "
+              f"({args.hosts} hosts, {args.hosts * args.vms_per_host:,} VMs)")
+        print(f"  {'mode':<28}{'req/sec':>10}{'p50 ms':>9}{'p95 ms':>9}{'304s':>7}{'KB/req':>9}")
+        try:
+            for label, conditional, gzip_ok in [
+                ("plain", False, False),
+                ("gzip", False, True),
+                ("gzip + If-None-Match", True, True),
+            ]:
+                results, threads = [], []
+                start = time.perf_counter()
+                for _ in range(args.clients):
+                    t = threading.Thread(target=_api_client,
+                                         args=(base_url, paths, args.requests, conditional, gzip_ok, results))
+                    t.start()
+                    threads.append(t)
+                for t in threads:
+                    t.join()
+                seconds = time.perf_counter() - start
+                latencies = sorted(r[0] for r in results)
+                not_modified = sum(1 for r in results if r[1] == 304)
+                kb = sum(r[2] for r in results) / len(results) / 1024
+                print(f"  {label:<28}{len(results) / seconds:>10,.0f}{latencies[len(latencies) // 2] * 1000:>9.2f}"
+                      f"{latencies[int(len(latencies) * 0.95)] * 1000:>9.2f}{not_modified:>7}{kb:>9.2f}")
+        finally:
+            server.shutdown()
+        db_manager.close_thread_connections()
+
+# --- ip-allocate: set-per-call free lists vs bitmap allocator ---
+
+def _python_free_ips(subnet):
+    # Old IP map: read the subnet's scan rows and VM IPs, build sets, diff
+    network = db_manager.parse_subnet(subnet)
+    with db_manager.read_connection() as conn:
+        rows = conn.execute("SELECT ip, status FROM network_scans WHERE ip BETWEEN ? AND ?",
+                            (int(network.network_address), int(network.broadcast_address))).fetchall()
+        vm_ips = {row['ip'] for row in conn.execute("SELECT ip FROM vm_ips")}
+    taken = {db_manager.int_to_ip(row['ip']) for row in rows if row['status'] == 'taken'} | vm_ips
+    return [ip for ip in map(str, network.hosts()) if ip not in taken]
+
+def bench_ip_allocate(args):
+    import ip_allocator
+    with temp_db():
+        subnets = [f"10.1.{i}.0/24" for i in range(min(args.subnets, 256))]
+        for subnet in subnets:
+            db_manager.add_subnet(subnet)
+        large = f"10.200.0.0/{args.large_prefix}"
+        db_manager.add_subnet(large)
+        now = datetime.now()
+        db_manager.bulk_upsert_scan_results([
+            (str(ip), "taken" if int(ip) % 3 == 0 else "free", now)
+            for subnet in subnets + [large] for ip in db_manager.parse_subnet(subnet)
+        ])
+        db_manager.bulk_upsert_hosts([("172.16.0.1", "root", "x", "g")])
+        db_manager.bulk_replace_vms(1, _fake_vm_rows(1, args.vms))   # VM IPs 10.1.0.0 upwards
+        target = subnets[min(1, len(subnets) - 1)]
+
+        print(f"\n{len(subnets)} /24 subnets plus {large}, {args.vms:,} VM IPs; free-list lookups")
+        for subnet in (target, large):
+            for label, fn in [("python sets (old IP map)", _python_free_ips), ("bitmap + indexed vm_ips", ip_allocator.free_ips)]:
+                seconds = sum(timed(fn, subnet)[0] for _ in range(args.repeat)) / args.repeat
+                print(f"  {subnet:<16}{label:<28}{len(fn(subnet)):>7} free{seconds * 1000:>10.3f} ms")
+            seconds, ips = timed(ip_allocator.allocate, subnet, 16, "bench")
+            print(f"  {subnet:<16}{'allocate(16)':<28}{len(ips):>7} ips {seconds * 1000:>10.3f} ms")
+
+        per_thread = args.allocations // args.threads
+        allocated, threads = [], []
+
+        def worker():
+            for i in range(per_thread):
+                ips = ip_allocator.allocate(subnets[i % len(subnets)], 1, owner="bench")
+                if ips:
+                    allocated.extend(ips)
+            db_manager.close_thread_connections()
+
+        start = time.perf_counter()
+        for _ in range(args.threads):
+            t = threading.Thread(target=worker)
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+        seconds = time.perf_counter() - start
+        print(f"\n{args.threads} threads allocating concurrently")
+        print(f"  {len(allocated)} of {per_thread * args.threads} requests reserved an IP in {seconds:.2f}s "
+              f"({per_thread * args.threads / seconds:,.0f} requests/sec), {len(allocated) - len(set(allocated))} duplicates")
+        db_manager.close_thread_connections()
+
+BENCHMARKS = {
+    "bulk-writes": (bench_bulk_writes, [
+        ("--vms", 10000, "total VM rows per snapshot"),
+        ("--hosts", 100, "hosts the VMs are spread over"),
+        ("--subnets", 64, "/24 subnets of scan results"),
+        ("--host-configs", 2000, "host config rows to sync"),
+    ]),
+    "db-concurrency": (bench_db_concurrency, [
+        ("--writers", 8, "writer threads (one host each)"),
+        ("--readers", 8, "reader threads running the dashboard join"),
+        ("--writes", 50, "snapshots written per writer"),
+        ("--vms-per-write", 200, "VM rows per snapshot"),
+    ]),
+    "change-stream": (bench_change_stream, [
+        ("--vms", 2000, "VMs on the simulated host"),
+        ("--changes", 20, "VMs modified between rounds"),
+        ("--rounds", 5, "update rounds to average over"),
+        ("--latency", 0.0, "simulated seconds per SOAP round trip"),
+    ]),
+    "host-fetch": (bench_host_fetch, [
+        ("--vms", 300, "VMs on the simulated host"),
+        ("--page-size", 100, "objects per RetrievePropertiesEx page"),
+    ]),
+    "collector-pool": (bench_collector_pool, [
+        ("--hosts", 100, "simulated hosts"),
+        ("--vms", 100, "VMs per host"),
+        ("--latency", 0.002, "seconds per simulated SOAP call"),
+        ("--parse-cost", 0.00005, "CPU seconds per returned object (SOAP parsing stand-in)"),
+        ("--processes", 4, "largest worker process count to try"),
+        ("--threads", 8, "collector threads in total per mode"),
+        ("--log", 0, "1 prints the collector's per-host log lines"),
+    ]),
+    "collector-cycle": (bench_collector_cycle, [
+        ("--hosts", 50, "simulated hosts"),
+        ("--vms", 200, "VMs per host"),
+        ("--datastores", 4, "datastores per host"),
+        ("--nics", 2, "NICs per VM"),
+        ("--ips-per-nic", 2, "IPv4 addresses per NIC"),
+        ("--latency", 0.001, "seconds per simulated SOAP call"),
+        ("--parse-cost", 0.0, "CPU seconds per returned object (SOAP parsing stand-in)"),
+        ("--cycles", 3, "full collection cycles (the first one inserts everything)"),
+        ("--changes", 100, "VMs modified before each later cycle"),
+        ("--json", "", "write the results to this JSON file"),
+        ("--baseline", "", "JSON file of an earlier run to compare against"),
+        ("--tolerance", 0.10, "relative increase reported as a regression"),
+        ("--log", 0, "1 prints the collector's per-host log lines"),
+    ]),
+    "async-collector": (bench_async_collector, [
+        ("--hosts", 400, "simulated hosts at the largest step (runs 1/8, 1/4, 1/2 and all of them)"),
+        ("--vms", 50, "VMs per host"),
+        ("--latency", 0.02, "seconds per SOAP call"),
+        ("--page-size", 100, "objects per RetrievePropertiesEx page"),
+        ("--parse-cost", 0.00005, "CPU seconds per object in the in-memory pyVmomi path (SOAP parsing stand-in)"),
+        ("--threads", 10, "collector threads of the pyVmomi thread pool"),
+        ("--log", 0, "1 prints the collectors' per-host log lines"),
+    ]),
+    "metrics-history": (bench_metrics_history, [
+        ("--hosts", 500, "hosts sampled"),
+        ("--days", 365, "days of history"),
+        ("--interval", 3600, "seconds between samples per host"),
+        ("--quick", 0, "1 samples 50 hosts x 90 days instead (seconds, not minutes; no year-long range)"),
+    ]),
+    "vm-search": (bench_vm_search, [
+        ("--vms", 50000, "VM rows in the inventory"),
+        ("--repeat", 5, "runs per query"),
+    ]),
+    "api-load": (bench_api_load, [
+        ("--clients", 8, "concurrent client threads"),
+        ("--requests", 200, "requests per client"),
+        ("--hosts", 20, "hosts in the DB"),
+        ("--vms-per-host", 500, "VMs per host"),
+    ]),
+    "ip-allocate": (bench_ip_allocate, [
+        ("--subnets", 64, "/24 subnets with scan results"),
+        ("--large-prefix", 16, "prefix length of one extra large subnet"),
+        ("--vms", 300, "VMs reporting IPs (10.1.0.0 upwards)"),
+        ("--threads", 8, "concurrent allocating threads"),
+        ("--allocations", 2000, "reservations to make in total"),
+        ("--repeat", 20, "runs per free-list lookup"),
+    ]),
+    "recent-vms": (bench_recent_vms, [
+        ("--vms", 50000, "VM rows in the inventory"),
+        ("--repeat", 5, "runs per query"),
+    ]),
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="ESXi monitor micro-benchmarks")
+    sub = parser.add_subparsers(dest="benchmark", required=True)
+    for name, (_, options) in BENCHMARKS.items():
+        p = sub.add_parser(name)
+        for flag, default, help_text in options:
+            p.add_argument(flag, type=type(default), default=default, help=help_text)
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark][0](args)
+
+if __name__ == "__main__":
+    main()
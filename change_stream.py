@@ -0,0 +1,181 @@
+import threading
+from datetime import datetime
+from pyVim import connect
+from pyVmomi import vim, vmodl
+import data_collector
+import db_manager
+
+# --- Change-Stream Collector ---
+# Long-lived alternative to the periodic full pull in data_collector.collect_host_data.
+# Per host we create our own PropertyCollector with one filter (VMs, the HostSystem
+# and its datastores) once, then loop on WaitForUpdatesEx with the returned version.
+# vCenter/ESXi only sends property deltas, and only the VMs that changed are written
+# back to the DB. The first batch after (re)connecting is the full inventory and is
+# applied as a full sync.
+
+STREAM_MAX_WAIT_SECONDS = 30      # Long-poll duration of one WaitForUpdatesEx call
+STREAM_MAX_OBJECT_UPDATES = 500   # Objects per update batch (larger sets are truncated)
+STREAM_RECONNECT_DELAY = 30       # Seconds before retrying a failed/broken stream
+
+
+class HostChangeStream:
+    """WaitForUpdatesEx session for one host, with an in-memory property cache."""
+
+    def __init__(self, host_row, si):
+        self.host_id = host_row['id']
+        self.ip = host_row['ip']
+        self.si = si
+        self.version = ''
+        self.collector = None
+        self.views = []
+        self.objects = {}        # moId -> {'type', 'obj', 'props'}
+        self.vm_keys = {}        # VM moId -> vm_uuid used in the DB
+        self.dirty_vms = set()
+        self.removed_vm_keys = set()
+        self.host_dirty = False
+        self.synced = False      # First flush replaces the host's rows wholesale
+        self.cached_ips = {}
+        self.legacy_ips = {}
+
+    def start(self):
+        content = self.si.RetrieveContent()
+        vm_view = content.viewManager.CreateContainerView(content.rootFolder, [vim.VirtualMachine], True)
+        host_view = content.viewManager.CreateContainerView(content.rootFolder, [vim.HostSystem], True)
+        self.views = [vm_view, host_view]
+        self.collector = content.propertyCollector.CreatePropertyCollector()
+        # Whole values per changed property; no indexed array sub-paths to merge
+        self.collector.CreateFilter(data_collector._build_inventory_filter_spec(vm_view, host_view), partialUpdates=False)
+        self.cached_ips, self.legacy_ips = data_collector.load_cached_ips(self.host_id)
+
+    def stop(self):
+        for cleanup in [self.collector.DestroyPropertyCollector if self.collector else None] + [v.Destroy for v in self.views]:
+            try:
+                if cleanup:
+                    cleanup()
+            except Exception:
+                pass
+        self.collector = None
+        self.views = []
+
+    def poll(self, max_wait_seconds=STREAM_MAX_WAIT_SECONDS):
+        """Waits for the next batch of updates and applies it to the cache.
+        Returns True if anything changed."""
+        options = vmodl.query.PropertyCollector.WaitOptions()
+        options.maxWaitSeconds = max_wait_seconds
+        options.maxObjectUpdates = STREAM_MAX_OBJECT_UPDATES
+        changed = False
+        while True:
+            update_set = self.collector.WaitForUpdatesEx(self.version, options)
+            if update_set is None:   # Timed out without changes
+                return changed
+            self.version = update_set.version
+            for filter_update in update_set.filterSet:
+                for obj_update in filter_update.objectSet:
+                    self._apply(obj_update)
+                    changed = True
+            if not update_set.truncated:
+                return changed
+
+    def _apply(self, obj_update):
+        mo = obj_update.obj
+        type_name = data_collector.managed_object_type(mo)
+        if obj_update.kind == 'leave':
+            self.objects.pop(mo._moId, None)
+            if type_name == 'VirtualMachine':
+                self.dirty_vms.discard(mo._moId)
+                key = self.vm_keys.pop(mo._moId, None)
+                if key:
+                    self.removed_vm_keys.add(key)
+            else:
+                self.host_dirty = True
+            return
+
+        entry = self.objects.setdefault(mo._moId, {'type': type_name, 'obj': mo, 'props': {}})
+        for change in obj_update.changeSet:
+            if change.op in ('remove', 'indirectRemove'):
+                entry['props'].pop(change.name, None)
+            else:
+                entry['props'][change.name] = change.val
+        if type_name == 'VirtualMachine':
+            self.dirty_vms.add(mo._moId)
+        else:
+            self.host_dirty = True
+
+    def _vm_row(self, mo_id):
+        entry = self.objects[mo_id]
+        key = self.vm_keys.get(mo_id)
+        if key is None:
+            key = data_collector.vm_identity(entry['obj'], entry['props'], set(self.vm_keys.values()))
+            self.vm_keys[mo_id] = key
+            self.removed_vm_keys.discard(key)
+        cached_ips = self.cached_ips.get(key) or self.legacy_ips.get(entry['props'].get("summary.config.name", "Unknown"), ())
+        row = data_collector.build_vm_row(self.host_id, key, entry['props'], cached_ips)
+        self.cached_ips[key] = row[-2]
+        return row
+
+    def flush(self):
+        """Writes pending deltas in one transaction. Returns the VM change counts."""
+        vm_rows = [self._vm_row(mo_id) for mo_id in sorted(self.dirty_vms)]
+        metrics_row = None
+        if self.host_dirty:
+            host_props = next((e['props'] for e in self.objects.values() if e['type'] == 'HostSystem'), None)
+            if host_props:
+                datastores = [e['props'] for e in self.objects.values() if e['type'] == 'Datastore']
+                metrics_row = data_collector.build_host_metrics_row(self.host_id, host_props, datastores)
+
+        with db_manager.connection(bump_generation=True) as conn:
+            if metrics_row:
+                data_collector.write_host_metrics(conn, metrics_row)
+            if not self.synced:
+                vm_rows = [self._vm_row(mo_id) for mo_id, e in self.objects.items() if e['type'] == 'VirtualMachine']
+                changes = db_manager.sync_vms(self.host_id, vm_rows, conn=conn)
+            else:
+                changes = db_manager.apply_vm_delta(self.host_id, vm_rows, self.removed_vm_keys, conn=conn)
+
+        self.synced = True
+        self.dirty_vms.clear()
+        self.removed_vm_keys.clear()
+        self.host_dirty = False
+        if any(changes.get(k) for k in ('inserted', 'updated', 'deleted')) or metrics_row:
+            print(f"[{datetime.now()}] Stream {self.ip}: {changes.get('inserted', 0)} VMs added, "
+                  f"{changes.get('updated', 0)} changed, {changes.get('deleted', 0)} removed"
+                  f"{', host metrics updated' if metrics_row else ''}")
+        return changes
+
+
+def stream_host(host_row, stop_event, max_wait_seconds=STREAM_MAX_WAIT_SECONDS):
+    """Runs one host's change stream until `stop_event` is set, reconnecting on errors."""
+    ip = host_row['ip']
+    while not stop_event.is_set():
+        si = data_collector.connect_host(ip, host_row['username'], host_row['password'])
+        if not si:
+            stop_event.wait(STREAM_RECONNECT_DELAY)
+            continue
+        stream = HostChangeStream(host_row, si)
+        try:
+            stream.start()
+            print(f"Change stream started for host {ip}")
+            while not stop_event.is_set():
+                if stream.poll(max_wait_seconds):
+                    stream.flush()
+        except Exception as e:
+            print(f"Change stream for host {ip} failed: {e}. Reconnecting in {STREAM_RECONNECT_DELAY}s.")
+            stop_event.wait(STREAM_RECONNECT_DELAY)
+        finally:
+            stream.stop()
+            connect.Disconnect(si)
+            db_manager.close_thread_connections()
+
+
+def run_change_streams(stop_event=None, max_wait_seconds=STREAM_MAX_WAIT_SECONDS):
+    """Starts one change-stream thread per host in the DB. Returns (threads, stop_event)."""
+    stop_event = stop_event or threading.Event()
+    with db_manager.read_connection() as conn:
+        hosts = conn.execute("SELECT * FROM hosts").fetchall()
+    threads = []
+    for host_row in hosts:
+        t = threading.Thread(target=stream_host, args=(host_row, stop_event, max_wait_seconds),
+                             name=f"stream-{host_row['ip']}", daemon=True)
+        t.start()
+        threads.append(t)
+    return threads, stop_event
@@ -0,0 +1,196 @@
+import atexit
+import multiprocessing
+import queue
+import threading
+import time
+import zlib
+import data_collector
+import db_manager
+import telemetry
+
+# --- Multi-Process Collector ---
+# With hundreds of hosts the SOAP deserialization in pyVmomi and the per-VM row
+# building are CPU-bound, and one process's threads take turns on the GIL.
+#   - hosts are sharded over long-lived worker processes by a stable hash of their
+#     IP, so a host always lands on the same worker and keeps its pooled session
+#   - each worker runs data_collector.fetch_host_data on its own thread pool and
+#     never writes to the DB
+#   - results come back as plain tuples, WRITER_BATCH_HOSTS hosts per message, and
+#     the parent is the only writer: one transaction per batch, so workers never
+#     contend for the SQLite write lock
+#   - each message also carries the worker's telemetry since the last one, merged
+#     into the parent's so /metrics and last_cycle_stats cover every process
+#   - every host gets data_collector.HOST_DEADLINE_SECONDS inside its worker; a
+#     worker still busy at CYCLE_DEADLINE_SECONDS is killed and restarted, which
+#     (unlike a thread) really cancels whatever it was stuck on
+# Workers are spawned (not forked), so nothing of the parent's threads, sessions
+# or DB connections leaks into them.
+
+WRITER_BATCH_HOSTS = 8          # Hosts per result message / write transaction
+WORKER_POLL_SECONDS = 1.0       # How often the writer checks for dead workers
+
+
+def shard_of(ip, shards):
+    """Worker index of a host; stable across cycles and processes."""
+    return zlib.crc32(ip.encode()) % shards
+
+
+def _collect_one(host, deadline):
+    """Worker side: (ip, fetched or None) for one host, errors logged like collect_host_data."""
+    print(f"Collecting data for host: {host['ip']}")
+    try:
+        fetched = data_collector.fetch_host_data(host, deadline)
+        if fetched is None:
+            print(f"Skipping {host['ip']} due to connection failure.")
+            telemetry.incr('host_failures', host['ip'])
+        return host['ip'], fetched
+    except Exception as e:
+        print(f"Error collecting data for host {host['ip']}: {e}")
+        telemetry.incr('host_failures', host['ip'])
+        return host['ip'], None
+
+
+def _worker_main(index, tasks, results, threads, db_file, connect):
+    db_manager.DB_FILE = db_file    # Cached-IP lookups read the same DB as the parent
+    if connect is not None:
+        data_collector.connect_host = connect
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        cycle, hosts = task
+        lock = threading.Lock()
+        state = {'batch': []}
+
+        def collect(host, deadline):
+            result = _collect_one(host, deadline)
+            if time.monotonic() > deadline:
+                result = (host['ip'], None)    # Late: already reported as timed out
+            with lock:
+                state['batch'].append(result)
+                if len(state['batch']) >= WRITER_BATCH_HOSTS:
+                    full, state['batch'] = state['batch'], []
+                    results.put(('batch', index, cycle, (full, telemetry.take_pending())))
+
+        _, timed_out = data_collector.collect_with_deadlines(hosts, collect, threads)
+        with lock:
+            full, state['batch'] = state['batch'], []
+        results.put(('batch', index, cycle, (full, telemetry.take_pending())))
+        results.put(('done', index, cycle, (data_collector.SESSION_POOL.take_saved_seconds(), timed_out)))
+    data_collector.SESSION_POOL.close_all()
+    db_manager.close_thread_connections()
+
+
+class CollectorPool:
+    """Long-lived collector worker processes feeding a single DB writer (the caller).
+
+    `connect` replaces data_collector.connect_host inside the workers (it must be
+    picklable, e.g. a module-level function); benchmarks use it to point the
+    workers at a simulated vSphere.
+    """
+
+    def __init__(self, processes, threads=data_collector.COLLECTOR_THREADS, connect=None):
+        self.processes = processes
+        self.threads = threads
+        self.connect = connect
+        self._context = multiprocessing.get_context("spawn")
+        self._results = self._context.Queue()
+        self._workers = [None] * processes
+        self._cycle = 0
+        self._lock = threading.Lock()     # One cycle at a time
+        for index in range(processes):
+            self._start_worker(index)
+
+    def _start_worker(self, index):
+        tasks = self._context.Queue()
+        process = self._context.Process(
+            target=_worker_main, name=f"collector-{index}", daemon=True,
+            args=(index, tasks, self._results, self.threads, db_manager.DB_FILE, self.connect)
+        )
+        process.start()
+        self._workers[index] = (process, tasks)
+
+    def collect(self, hosts, progress_callback=None):
+        """Collects all hosts and writes them from this process.
+
+        Returns ([VM change counts or None per host, in `hosts` order], connect
+        seconds saved by session reuse across all workers, {ip: reason} of the
+        hosts that timed out). `progress_callback(done, total)` is called after
+        each written batch.
+        """
+        hosts = [dict(host) for host in hosts]   # sqlite3.Row doesn't pickle
+        shards = [[] for _ in range(self.processes)]
+        for host in hosts:
+            shards[shard_of(host['ip'], self.processes)].append(host)
+
+        with self._lock:
+            self._cycle += 1
+            cycle = self._cycle
+            pending = set()
+            for index, shard in enumerate(shards):
+                if not shard:
+                    continue
+                if not self._workers[index][0].is_alive():
+                    print(f"Collector worker {index} exited, restarting it")
+                    self._start_worker(index)
+                self._workers[index][1].put((cycle, shard))
+                pending.add(index)
+
+            changes = {}
+            saved_seconds = 0.0
+            timed_out = {}
+            reported = 0
+            # Workers enforce the deadlines themselves; this only catches a wedged worker
+            deadline = time.monotonic() + data_collector.CYCLE_DEADLINE_SECONDS + data_collector.HOST_DEADLINE_SECONDS
+            while pending:
+                try:
+                    kind, index, message_cycle, payload = self._results.get(timeout=WORKER_POLL_SECONDS)
+                except queue.Empty:
+                    for index in [i for i in pending if not self._workers[i][0].is_alive()]:
+                        print(f"Collector worker {index} died mid-cycle; its remaining hosts count as failed")
+                        pending.discard(index)
+                    if time.monotonic() > deadline:
+                        for index in list(pending):
+                            print(f"Collector worker {index} is past the cycle deadline, restarting it")
+                            self._workers[index][0].terminate()
+                            self._start_worker(index)
+                            timed_out.update((host['ip'], "worker restarted at the cycle deadline")
+                                             for host in shards[index] if host['ip'] not in changes)
+                        pending.clear()
+                    continue
+                if message_cycle != cycle:
+                    continue     # Late message from a cycle that lost its worker
+                if kind == 'done':
+                    saved_seconds += payload[0]
+                    timed_out.update(payload[1])
+                    pending.discard(index)
+                    continue
+                batch, stats = payload
+                telemetry.merge(stats)
+                changes.update(data_collector.store_host_batch(batch))
+                reported += len(batch)
+                if progress_callback:
+                    progress_callback(min(reported, len(hosts)), len(hosts))
+
+        return [changes.get(host['ip']) for host in hosts], saved_seconds, timed_out
+
+    def close(self):
+        for process, tasks in self._workers:
+            if process.is_alive():
+                tasks.put(None)
+        for process, _ in self._workers:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+
+
+_shared = None
+
+
+def shared_pool():
+    """The process-wide pool used by data_collector.update_all_hosts."""
+    global _shared
+    if _shared is None:
+        _shared = CollectorPool(data_collector.COLLECTOR_PROCESSES, data_collector.COLLECTOR_THREADS)
+        atexit.register(_shared.close)
+    return _shared
@@ -0,0 +1,110 @@
+import functools
+import threading
+import time
+from collections import OrderedDict
+import db_manager
+
+# --- Dashboard Data Cache ---
+# Streamlit reruns the whole script on every click, toggle and keystroke, and each
+# rerun used to re-run every dashboard query. Results are cached process-wide (all
+# sessions share them) and tagged with the collection generation they were read at.
+# Writers of collected data bump the generation when they commit (see
+# db_manager.connection), so an entry stays valid until new data actually lands. The generation itself is
+# re-read at most every GENERATION_TTL_SECONDS, which bounds both the staleness and
+# the per-rerun DB cost to one single-row read.
+# RENDER_CACHE holds pure renders (e.g. HTML built from a scan status array) whose
+# arguments fully determine the result; those ignore the generation.
+
+MAX_ENTRIES = 256               # LRU bound across all cached fetchers
+GENERATION_TTL_SECONDS = 2.0
+MAX_AGE_SECONDS = 600           # Safety net for writes that skip the generation bump
+MAX_RENDER_ENTRIES = 128
+
+
+class GenerationCache:
+    """LRU cache of fetcher results keyed on (function, args), valid for one generation."""
+
+    def __init__(self, max_entries=MAX_ENTRIES, clock=time.monotonic, track_generation=True):
+        self.max_entries = max_entries
+        self.clock = clock
+        self.track_generation = track_generation
+        self._entries = OrderedDict()     # key -> (generation, stored_at, value)
+        self._lock = threading.Lock()
+        self._generation = None
+        self._generation_checked = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def generation(self):
+        if not self.track_generation:
+            return 0
+        now = self.clock()
+        if self._generation is None or now - self._generation_checked >= GENERATION_TTL_SECONDS:
+            self._generation = db_manager.get_generation()
+            self._generation_checked = now
+        return self._generation
+
+    def get_or_load(self, key, load):
+        generation = self.generation()
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] == generation and now - entry[1] < MAX_AGE_SECONDS:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+        # Load outside the lock; two concurrent misses on one key both query, which is harmless
+        value = load()
+        with self._lock:
+            self._entries[key] = (generation, now, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        """Drops every entry and forces a generation re-read (e.g. right after a UI write)."""
+        with self._lock:
+            self._entries.clear()
+            self._generation = None
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'generation': self._generation,
+            }
+
+
+CACHE = GenerationCache()
+RENDER_CACHE = GenerationCache(MAX_RENDER_ENTRIES, track_generation=False)
+
+
+def cached(fn):
+    """Caches `fn(*args, **kwargs)` in CACHE. Results are shared: callers must not mutate them."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        key = (fn.__qualname__, args, tuple(sorted(kwargs.items())))
+        return CACHE.get_or_load(key, lambda: fn(*args, **kwargs))
+    return wrapper
+
+
+def memoized(fn):
+    """Caches a pure `fn(*args)` in RENDER_CACHE, keyed on its arguments only."""
+    @functools.wraps(fn)
+    def wrapper(*args):
+        return RENDER_CACHE.get_or_load((fn.__qualname__, args), lambda: fn(*args))
+    return wrapper
+
+
+def cache_stats():
+    return CACHE.stats()
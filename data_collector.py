@@ -1,13 +1,19 @@
+import asyncio
 import ssl
 import re
 import platform
 import subprocess
-from concurrent.futures import ThreadPoolExecutor
-from datetime import datetime
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from datetime import datetime, timedelta
 import requests
 from pyVim import connect
 from pyVmomi import vim, vmodl
 import db_manager
+import icmp_scanner
+import metrics_history
+import session_pool
+import telemetry
 
 # Disable SSL warnings
 requests.packages.urllib3.disable_warnings()
@@ -42,233 +48,375 @@ def format_guest_id(guest_id):
     
     return f"{guest_id.capitalize()}{bitness}"
 
+# --- Timeouts and Deadlines ---
+# A black-holed host or a login that never returns must not hold up a cycle:
+#   - every SOAP request (including the TCP connect and login) gives up after
+#     HOST_SOCKET_TIMEOUT_SECONDS without data
+#   - one host's whole collection gets HOST_DEADLINE_SECONDS; past that the cycle
+#     stops waiting for it, drops its session and discards whatever it returns late
+#   - hosts still queued when CYCLE_DEADLINE_SECONDS runs out are not started
+HOST_SOCKET_TIMEOUT_SECONDS = 30
+HOST_DEADLINE_SECONDS = 180
+CYCLE_DEADLINE_SECONDS = 1800
+DEADLINE_POLL_SECONDS = 1.0
+
+class HostTimeout(Exception):
+    """A host's collection ran past its deadline."""
+
+def check_deadline(deadline, ip, step):
+    if deadline is not None and time.monotonic() > deadline:
+        raise HostTimeout(f"{ip} exceeded its {HOST_DEADLINE_SECONDS}s budget before {step}")
+
 def connect_host(host, user, password):
     """Establishes a connection to an ESXi host."""
     context = None
     if hasattr(ssl, '_create_unverified_context'):
         context = ssl._create_unverified_context()
     try:
-        si = connect.SmartConnect(host=host, user=user, pwd=password, sslContext=context, disableSslCertValidation=True)
+        si = connect.SmartConnect(host=host, user=user, pwd=password, sslContext=context, disableSslCertValidation=True,
+                                  httpConnectionTimeout=HOST_SOCKET_TIMEOUT_SECONDS)
         return si
     except Exception as e:
         print(f"Failed to connect to {host}: {e}")
         return None
 
-def _build_property_collector_spec(view_ref, property_list):
-    """Builds a PropertySpec for the PropertyCollector."""
-    obj_spec = vmodl.query.PropertyCollector.ObjectSpec()
-    obj_spec.obj = view_ref
-    obj_spec.skip = True
-
-    traversal_spec = vmodl.query.PropertyCollector.TraversalSpec()
-    traversal_spec.name = 'traverseEntities'
-    traversal_spec.path = 'view'
-    traversal_spec.skip = False
-    traversal_spec.type = vim.view.ContainerView
-
-    obj_spec.selectSet = [traversal_spec]
+# Sessions survive between collection cycles; looked up through connect_host at
+# login time so tests and benchmarks can swap in a fake connector.
+SESSION_POOL = session_pool.SessionPool(lambda host, user, password: connect_host(host, user, password))
+
+def managed_object_type(obj):
+    """vSphere type name of a managed object reference, e.g. 'VirtualMachine'."""
+    return getattr(obj, '_wsdlName', None) or type(obj).__name__
+
+def _build_inventory_filter_spec(vm_view, host_view):
+    """FilterSpec covering the VMs of `vm_view`, the HostSystem of `host_view` and,
+    through HostSystem.datastore, that host's datastores."""
+    pc = vmodl.query.PropertyCollector
+    host_to_datastore = pc.TraversalSpec(name='hostToDatastore', type=vim.HostSystem, path='datastore', skip=False)
+    vm_spec = pc.ObjectSpec(obj=vm_view, skip=True, selectSet=[
+        pc.TraversalSpec(name='traverseVms', type=vim.view.ContainerView, path='view', skip=False)
+    ])
+    host_spec = pc.ObjectSpec(obj=host_view, skip=True, selectSet=[
+        pc.TraversalSpec(name='traverseHosts', type=vim.view.ContainerView, path='view', skip=False,
+                         selectSet=[host_to_datastore])
+    ])
+    return pc.FilterSpec(objectSet=[vm_spec, host_spec], propSet=[
+        pc.PropertySpec(type=vim.VirtualMachine, pathSet=VM_PROPERTIES),
+        pc.PropertySpec(type=vim.HostSystem, pathSet=HOST_PROPERTIES),
+        pc.PropertySpec(type=vim.Datastore, pathSet=DATASTORE_PROPERTIES),
+    ])
 
-    prop_spec = vmodl.query.PropertyCollector.PropertySpec()
-    prop_spec.type = vim.VirtualMachine
-    prop_spec.pathSet = property_list
+# --- Data Collection Logic ---
 
-    filter_spec = vmodl.query.PropertyCollector.FilterSpec()
-    filter_spec.objectSet = [obj_spec]
-    filter_spec.propSet = [prop_spec]
+VM_PROPERTIES = [
+    "name", "summary.config.name", "summary.guest.guestFullName", "summary.guest.guestId",
+    "config.guestFullName", "config.guestId",
+    "summary.guest.ipAddress", "guest.net", "summary.config.memorySizeMB", "summary.quickStats.guestMemoryUsage",
+    "summary.config.numCpu", "config.hardware.device", "config.createDate", "runtime.powerState",
+    "config.instanceUuid"
+]
+HOST_PROPERTIES = [
+    "summary.quickStats.overallCpuUsage", "summary.quickStats.overallMemoryUsage",
+    "summary.hardware.cpuMhz", "summary.hardware.numCpuThreads", "summary.hardware.memorySize"
+]
+DATASTORE_PROPERTIES = ["summary.capacity", "summary.freeSpace"]
+
+def build_host_metrics_row(host_id, host_props, datastores):
+    """Builds a host_metrics row from HOST_PROPERTIES values and a list of
+    DATASTORE_PROPERTIES dicts (one per datastore)."""
+    used_cpu_mhz = host_props.get("summary.quickStats.overallCpuUsage") or 0
+    total_cpu_mhz = (host_props.get("summary.hardware.cpuMhz") or 0) * (host_props.get("summary.hardware.numCpuThreads") or 0)
+    cpu_usage = round((used_cpu_mhz / total_cpu_mhz) * 100, 2) if total_cpu_mhz > 0 else 0
+    
+    total_memory_gb = round((host_props.get("summary.hardware.memorySize") or 0) / (1024**3), 2)
+    used_memory_gb = round((host_props.get("summary.quickStats.overallMemoryUsage") or 0) / 1024, 2)
+    mem_usage = round((used_memory_gb / total_memory_gb) * 100, 2) if total_memory_gb > 0 else 0
+
+    total_storage_bytes = sum(ds.get("summary.capacity") or 0 for ds in datastores)
+    free_storage_bytes = sum(ds.get("summary.freeSpace") or 0 for ds in datastores)
+    total_storage_gb = round(total_storage_bytes / (1024**3), 2)
+    used_storage_gb = round((total_storage_bytes - free_storage_bytes) / (1024**3), 2)
+    storage_usage = round((used_storage_gb / total_storage_gb) * 100, 2) if total_storage_gb > 0 else 0
+
+    return (
+        host_id, cpu_usage, round(used_cpu_mhz / 1000, 2), round(total_cpu_mhz / 1000, 2),
+        mem_usage, used_memory_gb, total_memory_gb,
+        storage_usage, used_storage_gb, total_storage_gb, datetime.now()
+    )
+
+def vm_identity(obj, vm_props, seen_keys):
+    """Stable identity: instanceUuid, or the moref if missing/duplicated (copied VMs)."""
+    vm_key = vm_props.get("config.instanceUuid")
+    if not vm_key or vm_key in seen_keys:
+        vm_key = f"moref:{obj._moId}"
+    seen_keys.add(vm_key)
+    return vm_key
+
+def is_virtual_disk(device):
+    """True for a VirtualDisk device, as a pyVmomi object or a parsed SOAP value
+    (async_collector.py), which carries its xsi:type as _wsdlName."""
+    return isinstance(device, vim.vm.device.VirtualDisk) or getattr(device, '_wsdlName', None) == 'VirtualDisk'
+
+def build_vm_row(host_id, vm_key, vm_props, cached_ips=()):
+    """Builds a VM row (db_manager.VM_ROW_FIELDS order) from VM_PROPERTIES values.
+
+    `cached_ips` are the last known IPs, kept when a powered-off VM reports none.
+    """
+    config_name = vm_props.get("summary.config.name", "Unknown")
+    
+    # Guest OS Resolution Priority:
+    # 1. summary.guest.guestFullName (Tools reported, most accurate)
+    # 2. config.guestFullName (Configured in VM Settings)
+    guest_full_name = vm_props.get("summary.guest.guestFullName")
+    if not guest_full_name:
+        guest_full_name = vm_props.get("config.guestFullName")
+    
+    # 3. summary.guest.guestId (Tools reported ID)
+    # 4. config.guestId (Configured ID)
+    guest_id = vm_props.get("summary.guest.guestId")
+    if not guest_id:
+        guest_id = vm_props.get("config.guestId")
+    
+    # Extract ALL IPs from guest.net
+    guest_net = vm_props.get("guest.net", [])
+    ip_list = []
+    if guest_net:
+        for nic in guest_net:
+            if nic.ipConfig and nic.ipConfig.ipAddress:
+                for ip_entry in nic.ipConfig.ipAddress:
+                    ip = ip_entry.ipAddress
+                    # Filter for IPv4 (simple check) and ignore localhost
+                    if "." in ip and not ip.startswith("127."):
+                        ip_list.append(ip)
+    
+    # Fallback to summary IP if net property is empty/missing
+    if not ip_list:
+        summary_ip = vm_props.get("summary.guest.ipAddress")
+        if summary_ip:
+            ip_list.append(summary_ip)
+    
+    # Unique IPs
+    ips = tuple(sorted(set(ip_list)))
+    
+    # Persistence Check: If no IP is reported, check our cache
+    if not ips and cached_ips:
+        print(f"Using cached IP {', '.join(cached_ips)} for offline VM {config_name}")
+        ips = tuple(cached_ips)
+
+    create_date = vm_props.get("config.createDate")
+    power_state = vm_props.get("runtime.powerState", "Unknown")
+
+    # OS Name Logic
+    os_name = "Unknown"
+    if guest_full_name:
+        os_name = str(guest_full_name)
+    elif guest_id: 
+        os_name = format_guest_id(str(guest_id))
+
+    # RAM
+    total_ram = vm_props.get("summary.config.memorySizeMB", 0)
+    used_ram = vm_props.get("summary.quickStats.guestMemoryUsage", 0)
+
+    # Disks
+    devices = vm_props.get("config.hardware.device", [])
+    disks = []
+    try:
+        for device in devices:
+            if is_virtual_disk(device):
+                disk_label = device.deviceInfo.label
+                capacity_gb = round(device.capacityInKB / (1024 * 1024), 2)
+                disks.append((disk_label, capacity_gb))
+    except: pass
+
+    return (
+        host_id, vm_key, config_name, os_name, vm_props.get("summary.config.numCpu", 0),
+        used_ram, total_ram, db_manager.utc_epoch(create_date), str(power_state), datetime.now(),
+        ips, tuple(disks)
+    )
+
+def load_cached_ips(host_id):
+    """Returns ({vm_uuid: ips}, {name: ips}) of the VMs stored for a host.
+    The name map covers rows written before vm_uuid existed."""
+    with db_manager.read_connection() as conn:
+        current_db_vms = conn.execute('''
+            SELECT v.vm_uuid, v.name, i.ip FROM vms v JOIN vm_ips i ON i.vm_id = v.id
+            WHERE v.host_id = ? ORDER BY i.ip
+        ''', (host_id,)).fetchall()
+    existing_ip_map, legacy_ip_map = {}, {}
+    for row in current_db_vms:
+        if row['vm_uuid']:
+            existing_ip_map.setdefault(row['vm_uuid'], []).append(row['ip'])
+        else:
+            legacy_ip_map.setdefault(row['name'], []).append(row['ip'])
+    return existing_ip_map, legacy_ip_map
+
+def write_host_metrics(conn, metrics_row):
+    """Replaces the latest host_metrics row of a host and appends the sample to
+    the metrics history."""
+    # host_metrics keeps one row per host (the dashboard's current view); trends
+    # come from the metrics_history tables written below
+    conn.execute("DELETE FROM host_metrics WHERE host_id = ?", (metrics_row[0],))
+    conn.execute('''
+        INSERT INTO host_metrics (
+            host_id, cpu_usage, used_cpu_ghz, total_cpu_ghz, 
+            mem_usage, used_mem_gb, total_mem_gb, 
+            storage_usage, used_storage_gb, total_storage_gb, last_updated
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', metrics_row)
+    host_id, cpu_usage, mem_usage, storage_usage, timestamp = (metrics_row[i] for i in (0, 1, 4, 7, 10))
+    metrics_history.record_samples([(host_id, timestamp, cpu_usage, mem_usage, storage_usage)], conn=conn)
+
+def _retrieve_all(property_collector, filter_spec, check=None):
+    """Yields every ObjectContent of a RetrievePropertiesEx result, following continuation tokens.
+    `check()` runs before each continuation page (deadline checks)."""
+    result = property_collector.RetrievePropertiesEx([filter_spec], vmodl.query.PropertyCollector.RetrieveOptions())
+    while result:
+        yield from result.objects
+        if not result.token:
+            break
+        if check:
+            check()
+        result = property_collector.ContinueRetrievePropertiesEx(result.token)
+
+def _fetch_host_inventory(session, host_id, deadline=None):
+    """Reads host metrics and VM rows over a pooled session. No DB writes.
+
+    Host, datastore (via HostSystem.datastore) and VM properties come back from one
+    batched RetrievePropertiesEx call plus its continuation pages, so the number of
+    round trips does not grow with the datastore count.
+    """
+    filter_spec = _build_inventory_filter_spec(session.view(vim.VirtualMachine), session.view(vim.HostSystem))
+
+    host_props = None
+    datastores = []
+    vm_contents = []
+    with telemetry.span('host_retrieve', session.ip):
+        check = lambda: check_deadline(deadline, session.ip, "the next page")
+        for obj_content in _retrieve_all(session.content.propertyCollector, filter_spec, check):
+            props = {prop.name: prop.val for prop in obj_content.propSet}
+            obj_type = managed_object_type(obj_content.obj)
+            if obj_type == 'VirtualMachine':
+                vm_contents.append((obj_content.obj, props))
+            elif obj_type == 'HostSystem':
+                host_props = host_props or props
+            elif obj_type == 'Datastore':
+                datastores.append(props)
+    if host_props is None:
+        raise RuntimeError("host returned no HostSystem properties")
+
+    with telemetry.span('host_process', session.ip):
+        return build_host_rows(host_id, host_props, datastores, vm_contents)
+
+def build_host_rows(host_id, host_props, datastores, vm_contents):
+    """(metrics_row, vm_rows) from retrieved properties: HOST_PROPERTIES values, a
+    DATASTORE_PROPERTIES dict per datastore and (VM moref, VM_PROPERTIES values) pairs."""
+    metrics_row = build_host_metrics_row(host_id, host_props, datastores)
+
+    # Custom Logic: specific persistence for offline VMs
+    # Fetch existing IPs for this host to preserve them if VM is powered off
+    existing_ip_map, legacy_ip_map = load_cached_ips(host_id)
+
+    vm_rows = []
+    seen_keys = set()
+    for obj, vm_props in vm_contents:
+        vm_key = vm_identity(obj, vm_props, seen_keys)
+        cached_ips = existing_ip_map.get(vm_key) or legacy_ip_map.get(vm_props.get("summary.config.name", "Unknown"), ())
+        vm_rows.append(build_vm_row(host_id, vm_key, vm_props, cached_ips))
+
+    return metrics_row, vm_rows
+
+def fetch_host_data(host_row, deadline=None):
+    """SOAP half of collect_host_data: reads a host over its pooled session.
+
+    Returns (metrics_row, vm_rows, round_trips), or None if the host could not be
+    reached. Raises on collection errors, and HostTimeout once `deadline`
+    (time.monotonic()) has passed. Only plain tuples are returned, so the result
+    can be shipped to another process (see collector_pool.py).
+    """
+    host_id = host_row['id']
 
-    return filter_spec
+    def fetch(session):
+        check_deadline(deadline, session.ip, "property retrieval")
+        start = session.round_trips
+        try:
+            return _fetch_host_inventory(session, host_id, deadline) + (session.round_trips - start,)
+        finally:
+            telemetry.incr('soap_round_trips', session.ip, session.round_trips - start)
+
+    return SESSION_POOL.run(host_row['ip'], host_row['username'], host_row['password'], fetch)
+
+def store_host_data(conn, ip, metrics_row, vm_rows, round_trips):
+    """DB half of collect_host_data: writes metrics and the VM delta on `conn`."""
+    write_host_metrics(conn, metrics_row)
+    vm_changes = db_manager.sync_vms(metrics_row[0], vm_rows, conn=conn)
+    telemetry.incr('vm_rows_written', ip, vm_changes['inserted'] + vm_changes['updated'] + vm_changes['deleted'])
+    print(f"Updated data for host {ip} (VMs: {vm_changes['inserted']} added, {vm_changes['updated']} changed, "
+          f"{vm_changes['deleted']} removed, {vm_changes['unchanged']} unchanged; {round_trips} SOAP round trips)")
+    return vm_changes
+
+def store_host_batch(batch):
+    """Writes [(ip, fetch_host_data result or None)] in a single transaction.
+    Returns {ip: VM change counts}, empty if the transaction failed."""
+    changes = {}
+    try:
+        with db_manager.connection(bump_generation=True) as conn:
+            for ip, fetched in batch:
+                if fetched is not None:
+                    with telemetry.span('host_db_write', ip):
+                        changes[ip] = store_host_data(conn, ip, *fetched)
+    except Exception as e:
+        print(f"Error writing collector batch ({', '.join(ip for ip, _ in batch)}): {e}")
+        return {}
+    return changes
 
-# --- Data Collection Logic ---
+def collect_host_data(host_row, deadline=None):
+    """Collects metrics and VM data for a single host and updates the DB.
 
-def collect_host_data(host_row):
-    """Collects metrics and VM data for a single host and updates the DB."""
-    host_id = host_row['id']
+    Returns the VM change counts from `db_manager.sync_vms`, or None on failure.
+    Nothing is written once `deadline` (time.monotonic()) has passed.
+    """
     ip = host_row['ip']
-    user = host_row['username']
-    password = host_row['password']
 
     print(f"Collecting data for host: {ip}")
-    si = connect_host(ip, user, password)
-    
-    conn = db_manager.get_db_connection()
-    c = conn.cursor()
-
-    if not si:
-        print(f"Skipping {ip} due to connection failure.")
-        # Optionally mark host as down in DB? For now, we just don't update metrics.
-        conn.close()
-        return
-
     try:
-        content = si.RetrieveContent()
-        
-        # 1. Host Metrics
-        host_view = content.viewManager.CreateContainerView(content.rootFolder, [vim.HostSystem], True)
-        esxi_host = host_view.view[0]
-        host_summary = esxi_host.summary
-        
-        used_cpu_mhz = host_summary.quickStats.overallCpuUsage
-        total_cpu_mhz = host_summary.hardware.cpuMhz * host_summary.hardware.numCpuThreads
-        cpu_usage = round((used_cpu_mhz / total_cpu_mhz) * 100, 2) if total_cpu_mhz > 0 else 0
-        
-        total_memory_gb = round(host_summary.hardware.memorySize / (1024**3), 2)
-        used_memory_gb = round(host_summary.quickStats.overallMemoryUsage / 1024, 2)
-        mem_usage = round((used_memory_gb / total_memory_gb) * 100, 2) if total_memory_gb > 0 else 0
-
-        total_storage_bytes = sum(ds.summary.capacity for ds in esxi_host.datastore)
-        free_storage_bytes = sum(ds.summary.freeSpace for ds in esxi_host.datastore)
-        total_storage_gb = round(total_storage_bytes / (1024**3), 2)
-        used_storage_gb = round((total_storage_bytes - free_storage_bytes) / (1024**3), 2)
-        storage_usage = round((used_storage_gb / total_storage_gb) * 100, 2) if total_storage_gb > 0 else 0
-
-        # Insert/Update Metrics (We keep history? For now, let's just insert a new record or update latest. 
-        # The prompt implies 'dashboard' view, so latest is key, but 'database' implies history. 
-        # I'll DELETE old metrics for this host to keep it lightweight as requested ("lightweight database"), 
-        # or we can keep them. Let's keep only the latest entry for now to mimic the current state behavior.)
-        c.execute("DELETE FROM host_metrics WHERE host_id = ?", (host_id,))
-        c.execute('''
-            INSERT INTO host_metrics (
-                host_id, cpu_usage, used_cpu_ghz, total_cpu_ghz, 
-                mem_usage, used_mem_gb, total_mem_gb, 
-                storage_usage, used_storage_gb, total_storage_gb, last_updated
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            host_id, cpu_usage, round(used_cpu_mhz / 1000, 2), round(total_cpu_mhz / 1000, 2),
-            mem_usage, used_memory_gb, total_memory_gb,
-            storage_usage, used_storage_gb, total_storage_gb, datetime.now()
-        ))
-        
-        host_view.Destroy()
-
-        # 2. VMs
-        vm_view = content.viewManager.CreateContainerView(content.rootFolder, [vim.VirtualMachine], True)
-        properties = [
-            "name", "summary.config.name", "summary.guest.guestFullName", "summary.guest.guestId",
-            "config.guestFullName", "config.guestId",
-            "summary.guest.ipAddress", "guest.net", "summary.config.memorySizeMB", "summary.quickStats.guestMemoryUsage",
-            "summary.config.numCpu", "config.hardware.device", "config.createDate", "runtime.powerState"
-        ]
-        filter_spec = _build_property_collector_spec(vm_view, properties)
-        options = vmodl.query.PropertyCollector.RetrieveOptions()
-        result = content.propertyCollector.RetrievePropertiesEx([filter_spec], options)
-
-        # Custom Logic: specific persistence for offline VMs
-        # Fetch existing IPs for this host to preserve them if VM is powered off
-        current_db_vms = conn.execute("SELECT name, ip FROM vms WHERE host_id = ?", (host_id,)).fetchall()
-        existing_ip_map = {row['name']: row['ip'] for row in current_db_vms}
-
-        # Clear old VMs for this host before inserting new snapshot
-        c.execute("DELETE FROM vms WHERE host_id = ?", (host_id,))
-
-        def process_object_content(objects):
-            for obj_content in objects:
-                vm_props = {prop.name: prop.val for prop in obj_content.propSet}
-                
-                config_name = vm_props.get("summary.config.name", "Unknown")
-                
-                # Guest OS Resolution Priority:
-                # 1. summary.guest.guestFullName (Tools reported, most accurate)
-                # 2. config.guestFullName (Configured in VM Settings)
-                guest_full_name = vm_props.get("summary.guest.guestFullName")
-                if not guest_full_name:
-                    guest_full_name = vm_props.get("config.guestFullName")
-                
-                # 3. summary.guest.guestId (Tools reported ID)
-                # 4. config.guestId (Configured ID)
-                guest_id = vm_props.get("summary.guest.guestId")
-                if not guest_id:
-                    guest_id = vm_props.get("config.guestId")
-                
-                # Extract ALL IPs from guest.net
-                guest_net = vm_props.get("guest.net", [])
-                ip_list = []
-                if guest_net:
-                    for nic in guest_net:
-                        if nic.ipConfig and nic.ipConfig.ipAddress:
-                            for ip_entry in nic.ipConfig.ipAddress:
-                                ip = ip_entry.ipAddress
-                                # Filter for IPv4 (simple check) and ignore localhost
-                                if "." in ip and not ip.startswith("127."):
-                                    ip_list.append(ip)
-                
-                # Fallback to summary IP if net property is empty/missing
-                if not ip_list:
-                    summary_ip = vm_props.get("summary.guest.ipAddress")
-                    if summary_ip:
-                        ip_list.append(summary_ip)
-                
-                # Join unique IPs
-                ip_address = ", ".join(sorted(set(ip_list))) if ip_list else "N/A"
-                
-                # Persistence Check: If IP is N/A, check our cache
-                if ip_address == "N/A":
-                    cached_ip = existing_ip_map.get(config_name)
-                    if cached_ip and cached_ip != "N/A":
-                        print(f"Using cached IP {cached_ip} for offline VM {config_name}")
-                        ip_address = cached_ip
-
-                create_date = vm_props.get("config.createDate")
-                power_state = vm_props.get("runtime.powerState", "Unknown")
-
-                # OS Name Logic
-                os_name = "Unknown"
-                if guest_full_name:
-                    os_name = str(guest_full_name)
-                elif guest_id: 
-                    os_name = format_guest_id(str(guest_id))
-
-                # RAM
-                total_ram = vm_props.get("summary.config.memorySizeMB", 0)
-                used_ram = vm_props.get("summary.quickStats.guestMemoryUsage", 0)
-                ram_perc = round((used_ram / total_ram) * 100, 1) if total_ram > 0 else 0
-                ram_str = f"{used_ram} / {total_ram} MB ({ram_perc}%)"
-
-                # Disks
-                devices = vm_props.get("config.hardware.device", [])
-                disk_details = []
-                try:
-                    for device in devices:
-                        if isinstance(device, vim.vm.device.VirtualDisk):
-                            disk_label = device.deviceInfo.label
-                            capacity_gb = round(device.capacityInKB / (1024 * 1024), 2)
-                            disk_details.append(f"{disk_label} ({capacity_gb}GB)")
-                except: pass
-                disks_str = ", ".join(disk_details) if disk_details else "N/A"
-
-                # Format Date
-                created_date_str = None
-                if isinstance(create_date, datetime):
-                    created_date_str = create_date.isoformat()
-                
-                c.execute('''
-                    INSERT INTO vms (
-                        host_id, name, os, ip, cpu_count, ram_info, disk_info, created_date, power_state, last_updated
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    host_id, config_name, os_name, ip_address, vm_props.get("summary.config.numCpu", 0),
-                    ram_str, disks_str, created_date_str, str(power_state), datetime.now()
-                ))
-
-        if result:
-            process_object_content(result.objects)
-            token = result.token
-            while token:
-                result = content.propertyCollector.ContinueRetrievePropertiesEx(token)
-                process_object_content(result.objects)
-                token = result.token
-
-        vm_view.Destroy()
-        conn.commit()
-        print(f"Updated data for host {ip}")
+        fetched = fetch_host_data(host_row, deadline)
+        if fetched is None:
+            print(f"Skipping {ip} due to connection failure.")
+            telemetry.incr('host_failures', ip)
+            # Optionally mark host as down in DB? For now, we just don't update metrics.
+            return
+
+        # All SOAP work is done; write metrics and the VM delta in one short transaction
+        check_deadline(deadline, ip, "the DB write; results discarded")
+        with telemetry.span('host_db_write', ip), db_manager.connection(bump_generation=True) as conn:
+            return store_host_data(conn, ip, *fetched)
 
     except Exception as e:
         print(f"Error collecting data for host {ip}: {e}")
-    finally:
-        connect.Disconnect(si)
-        conn.close()
+        telemetry.incr('host_failures', ip)
 
 # --- Network Scanning Logic ---
 
+# Scanner backend: "icmp" uses the asyncio sweep engine (one socket for all targets),
+# "ping" forks one `ping` process per address. "icmp" falls back to "ping" when the
+# process may not open ICMP sockets.
+SCANNER_BACKEND = "icmp"
+SCAN_MAX_IN_FLIGHT = 1024   # Probes in flight across ALL subnets of a bulk scan
+PING_MAX_WORKERS = 50       # Thread cap for the `ping` fallback backend
+SCAN_PROGRESS_STEP = 32     # Report progress every N completed probes
+
+# Incremental rescan policy. Taken, new and recently changed addresses are probed
+# every cycle; addresses that stayed free get probed every N cycles, N growing
+# with how long they have been free.
+INCREMENTAL_RECENT_CHANGE = timedelta(days=1)
+INCREMENTAL_VOLATILE_CHANGES = 3                 # Flips that mark an address volatile...
+INCREMENTAL_VOLATILE_WINDOW = timedelta(days=7)  # ...while its last flip is this recent
+INCREMENTAL_FREE_STRIDES = [                     # (free for at least, probe every N cycles)
+    (timedelta(days=1), 4),
+    (timedelta(days=7), 12),
+    (timedelta(days=30), 24),
+]
+
 def scan_ip(ip):
     """Pings an IP address. Returns (ip, is_active)."""
     param = '-n' if platform.system().lower() == 'windows' else '-c'
@@ -282,47 +430,297 @@ def scan_ip(ip):
     except subprocess.CalledProcessError:
         return ip, False
 
-def scan_and_store_subnet(subnet_prefix):
-    """Scans a subnet and updates the DB."""
-    print(f"Scanning subnet {subnet_prefix}.0/24...")
-    ips_to_scan = [f"{subnet_prefix}.{i}" for i in range(256)]
-    
-    with ThreadPoolExecutor(max_workers=50) as executor:
-        results = list(executor.map(scan_ip, ips_to_scan))
-    
-    conn = db_manager.get_db_connection()
-    c = conn.cursor()
-    
-    # Upsert results
-    for ip, is_active in results:
+def _fair_shares(subnet_ips, budget):
+    """Splits the global probe budget between subnets in proportion to their size."""
+    total = sum(len(ips) for ips in subnet_ips.values()) or 1
+    return {subnet: max(1, budget * len(ips) // total) for subnet, ips in subnet_ips.items()}
+
+def _parse_timestamp(value):
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value)
+    try:
+        return datetime.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+def _probe_stride(row, now):
+    """How many incremental cycles may pass between probes of one address."""
+    if row is None or row['status'] == 'taken':
+        return 1
+    last_changed = _parse_timestamp(row['last_changed']) or _parse_timestamp(row['last_updated'])
+    if last_changed is None:
+        return 1
+    stable_for = now - last_changed
+    # Volatile addresses (recently released, or flapping) stay on every cycle
+    volatile = (row['change_count'] or 0) >= INCREMENTAL_VOLATILE_CHANGES and stable_for < INCREMENTAL_VOLATILE_WINDOW
+    if stable_for < INCREMENTAL_RECENT_CHANGE or volatile:
+        return 1
+    stride = 1
+    for min_age, cycles in INCREMENTAL_FREE_STRIDES:
+        if stable_for >= min_age:
+            stride = cycles
+    return stride
+
+def _select_due_ips(ips, history, cycle, now):
+    """Picks the addresses an incremental scan should probe on this cycle."""
+    due = []
+    for ip in ips:
+        stride = _probe_stride(history.get(ip), now)
+        # Offset by the host number so skipped addresses are spread across cycles
+        if (db_manager.ip_to_int(ip) + cycle) % stride == 0:
+            due.append(ip)
+    return due
+
+def _store_scan_results(subnet, results, history=None):
+    """Writes one subnet's scan results ({ip: is_active}) to the DB.
+
+    With `history` (incremental mode) only new rows and rows whose status changed
+    are written. Returns the number of rows written.
+    """
+    now = datetime.now()
+    rows = []
+    for ip, is_active in results.items():
         status = 'taken' if is_active else 'free'
-        c.execute('''
-            INSERT OR REPLACE INTO network_scans (subnet, ip, status, last_updated)
-            VALUES (?, ?, ?, ?)
-        ''', (subnet_prefix, ip, status, datetime.now()))
-        
-    conn.commit()
-    conn.close()
-    print(f"Finished scanning {subnet_prefix}.0/24")
-
-def scan_all_subnets():
-    """Scans all subnets defined in the database."""
+        if history is not None and ip in history and history[ip]['status'] == status:
+            continue
+        rows.append((ip, status, now))
+
+    db_manager.bulk_upsert_scan_results(rows)
+    return len(rows)
+
+async def _sweep_subnets_icmp(subnet_ips, max_in_flight, on_probe, store, on_subnet_done):
+    """Sweeps all subnets at once over a single ICMP socket."""
+    loop = asyncio.get_running_loop()
+    shares = _fair_shares(subnet_ips, max_in_flight)
+
+    async with icmp_scanner.ICMPSweeper(max_in_flight=max_in_flight) as sweeper:
+        async def sweep_subnet(subnet, ips):
+            results = await sweeper.sweep_async(
+                ips, share=asyncio.Semaphore(shares[subnet]),
+                on_result=lambda ip, is_active: on_probe(subnet)
+            )
+            # Store off the event loop so other subnets keep probing meanwhile
+            written = await loop.run_in_executor(None, store, subnet, results)
+            on_subnet_done(subnet, written)
+
+        await asyncio.gather(*(sweep_subnet(subnet, ips) for subnet, ips in subnet_ips.items()))
+
+def _sweep_subnets_ping(subnet_ips, max_workers, on_probe, store, on_subnet_done):
+    """Sweeps all subnets through one shared pool of `ping` subprocesses."""
+    # Interleave submissions by relative position inside each subnet, so larger
+    # subnets get proportionally more of the pool and all subnets finish together.
+    queue = sorted(
+        ((i / len(ips), subnet, ip) for subnet, ips in subnet_ips.items() for i, ip in enumerate(ips)),
+        key=lambda item: item[0]
+    )
+    pending = {subnet: len(ips) for subnet, ips in subnet_ips.items()}
+    results = {subnet: {} for subnet in subnet_ips}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(scan_ip, ip): subnet for _, subnet, ip in queue}
+        for future in as_completed(futures):
+            subnet = futures[future]
+            ip, is_active = future.result()
+            results[subnet][ip] = is_active
+            on_probe(subnet)
+            pending[subnet] -= 1
+            if pending[subnet] == 0:
+                on_subnet_done(subnet, store(subnet, results.pop(subnet)))
+
+def scan_subnets(subnets, progress_callback=None, max_in_flight=SCAN_MAX_IN_FLIGHT, incremental=False):
+    """Scans several subnets concurrently under one shared probe budget.
+
+    Each subnet's results are written to the DB as soon as that subnet finishes.
+    `progress_callback(subnet, done, total)` is called from the caller's thread as
+    probes complete (every SCAN_PROGRESS_STEP probes) and once the subnet is stored.
+
+    In incremental mode the stored history decides which addresses are due this
+    cycle (see `_probe_stride`) and only status changes are written.
+    Returns {'probed', 'skipped', 'written'} counts.
+    """
+    stats = {'probed': 0, 'skipped': 0, 'written': 0}
+    histories = {}
+    subnet_ips = {}
+    now = datetime.now()
+    for subnet in subnets:
+        ips = [str(ip) for ip in db_manager.parse_subnet(subnet).hosts()]
+        if incremental:
+            histories[subnet] = db_manager.get_scan_history(subnet)
+            due = _select_due_ips(ips, histories[subnet], db_manager.next_scan_cycle(subnet), now)
+            stats['skipped'] += len(ips) - len(due)
+            ips = due
+        stats['probed'] += len(ips)
+        subnet_ips[subnet] = ips
+
+    done = {subnet: 0 for subnet in subnet_ips}
+
+    def on_probe(subnet):
+        done[subnet] += 1
+        total = len(subnet_ips[subnet])
+        # The final (total, total) report is held back until the subnet is stored
+        if progress_callback and done[subnet] < total and done[subnet] % SCAN_PROGRESS_STEP == 0:
+            progress_callback(subnet, done[subnet], total)
+
+    def store(subnet, results):
+        with telemetry.span('subnet_db_write', subnet):
+            return _store_scan_results(subnet, results, histories.get(subnet))
+
+    sweep_start = time.perf_counter()
+
+    def on_subnet_done(subnet, written):
+        stats['written'] += written
+        total = len(subnet_ips[subnet])
+        telemetry.observe('subnet_sweep', subnet, time.perf_counter() - sweep_start)
+        telemetry.incr('probes', subnet, total)
+        telemetry.incr('scan_rows_written', subnet, written)
+        print(f"Finished scanning {subnet} ({total} probed, {written} rows written)")
+        if progress_callback:
+            progress_callback(subnet, total, total)
+
+    # Nothing due in a subnet (incremental mode): it is already up to date
+    for subnet in [s for s, ips in subnet_ips.items() if not ips]:
+        del subnet_ips[subnet]
+        on_subnet_done(subnet, 0)
+
+    for subnet in subnet_ips:
+        print(f"Scanning subnet {subnet}...")
+
+    if subnet_ips:
+        swept = False
+        if SCANNER_BACKEND == "icmp":
+            try:
+                asyncio.run(_sweep_subnets_icmp(subnet_ips, max_in_flight, on_probe, store, on_subnet_done))
+                swept = True
+            except (OSError, NotImplementedError) as e:
+                print(f"ICMP sweep unavailable ({e}), falling back to ping subprocesses.")
+        if not swept:
+            _sweep_subnets_ping(subnet_ips, min(max_in_flight, PING_MAX_WORKERS), on_probe, store, on_subnet_done)
+
+    if incremental:
+        print(f"Incremental scan: {stats['probed']} probed, {stats['skipped']} skipped, {stats['written']} rows written.")
+    telemetry.end_cycle(subnets)
+    telemetry.flush()
+    return stats
+
+def scan_and_store_subnet(subnet, incremental=False):
+    """Scans a subnet (CIDR) and updates the DB."""
+    return scan_subnets([subnet], incremental=incremental)
+
+def scan_all_subnets(progress_callback=None, incremental=False):
+    """Scans all subnets defined in the database, in parallel.
+
+    `progress_callback(subnet, done, total)` receives per-zone progress.
+    """
     subnets = db_manager.get_all_subnets()
     print(f"Starting bulk scan for {len(subnets)} subnets...")
-    for subnet in subnets:
-        scan_and_store_subnet(subnet)
+    stats = scan_subnets(subnets, progress_callback=progress_callback, incremental=incremental)
     print("Bulk subnet scan completed.")
+    return stats
 
 # --- Main Update Function ---
 
-def update_all_hosts():
-    """Fetches all hosts from DB and triggers collection for them."""
-    conn = db_manager.get_db_connection()
-    hosts = conn.execute("SELECT * FROM hosts").fetchall()
-    conn.close()
-
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        executor.map(collect_host_data, hosts)
+# Worker processes for update_all_hosts. 0 keeps everything in this process on
+# COLLECTOR_THREADS threads; N > 0 shards the hosts over N processes with
+# COLLECTOR_THREADS threads each, so SOAP parsing and VM row building run outside
+# this process's GIL (see collector_pool.py).
+COLLECTOR_PROCESSES = 0
+COLLECTOR_THREADS = 10
+# True collects every host from one asyncio event loop over raw SOAP/HTTP instead
+# of pyVmomi on threads (see async_collector.py); takes precedence over processes.
+COLLECTOR_ASYNC = False
+
+def collect_with_deadlines(hosts, collect=None, threads=None, progress_callback=None):
+    """Runs `collect(host_row, deadline)` (default collect_host_data) for every host
+    on a thread pool, enforcing HOST_DEADLINE_SECONDS per host and
+    CYCLE_DEADLINE_SECONDS for the whole batch.
+
+    Returns (results in `hosts` order, None for failed or timed-out hosts,
+    {ip: reason} of the timed-out hosts). Never waits for an overdue host: its
+    session is dropped from the pool and the socket of its in-flight request is
+    shut down, so its thread fails promptly. A host still logging in has no
+    session to interrupt yet; that thread is bounded by the socket timeout only.
+    `progress_callback(done, total)` is called
+    from the caller's thread as hosts finish or time out.
+    """
+    collect = collect or collect_host_data
+    started = {}
+
+    def run(index, host_row):
+        started[index] = time.monotonic()
+        return collect(host_row, started[index] + HOST_DEADLINE_SECONDS)
+
+    executor = ThreadPoolExecutor(max_workers=threads or COLLECTOR_THREADS)
+    futures = {executor.submit(run, index, host_row): index for index, host_row in enumerate(hosts)}
+    results = [None] * len(hosts)
+    timed_out = {}
+    cycle_deadline = time.monotonic() + CYCLE_DEADLINE_SECONDS
+    pending = set(futures)
+    try:
+        while pending:
+            done, pending = wait(pending, timeout=DEADLINE_POLL_SECONDS, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[futures[future]] = future.result()
+            now = time.monotonic()
+            for future in list(pending):
+                index = futures[future]
+                ip = hosts[index]['ip']
+                if index in started and now - started[index] > HOST_DEADLINE_SECONDS:
+                    timed_out[ip] = f"still running after {HOST_DEADLINE_SECONDS}s"
+                    SESSION_POOL.abandon(ip)
+                elif now > cycle_deadline and future.cancel():
+                    timed_out[ip] = f"not started within the {CYCLE_DEADLINE_SECONDS}s cycle deadline"
+                else:
+                    continue
+                pending.discard(future)
+                telemetry.incr('host_timeouts', ip)
+            if progress_callback:
+                progress_callback(len(hosts) - len(pending), len(hosts))
+    finally:
+        # Don't join overdue threads; their late results are discarded by the deadline check
+        executor.shutdown(wait=False, cancel_futures=True)
+    return results, timed_out
+
+def update_all_hosts(progress_callback=None):
+    """Fetches all hosts from DB and triggers collection for them.
+
+    Returns the cycle's VM change counts plus 'timed_out', {ip: reason} of the
+    hosts that ran out of time. `progress_callback(done, total)` receives the
+    number of finished hosts.
+    """
+    with db_manager.read_connection() as conn:
+        hosts = conn.execute("SELECT * FROM hosts").fetchall()
+
+    with telemetry.span('collection_cycle', 'cycle'):
+        if COLLECTOR_ASYNC:
+            import async_collector
+            results, saved_seconds, timed_out = async_collector.collect_all(hosts, progress_callback)
+        elif COLLECTOR_PROCESSES > 0:
+            import collector_pool
+            results, saved_seconds, timed_out = collector_pool.shared_pool().collect(hosts, progress_callback)
+        else:
+            results, timed_out = collect_with_deadlines(hosts, progress_callback=progress_callback)
+            saved_seconds = SESSION_POOL.take_saved_seconds()
+
+    # Per-cycle VM change counts across all hosts
+    totals = {'inserted': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0}
+    for vm_changes in results:
+        for key, value in (vm_changes or {}).items():
+            totals[key] += value
+    print(f"Cycle VM changes: {totals['inserted']} added, {totals['updated']} changed, "
+          f"{totals['deleted']} removed, {totals['unchanged']} unchanged "
+          f"({sum(1 for r in results if r is None)} of {len(hosts)} hosts failed)")
+    print(f"Session reuse saved {saved_seconds:.2f}s of connect time this cycle")
+    if timed_out:
+        print(f"{len(timed_out)} hosts timed out: " + "; ".join(f"{ip} ({reason})" for ip, reason in timed_out.items()))
+    telemetry.incr('hosts_collected', 'cycle', len(hosts) - sum(1 for r in results if r is None))
+    telemetry.incr('hosts_failed', 'cycle', sum(1 for r in results if r is None))
+    telemetry.incr('hosts_timed_out', 'cycle', len(timed_out))
+    telemetry.end_cycle([host['ip'] for host in hosts] + ['cycle'])
+    telemetry.flush()
+    totals['timed_out'] = timed_out
+    return totals
 
 def update_specific_subnet(subnet):
     scan_and_store_subnet(subnet)
@@ -1,19 +1,129 @@
 import sqlite3
+import ipaddress
 import json
 import os
-from datetime import datetime
+import re
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from urllib.request import pathname2url
 
 DB_FILE = 'monitoring.db'
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_FILE)
+# --- Connection Management ---
+# Every thread gets one pooled connection per flavour (read-write / read-only),
+# opened once with WAL journaling and tuned pragmas. WAL lets the dashboard keep
+# reading while the collector writes. Use the context managers below and don't
+# close pooled connections yourself.
+BUSY_TIMEOUT_MS = 15000   # Wait this long for a competing writer instead of failing
+CACHE_SIZE_KB = 16384     # Page cache per connection
+
+_local = threading.local()
+
+def _open_connection(read_only=False):
+    """Opens a new connection with the standard pragmas applied."""
+    if read_only:
+        uri = f"file:{pathname2url(os.path.abspath(DB_FILE))}?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, timeout=BUSY_TIMEOUT_MS / 1000)
+    else:
+        conn = sqlite3.connect(DB_FILE, timeout=BUSY_TIMEOUT_MS / 1000)
+        # Persistent on the DB file; a no-op once the file is already in WAL mode
+        conn.execute('PRAGMA journal_mode = WAL')
     conn.row_factory = sqlite3.Row
+    conn.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}')
+    conn.execute('PRAGMA synchronous = NORMAL')  # Durable enough with WAL, far fewer fsyncs
+    conn.execute(f'PRAGMA cache_size = -{CACHE_SIZE_KB}')
     return conn
 
+def _pooled(read_only):
+    """Returns this thread's pooled connection (and its nesting-depth slot)."""
+    if not hasattr(_local, 'connections'):
+        _local.connections = {}
+        _local.depth = {}
+        _local.bump = {}
+    key = (os.path.abspath(DB_FILE), read_only)
+    conn = _local.connections.get(key)
+    if conn is None:
+        conn = _local.connections[key] = _open_connection(read_only)
+        _local.depth[key] = 0
+    return key, conn
+
+@contextmanager
+def connection(bump_generation=False):
+    """Read-write pooled connection wrapped in one transaction.
+
+    The outermost block starts the transaction (BEGIN IMMEDIATE, so writers queue
+    on busy_timeout instead of failing mid-transaction) and commits on success or
+    rolls back on error. Nested blocks on the same thread join it.
+    Keep network I/O out of the block: it holds the write lock.
+    Writers of collected data (hosts, VMs, scans, reservations) pass
+    bump_generation=True: if the transaction changed any rows, the collection
+    generation is bumped, which tells readers' caches that new data has landed.
+    Bookkeeping writes (jobs, telemetry) leave it alone. A nested block asking for
+    the bump applies it to the whole transaction.
+    """
+    key, conn = _pooled(read_only=False)
+    outermost = _local.depth[key] == 0
+    _local.depth[key] += 1
+    if bump_generation:
+        _local.bump[key] = True
+    try:
+        if outermost and not conn.in_transaction:
+            conn.execute('BEGIN IMMEDIATE')
+        changes_before = conn.total_changes if outermost else None
+        yield conn
+        if outermost:
+            if _local.bump.get(key) and conn.total_changes != changes_before:
+                bump_collection_generation(conn)
+            conn.commit()
+    except BaseException:
+        if outermost:
+            conn.rollback()
+        raise
+    finally:
+        _local.depth[key] -= 1
+        if outermost:
+            _local.bump.pop(key, None)
+
+def bump_collection_generation(conn):
+    """Marks new collected data inside the caller's transaction (see connection())."""
+    conn.execute('UPDATE collection_state SET generation = generation + 1 WHERE id = 1')
+
+@contextmanager
+def read_connection():
+    """Read-only pooled connection, for the dashboard fetchers and other readers."""
+    _, conn = _pooled(read_only=True)
+    yield conn
+
+def close_thread_connections():
+    """Closes the calling thread's pooled connections (e.g. before a thread exits)."""
+    for conn in getattr(_local, 'connections', {}).values():
+        conn.close()
+    _local.connections = {}
+    _local.depth = {}
+    _local.bump = {}
+
+def get_db_connection():
+    """Standalone (non-pooled) connection with the standard pragmas. Caller closes it."""
+    return _open_connection()
+
+def _add_column_if_missing(c, table, column, definition):
+    """Adds a column to an existing table (CREATE TABLE IF NOT EXISTS won't)."""
+    columns = [row[1] for row in c.execute(f'PRAGMA table_info({table})').fetchall()]
+    if column not in columns:
+        c.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
 def init_db():
-    conn = get_db_connection()
-    c = conn.cursor()
+    with connection(bump_generation=True) as conn:   # Migrations may rewrite served rows
+        _create_schema(conn.cursor())
 
+def get_generation():
+    """Collection generation: increases with every transaction that changed collected data."""
+    with read_connection() as conn:
+        row = conn.execute('SELECT generation FROM collection_state WHERE id = 1').fetchone()
+    return row[0] if row else 0
+
+def _create_schema(c):
     # Hosts table (Stores config/credentials)
     c.execute('''
         CREATE TABLE IF NOT EXISTS hosts (
@@ -44,140 +154,692 @@ def init_db():
         )
     ''')
 
-    # VMs table
+    # VMs table. IPs and disks live in the vm_ips / vm_disks child tables; values
+    # are stored raw and only formatted for display.
     c.execute('''
         CREATE TABLE IF NOT EXISTS vms (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             host_id INTEGER,
             name TEXT,
             os TEXT,
-            ip TEXT,
             cpu_count INTEGER,
-            ram_info TEXT,
-            disk_info TEXT,
-            created_date TEXT,
+            ram_used_mb INTEGER,
+            ram_total_mb INTEGER,
+            created_ts INTEGER,     -- config.createDate, epoch seconds (UTC)
             power_state TEXT,
             last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             FOREIGN KEY (host_id) REFERENCES hosts (id)
         )
     ''')
+    # Stable VM identity (instanceUuid, or moref as fallback) for delta syncs
+    _add_column_if_missing(c, 'vms', 'vm_uuid', 'TEXT')
+    c.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_vms_host_uuid ON vms (host_id, vm_uuid)')
+    _create_vm_search_schema(c)
+    _migrate_vm_created_date(c)
+    c.execute('CREATE INDEX IF NOT EXISTS idx_vms_created_ts ON vms (created_ts)')
 
-    # Network Scans table (replacing JSON cache)
+    # Network Scans table (replacing JSON cache). One row per address, keyed by
+    # the IP as an integer; a subnet's rows are the range [first_ip, last_ip].
+    _migrate_network_scans(c)
     c.execute('''
         CREATE TABLE IF NOT EXISTS network_scans (
-            subnet TEXT,
-            ip TEXT,
-            status TEXT, -- 'taken' or 'free'
-            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            PRIMARY KEY (subnet, ip)
+            ip INTEGER PRIMARY KEY,
+            status TEXT,                -- 'taken' or 'free'
+            last_updated INTEGER,       -- epoch seconds
+            last_changed INTEGER,       -- last status flip, for the incremental rescan mode
+            change_count INTEGER DEFAULT 0
         )
     ''')
 
-    # Subnets configuration table
+    # Subnets configuration table (CIDR networks, /16 to /28)
+    _migrate_subnets(c)
     c.execute('''
         CREATE TABLE IF NOT EXISTS subnets (
-            prefix TEXT PRIMARY KEY
+            cidr TEXT PRIMARY KEY,
+            first_ip INTEGER NOT NULL,
+            last_ip INTEGER NOT NULL,
+            scan_cycle INTEGER DEFAULT 0    -- Incremental scans stagger low-priority probes by cycle
         )
     ''')
 
-    conn.commit()
-    conn.close()
+    # Single-row counter bumped by connection(bump_generation=True) on every commit that changed data
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS collection_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            generation INTEGER NOT NULL
+        )
+    ''')
+    c.execute('INSERT OR IGNORE INTO collection_state (id, generation) VALUES (1, 0)')
+
+    # Host metrics history (raw samples + rollup tiers)
+    import metrics_history
+    metrics_history.create_schema(c)
+
+    # Free-IP allocator bitmaps and reservations
+    import ip_allocator
+    ip_allocator.create_schema(c)
+
+    # Latest collector phase timings per host / subnet
+    import telemetry
+    telemetry.create_schema(c)
+
+    # Dashboard-requested refreshes / scans, run by background_job.py
+    import jobs
+    jobs.create_schema(c)
+
+def _create_vm_search_schema(c):
+    """vm_ips / vm_disks child tables (written by the VM write API, removed with
+    their VM by trigger) and the vms_fts name index kept in sync by triggers."""
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS vm_ips (
+            vm_id INTEGER NOT NULL,
+            ip TEXT NOT NULL,
+            PRIMARY KEY (vm_id, ip)
+        ) WITHOUT ROWID
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_vm_ips_ip ON vm_ips (ip)')
+    # Integer form of the address, for subnet range lookups (NULL if not IPv4)
+    _add_column_if_missing(c, 'vm_ips', 'ip_num', 'INTEGER')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_vm_ips_num ON vm_ips (ip_num)')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS vm_disks (
+            vm_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            label TEXT,
+            capacity_gb REAL,
+            PRIMARY KEY (vm_id, position)
+        ) WITHOUT ROWID
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_vms_name ON vms (name COLLATE NOCASE)')
+    _migrate_vm_strings(c)
+    backfill = c.execute('SELECT vm_id, ip FROM vm_ips WHERE ip_num IS NULL').fetchall()
+    c.executemany('UPDATE vm_ips SET ip_num = ? WHERE vm_id = ? AND ip = ?',
+                  [(ip_to_int(ip), vm_id, ip) for vm_id, ip in backfill if ip_to_int(ip) is not None])
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS vms_children_delete AFTER DELETE ON vms BEGIN
+            DELETE FROM vm_ips WHERE vm_id = OLD.id;
+            DELETE FROM vm_disks WHERE vm_id = OLD.id;
+        END
+    ''')
+
+    # Substring search on VM names. Needs FTS5 with the trigram tokenizer (SQLite
+    # 3.34+); without it search_vms falls back to LIKE over the name index.
+    try:
+        exists = c.execute("SELECT 1 FROM sqlite_master WHERE name = 'vms_fts'").fetchone()
+        c.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS vms_fts USING fts5(
+                name, content='vms', content_rowid='id', tokenize='trigram'
+            )
+        ''')
+    except sqlite3.OperationalError as e:
+        print(f"FTS5 trigram search unavailable ({e}); VM name search will use LIKE.")
+        return
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS vms_fts_insert AFTER INSERT ON vms BEGIN
+            INSERT INTO vms_fts (rowid, name) VALUES (NEW.id, NEW.name);
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS vms_fts_delete AFTER DELETE ON vms BEGIN
+            INSERT INTO vms_fts (vms_fts, rowid, name) VALUES ('delete', OLD.id, OLD.name);
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS vms_fts_update AFTER UPDATE OF name ON vms WHEN OLD.name IS NOT NEW.name BEGIN
+            INSERT INTO vms_fts (vms_fts, rowid, name) VALUES ('delete', OLD.id, OLD.name);
+            INSERT INTO vms_fts (rowid, name) VALUES (NEW.id, NEW.name);
+        END
+    ''')
+    if not exists:
+        c.execute("INSERT INTO vms_fts (vms_fts) VALUES ('rebuild')")
+
+_RAM_INFO_RE = re.compile(r'^\s*(\d+)\s*/\s*(\d+)\s*MB')
+_DISK_INFO_RE = re.compile(r'\s*(.+?)\s*\(([\d.]+)\s*GB\)\s*(?:,|$)')
+
+def _migrate_vm_strings(c):
+    """In-place upgrade of DBs that stored formatted strings on vms: parses ip,
+    ram_info and disk_info into vm_ips, ram_used_mb/ram_total_mb and vm_disks,
+    then drops the old columns."""
+    columns = [row[1] for row in c.execute('PRAGMA table_info(vms)').fetchall()]
+    if 'ram_info' not in columns:
+        return
+    print("Migrating vms to normalized IP/disk/RAM storage...")
+    _add_column_if_missing(c, 'vms', 'ram_used_mb', 'INTEGER')
+    _add_column_if_missing(c, 'vms', 'ram_total_mb', 'INTEGER')
+    # Earlier schema versions kept vm_ips in step with vms.ip through these
+    for trigger in ('vms_ips_insert', 'vms_ips_update', 'vms_ips_delete'):
+        c.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+    c.execute('DELETE FROM vm_ips')
+
+    ram_rows, ip_rows, disk_rows = [], [], []
+    for vm in c.execute('SELECT id, ip, ram_info, disk_info FROM vms').fetchall():
+        ram = _RAM_INFO_RE.match(vm[2] or '')
+        ram_rows.append((int(ram.group(1)) if ram else None, int(ram.group(2)) if ram else None, vm[0]))
+        ip_rows.extend((vm[0], ip.strip()) for ip in (vm[1] or '').split(',') if ip.strip() not in ('', 'N/A'))
+        disk_rows.extend((vm[0], position, label, float(gb))
+                         for position, (label, gb) in enumerate(_DISK_INFO_RE.findall(vm[3] or '')))
+    c.executemany('UPDATE vms SET ram_used_mb = ?, ram_total_mb = ? WHERE id = ?', ram_rows)
+    c.executemany('INSERT OR IGNORE INTO vm_ips (vm_id, ip) VALUES (?, ?)', ip_rows)
+    c.executemany('INSERT OR IGNORE INTO vm_disks (vm_id, position, label, capacity_gb) VALUES (?, ?, ?, ?)', disk_rows)
+    for column in ('ip', 'ram_info', 'disk_info'):
+        try:
+            c.execute(f'ALTER TABLE vms DROP COLUMN {column}')
+        except sqlite3.OperationalError as e:
+            # SQLite < 3.35: the column stays, unused
+            print(f"Could not drop vms.{column} ({e}); leaving it in place.")
+    print(f"Migrated {len(ram_rows)} VMs ({len(ip_rows)} IPs, {len(disk_rows)} disks).")
+
+def utc_epoch(value):
+    """Epoch seconds from a datetime or ISO string; naive values are taken as UTC.
+    Returns None for missing or unparseable values."""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+def _migrate_vm_created_date(c):
+    """In-place upgrade of DBs that stored vms.created_date as ISO text."""
+    columns = [row[1] for row in c.execute('PRAGMA table_info(vms)').fetchall()]
+    if 'created_date' not in columns:
+        return
+    _add_column_if_missing(c, 'vms', 'created_ts', 'INTEGER')
+    rows = c.execute('SELECT id, created_date FROM vms WHERE created_date IS NOT NULL').fetchall()
+    c.executemany('UPDATE vms SET created_ts = ? WHERE id = ?', [(utc_epoch(row[1]), row[0]) for row in rows])
+    try:
+        c.execute('ALTER TABLE vms DROP COLUMN created_date')
+    except sqlite3.OperationalError as e:
+        print(f"Could not drop vms.created_date ({e}); leaving it in place.")
+    print(f"Migrated created_date of {len(rows)} VMs to created_ts.")
+
+# --- Subnets and IP Addresses ---
+# Subnets are IPv4 CIDR networks. Addresses are stored as integers so a subnet is
+# an integer range and a /16 costs 65k small rows rather than dotted strings.
+
+MIN_SUBNET_PREFIX = 16
+MAX_SUBNET_PREFIX = 28
+
+def ip_to_int(ip):
+    """Integer form of a dotted IPv4 address, or None if it isn't one."""
+    try:
+        return int(ipaddress.IPv4Address(ip))
+    except ValueError:
+        return None
+
+def int_to_ip(value):
+    return f"{value >> 24 & 255}.{value >> 16 & 255}.{value >> 8 & 255}.{value & 255}"
+
+def parse_subnet(text):
+    """IPv4Network from CIDR text ("10.1.0.0/22"); three octets ("192.168.5") mean a /24.
+    Raises ValueError for anything else or a prefix outside /16-/28."""
+    text = (text or '').strip()
+    if re.fullmatch(r'\d{1,3}\.\d{1,3}\.\d{1,3}', text):
+        text += '.0/24'
+    network = ipaddress.IPv4Network(text, strict=False)
+    if not MIN_SUBNET_PREFIX <= network.prefixlen <= MAX_SUBNET_PREFIX:
+        raise ValueError(f"subnet size must be /{MIN_SUBNET_PREFIX} to /{MAX_SUBNET_PREFIX}, got /{network.prefixlen}")
+    return network
+
+def _subnet_range(network):
+    return int(network.network_address), int(network.broadcast_address)
+
+def _epoch_seconds(value):
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    if isinstance(value, str):
+        try:
+            return int(datetime.fromisoformat(value).timestamp())
+        except ValueError:
+            return None
+    return int(value) if value is not None else None
+
+def _migrate_network_scans(c):
+    """In-place upgrade of network_scans keyed on (subnet prefix, dotted IP)."""
+    columns = [row[1] for row in c.execute('PRAGMA table_info(network_scans)').fetchall()]
+    if 'subnet' not in columns:
+        return
+    _add_column_if_missing(c, 'network_scans', 'last_changed', 'TIMESTAMP')
+    _add_column_if_missing(c, 'network_scans', 'change_count', 'INTEGER DEFAULT 0')
+    rows = c.execute('SELECT ip, status, last_updated, last_changed, change_count FROM network_scans').fetchall()
+    c.execute('DROP TABLE network_scans')
+    c.execute('''
+        CREATE TABLE network_scans (
+            ip INTEGER PRIMARY KEY,
+            status TEXT,
+            last_updated INTEGER,
+            last_changed INTEGER,
+            change_count INTEGER DEFAULT 0
+        )
+    ''')
+    c.executemany('INSERT OR REPLACE INTO network_scans VALUES (?, ?, ?, ?, ?)', [
+        (ip_to_int(row[0]), row[1], _epoch_seconds(row[2]), _epoch_seconds(row[3]), row[4] or 0)
+        for row in rows if ip_to_int(row[0]) is not None
+    ])
+    print(f"Migrated {len(rows)} scan results to integer IP storage.")
+
+def _migrate_subnets(c):
+    """In-place upgrade of subnets stored as three-octet /24 prefixes."""
+    columns = [row[1] for row in c.execute('PRAGMA table_info(subnets)').fetchall()]
+    if 'prefix' not in columns:
+        return
+    _add_column_if_missing(c, 'subnets', 'scan_cycle', 'INTEGER DEFAULT 0')
+    rows = c.execute('SELECT prefix, scan_cycle FROM subnets').fetchall()
+    c.execute('DROP TABLE subnets')
+    c.execute('''
+        CREATE TABLE subnets (
+            cidr TEXT PRIMARY KEY,
+            first_ip INTEGER NOT NULL,
+            last_ip INTEGER NOT NULL,
+            scan_cycle INTEGER DEFAULT 0
+        )
+    ''')
+    for prefix, scan_cycle in rows:
+        network = parse_subnet(prefix)
+        c.execute('INSERT OR IGNORE INTO subnets VALUES (?, ?, ?, ?)',
+                  (str(network), *_subnet_range(network), scan_cycle or 0))
+    # Allocator state keyed on the old prefixes is rebuilt by ip_allocator.create_schema
+    c.execute('DROP TABLE IF EXISTS subnet_bitmaps')
+    c.execute('DROP TABLE IF EXISTS ip_reservations')
+    print(f"Migrated {len(rows)} subnets to CIDR notation.")
 
 def seed_hosts_if_empty(host_groups, default_user="root"):
     """
     Populates the hosts table from the hardcoded dictionary if the table is empty.
     """
-    conn = get_db_connection()
-    c = conn.cursor()
-    
-    c.execute('SELECT count(*) FROM hosts')
-    if c.fetchone()[0] == 0:
-        print("Seeding database with initial host configuration...")
-        for group_name, group_data in host_groups.items():
-            password = group_data["pass"]
-            for ip in group_data["ips"]:
-                try:
-                    c.execute('''
-                        INSERT INTO hosts (ip, username, password, group_name)
-                        VALUES (?, ?, ?, ?)
-                    ''', (ip, default_user, password, group_name))
-                except sqlite3.IntegrityError:
-                    pass # Skip duplicates
-        conn.commit()
-    
-    conn.close()
+    with connection(bump_generation=True) as conn:
+        c = conn.cursor()
+        
+        c.execute('SELECT count(*) FROM hosts')
+        if c.fetchone()[0] == 0:
+            print("Seeding database with initial host configuration...")
+            for group_name, group_data in host_groups.items():
+                password = group_data["pass"]
+                for ip in group_data["ips"]:
+                    try:
+                        c.execute('''
+                            INSERT INTO hosts (ip, username, password, group_name)
+                            VALUES (?, ?, ?, ?)
+                        ''', (ip, default_user, password, group_name))
+                    except sqlite3.IntegrityError:
+                        pass # Skip duplicates
 
 def seed_subnets_if_empty(default_range=15):
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute('SELECT count(*) FROM subnets')
-    if c.fetchone()[0] == 0:
-        print("Seeding database with initial subnets...")
-        # Default 192.168.0.x to 192.168.14.x
-        for i in range(default_range):
-            try:
-                c.execute('INSERT INTO subnets (prefix) VALUES (?)', (f"192.168.{i}",))
-            except sqlite3.IntegrityError:
-                pass
-        conn.commit()
-    conn.close()
+    with connection(bump_generation=True) as conn:
+        c = conn.cursor()
+        c.execute('SELECT count(*) FROM subnets')
+        if c.fetchone()[0] == 0:
+            print("Seeding database with initial subnets...")
+            # Default 192.168.0.0/24 to 192.168.14.0/24
+            for i in range(default_range):
+                network = parse_subnet(f"192.168.{i}.0/24")
+                c.execute('INSERT OR IGNORE INTO subnets (cidr, first_ip, last_ip) VALUES (?, ?, ?)',
+                          (str(network), *_subnet_range(network)))
 
 def get_all_subnets():
-    conn = get_db_connection()
-    rows = conn.execute('SELECT prefix FROM subnets ORDER BY prefix').fetchall()
-    conn.close()
-    return [row['prefix'] for row in rows]
+    """CIDR strings of the configured subnets, in address order."""
+    with read_connection() as conn:
+        rows = conn.execute('SELECT cidr FROM subnets ORDER BY first_ip').fetchall()
+    return [row['cidr'] for row in rows]
 
-def add_subnet(prefix):
-    conn = get_db_connection()
-    try:
-        conn.execute('INSERT INTO subnets (prefix) VALUES (?)', (prefix,))
-        conn.commit()
-        return True
-    except sqlite3.IntegrityError:
-        return False
-    finally:
-        conn.close()
+def get_scan_history(subnet):
+    """Returns {ip: row} with status and change history for a subnet (dotted IP keys,
+    epoch second timestamps)."""
+    first, last = _subnet_range(parse_subnet(subnet))
+    with read_connection() as conn:
+        rows = conn.execute('''
+            SELECT ip, status, last_updated, last_changed, change_count
+            FROM network_scans WHERE ip BETWEEN ? AND ?
+        ''', (first, last)).fetchall()
+    return {int_to_ip(row['ip']): row for row in rows}
+
+def next_scan_cycle(subnet):
+    """Increments and returns the incremental scan cycle counter of a subnet."""
+    with connection() as conn:
+        conn.execute('UPDATE subnets SET scan_cycle = COALESCE(scan_cycle, 0) + 1 WHERE cidr = ?', (subnet,))
+        row = conn.execute('SELECT scan_cycle FROM subnets WHERE cidr = ?', (subnet,)).fetchone()
+    return row['scan_cycle'] if row else 0
 
-def remove_subnet(prefix):
-    conn = get_db_connection()
-    conn.execute('DELETE FROM subnets WHERE prefix = ?', (prefix,))
-    # Optionally clean up scan results for this subnet
-    conn.execute('DELETE FROM network_scans WHERE subnet = ?', (prefix,))
-    conn.commit()
-    conn.close()
+def add_subnet(text):
+    """Adds a subnet (see parse_subnet; raises ValueError if invalid).
+
+    Subnets it contains are merged into it. Returns False if it is already
+    configured or lies inside a configured subnet.
+    """
+    import ip_allocator
+    network = parse_subnet(text)
+    first, last = _subnet_range(network)
+    with connection(bump_generation=True) as conn:
+        if conn.execute('SELECT 1 FROM subnets WHERE first_ip <= ? AND last_ip >= ?', (first, last)).fetchone():
+            return False
+        merged = [row[0] for row in conn.execute(
+            'SELECT cidr FROM subnets WHERE first_ip >= ? AND last_ip <= ?', (first, last)
+        )]
+        for cidr in merged:
+            conn.execute('DELETE FROM subnets WHERE cidr = ?', (cidr,))
+            ip_allocator.drop_subnet(conn, cidr, moved_to=str(network))
+        conn.execute('INSERT INTO subnets (cidr, first_ip, last_ip) VALUES (?, ?, ?)', (str(network), first, last))
+        ip_allocator.rebuild_bitmaps(conn, [str(network)])
+    if merged:
+        print(f"Merged {', '.join(merged)} into {network}")
+    return True
+
+def remove_subnet(cidr):
+    import ip_allocator
+    first, last = _subnet_range(parse_subnet(cidr))
+    with connection(bump_generation=True) as conn:
+        conn.execute('DELETE FROM subnets WHERE cidr = ?', (cidr,))
+        # Optionally clean up scan results for this subnet
+        conn.execute('DELETE FROM network_scans WHERE ip BETWEEN ? AND ?', (first, last))
+        ip_allocator.drop_subnet(conn, cidr)
 
 def update_hosts_from_config(host_groups, default_user="root"):
     """
     Updates the hosts table based on the configuration dictionary.
     Updates passwords and usernames for existing hosts and inserts new ones.
     """
-    conn = get_db_connection()
-    c = conn.cursor()
-    
     print("Syncing host configuration to database...")
+    rows = []
     for group_name, group_data in host_groups.items():
         password = group_data["pass"]
         user = group_data.get("user", default_user)
         for ip in group_data["ips"]:
-            # Check if host exists
-            c.execute('SELECT id FROM hosts WHERE ip = ?', (ip,))
-            row = c.fetchone()
-            
-            if row:
-                # Update existing host
-                c.execute('''
-                    UPDATE hosts 
-                    SET username = ?, password = ?, group_name = ?
-                    WHERE ip = ?
-                ''', (user, password, group_name, ip))
-            else:
-                # Insert new host
-                c.execute('''
-                    INSERT INTO hosts (ip, username, password, group_name)
-                    VALUES (?, ?, ?, ?)
-                ''', (ip, user, password, group_name))
-                
-    conn.commit()
-    conn.close()
+            rows.append((ip, user, password, group_name))
+    bulk_upsert_hosts(rows)
+
+# --- Bulk Write API ---
+# Each call writes its whole batch with executemany in ONE transaction and bumps the
+# collection generation. Pass `conn` (or call inside a `connection()` block) to join
+# the caller's transaction instead; the caller then decides on the bump.
+
+def _run_batch(conn, write, bump_generation=True):
+    if conn is not None:
+        return write(conn)
+    with connection(bump_generation) as conn:
+        return write(conn)
+
+def bulk_upsert_hosts(rows, conn=None):
+    """Upserts host config rows: (ip, username, password, group_name)."""
+    def write(conn):
+        conn.executemany('''
+            INSERT INTO hosts (ip, username, password, group_name)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (ip) DO UPDATE SET
+                username = excluded.username,
+                password = excluded.password,
+                group_name = excluded.group_name
+        ''', rows)
+        return len(rows)
+    return _run_batch(conn, write)
+
+def bulk_upsert_scan_results(rows, conn=None):
+    """Upserts scan rows: (ip, status, timestamp), with a dotted IP and a datetime
+    or epoch timestamp.
+
+    Existing rows keep their change history: last_changed/change_count only move
+    when the status actually flips. The allocator bitmaps of the touched subnets
+    are updated in the same transaction.
+    """
+    import ip_allocator
+    rows = [(ip_to_int(ip), status, _epoch_seconds(ts)) for ip, status, ts in rows]
+
+    def write(conn):
+        conn.executemany('''
+            INSERT INTO network_scans (ip, status, last_updated, last_changed, change_count)
+            VALUES (?1, ?2, ?3, ?3, 0)
+            ON CONFLICT (ip) DO UPDATE SET
+                last_changed = CASE WHEN status != excluded.status THEN excluded.last_changed
+                                    ELSE COALESCE(last_changed, excluded.last_changed) END,
+                change_count = COALESCE(change_count, 0) + (status != excluded.status),
+                status = excluded.status,
+                last_updated = excluded.last_updated
+        ''', rows)
+        ip_allocator.update_bitmaps(conn, rows)
+        return len(rows)
+    return _run_batch(conn, write)
+
+VM_COLUMNS = (
+    'host_id', 'vm_uuid', 'name', 'os', 'cpu_count', 'ram_used_mb', 'ram_total_mb',
+    'created_ts', 'power_state', 'last_updated'
+)
+# Columns compared by sync_vms to decide whether a VM changed
+VM_DATA_COLUMNS = VM_COLUMNS[2:-1]
+# VM rows passed to the write API are VM_COLUMNS followed by the child data:
+#   ips    tuple of IP strings                     -> vm_ips
+#   disks  tuple of (label, capacity_gb) in order  -> vm_disks
+VM_ROW_FIELDS = VM_COLUMNS + ('ips', 'disks')
+
+_VM_INSERT = f"INSERT INTO vms ({', '.join(VM_COLUMNS)}) VALUES ({', '.join('?' * len(VM_COLUMNS))})"
+# Updates in place (same id), so the FTS triggers only fire for new or renamed VMs
+_VM_UPSERT = (f"{_VM_INSERT} ON CONFLICT (host_id, vm_uuid) DO UPDATE SET "
+              f"{', '.join(f'{col} = excluded.{col}' for col in VM_COLUMNS[2:])}")
+
+def _vm_children(conn, where, params):
+    """{vm_id: (ips, disks)} for the VMs matched by `where` (an SQL condition on vms)."""
+    children = {}
+    for row in conn.execute(f"SELECT vm_id, ip FROM vm_ips WHERE vm_id IN (SELECT id FROM vms WHERE {where}) ORDER BY vm_id, ip", params):
+        children.setdefault(row[0], ([], []))[0].append(row[1])
+    for row in conn.execute(f"SELECT vm_id, label, capacity_gb FROM vm_disks WHERE vm_id IN (SELECT id FROM vms WHERE {where}) ORDER BY vm_id, position", params):
+        children.setdefault(row[0], ([], []))[1].append((row[1], row[2]))
+    return {vm_id: (tuple(ips), tuple(disks)) for vm_id, (ips, disks) in children.items()}
+
+def _write_vm_children(conn, host_id, rows):
+    """Replaces vm_ips / vm_disks of the given VM rows (looked up by vm_uuid)."""
+    if not rows:
+        return
+    ids = {row['vm_uuid']: row['id'] for row in conn.execute(
+        "SELECT id, vm_uuid FROM vms WHERE host_id = ? AND vm_uuid IS NOT NULL", (host_id,)
+    )}
+    vm_ids = [(ids[row[1]],) for row in rows if row[1] in ids]
+    conn.executemany("DELETE FROM vm_ips WHERE vm_id = ?", vm_ids)
+    conn.executemany("DELETE FROM vm_disks WHERE vm_id = ?", vm_ids)
+    conn.executemany("INSERT OR IGNORE INTO vm_ips (vm_id, ip, ip_num) VALUES (?, ?, ?)", [
+        (ids[row[1]], ip, ip_to_int(ip)) for row in rows if row[1] in ids for ip in row[-2]
+    ])
+    conn.executemany("INSERT INTO vm_disks (vm_id, position, label, capacity_gb) VALUES (?, ?, ?, ?)", [
+        (ids[row[1]], position, label, capacity_gb)
+        for row in rows if row[1] in ids for position, (label, capacity_gb) in enumerate(row[-1])
+    ])
+
+def attach_vm_children(conn, rows):
+    """Turns vms rows into dicts with 'ips' (list of str) and 'disks' (list of
+    {'label', 'capacity_gb'}) loaded from the child tables."""
+    vms = [dict(row) for row in rows]
+    if not vms:
+        return vms
+    ids = [vm['id'] for vm in vms]
+    children = {}
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        children.update(_vm_children(conn, f"id IN ({', '.join('?' * len(chunk))})", chunk))
+    for vm in vms:
+        ips, disks = children.get(vm['id'], ((), ()))
+        vm['ips'] = list(ips)
+        vm['disks'] = [{'label': label, 'capacity_gb': capacity_gb} for label, capacity_gb in disks]
+    return vms
+
+def bulk_replace_vms(host_id, rows, conn=None):
+    """Replaces the VM snapshot of a host. `rows` are tuples in VM_ROW_FIELDS order.
+
+    VMs that are still present are overwritten in place rather than deleted and
+    re-inserted, which would rewrite every VM's vms_fts entry on each snapshot.
+    """
+    def write(conn):
+        keep = {row[1] for row in rows if row[1] is not None}
+        conn.executemany("DELETE FROM vms WHERE id = ?", [
+            (row['id'],) for row in conn.execute("SELECT id, vm_uuid FROM vms WHERE host_id = ?", (host_id,))
+            if row['vm_uuid'] not in keep
+        ])
+        conn.executemany(_VM_UPSERT, [row[:len(VM_COLUMNS)] for row in rows])
+        _write_vm_children(conn, host_id, rows)
+        return len(rows)
+    return _run_batch(conn, write)
+
+def sync_vms(host_id, rows, conn=None):
+    """Applies a host's VM snapshot as a delta, keyed on (host_id, vm_uuid).
+
+    `rows` are tuples in VM_ROW_FIELDS order. New VMs are inserted, changed VMs
+    (columns, IPs or disks) updated in place (keeping their id), and VMs missing
+    from the snapshot deleted, all in one transaction.
+    Returns {'inserted', 'updated', 'deleted', 'unchanged'}.
+    """
+    def write(conn):
+        stored = {
+            row['vm_uuid']: row for row in conn.execute(
+                f"SELECT id, vm_uuid, {', '.join(VM_DATA_COLUMNS)} FROM vms WHERE host_id = ? AND vm_uuid IS NOT NULL",
+                (host_id,)
+            ).fetchall()
+        }
+        stored_children = _vm_children(conn, "host_id = ?", (host_id,))
+        inserts, updates, changed_children, seen = [], [], [], set()
+        for row in rows:
+            vm = dict(zip(VM_ROW_FIELDS, row))
+            seen.add(vm['vm_uuid'])
+            old = stored.get(vm['vm_uuid'])
+            if old is None:
+                inserts.append(row)
+                continue
+            children_changed = stored_children.get(old['id'], ((), ())) != (tuple(vm['ips']), tuple(vm['disks']))
+            if children_changed:
+                changed_children.append(row)
+            if children_changed or any(old[col] != vm[col] for col in VM_DATA_COLUMNS):
+                updates.append(tuple(vm[col] for col in VM_DATA_COLUMNS) + (vm['last_updated'], old['id']))
+        deletes = [(row['id'],) for key, row in stored.items() if key not in seen]
+
+        conn.executemany("DELETE FROM vms WHERE id = ?", deletes)
+        # Rows from before vm_uuid existed have no key; the first sync replaces them
+        legacy_deleted = conn.execute("DELETE FROM vms WHERE host_id = ? AND vm_uuid IS NULL", (host_id,)).rowcount
+        conn.executemany(
+            f"UPDATE vms SET {', '.join(f'{col} = ?' for col in VM_DATA_COLUMNS)}, last_updated = ? WHERE id = ?",
+            updates
+        )
+        conn.executemany(_VM_INSERT, [row[:len(VM_COLUMNS)] for row in inserts])
+        _write_vm_children(conn, host_id, inserts + changed_children)
+        return {
+            'inserted': len(inserts),
+            'updated': len(updates),
+            'deleted': len(deletes) + legacy_deleted,
+            'unchanged': len(rows) - len(inserts) - len(updates),
+        }
+    return _run_batch(conn, write)
+
+def apply_vm_delta(host_id, upserts, deleted_keys, conn=None):
+    """Applies incremental VM changes for one host (e.g. from a change stream).
+
+    `upserts` are tuples in VM_ROW_FIELDS order, `deleted_keys` are vm_uuid values.
+    Returns {'inserted', 'updated', 'deleted'}.
+    """
+    def write(conn):
+        existing = {row['vm_uuid'] for row in conn.execute(
+            "SELECT vm_uuid FROM vms WHERE host_id = ? AND vm_uuid IS NOT NULL", (host_id,)
+        ).fetchall()}
+        keys = [(host_id, key) for key in deleted_keys if key in existing]
+        conn.executemany("DELETE FROM vms WHERE host_id = ? AND vm_uuid = ?", keys)
+        conn.executemany(_VM_UPSERT, [row[:len(VM_COLUMNS)] for row in upserts])
+        _write_vm_children(conn, host_id, upserts)
+        inserted = sum(1 for row in upserts if row[1] not in existing)
+        return {'inserted': inserted, 'updated': len(upserts) - inserted, 'deleted': len(keys)}
+    return _run_batch(conn, write)
+
+# --- VM Search ---
+# Pushed down to SQLite: exact IP lookups go through the vm_ips index, name
+# searches through the vms_fts trigram index (substring, case-insensitive).
+# Results are paginated with LIMIT/OFFSET and ordered by name.
+
+SEARCH_PAGE_SIZE = 50
+FTS_MIN_QUERY = 3   # Trigrams need at least 3 characters; shorter queries use LIKE
+
+def _has_fts(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'vms_fts'").fetchone() is not None
+
+def search_vms(query, by="Name", limit=SEARCH_PAGE_SIZE, offset=0):
+    """Finds VMs by name substring (by="Name") or exact IP (by="IP").
+
+    Returns (vms, total): one page of VMs (dicts as from attach_vm_children, plus
+    `host_ip`) and the number of matches across all pages.
+    """
+    query = (query or "").strip()
+    if not query:
+        return [], 0
+    with read_connection() as conn:
+        if by == "IP":
+            match_sql = "SELECT vm_id AS id FROM vm_ips WHERE ip = ?"
+            params = (query,)
+        elif len(query) >= FTS_MIN_QUERY and _has_fts(conn):
+            match_sql = "SELECT rowid AS id FROM vms_fts WHERE vms_fts MATCH ?"
+            params = ('"' + query.replace('"', '""') + '"',)
+        else:
+            escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            match_sql = "SELECT id FROM vms WHERE name LIKE ? ESCAPE '\\'"
+            params = (f"%{escaped}%",)
+
+        total = conn.execute(f"SELECT count(DISTINCT id) FROM ({match_sql})", params).fetchone()[0]
+        rows = conn.execute(f'''
+            SELECT v.*, h.ip AS host_ip
+            FROM vms v
+            JOIN hosts h ON v.host_id = h.id
+            WHERE v.id IN ({match_sql})
+            ORDER BY v.name COLLATE NOCASE, v.id
+            LIMIT ? OFFSET ?
+        ''', params + (limit, offset)).fetchall()
+        return attach_vm_children(conn, rows), total
+
+# --- Recently Created VMs ---
+
+def recent_vms(start_ts, end_ts, limit=SEARCH_PAGE_SIZE, offset=0):
+    """VMs created between two epoch timestamps (inclusive), newest first.
+
+    Range scan on idx_vms_created_ts. Returns (vms, total) like search_vms.
+    """
+    with read_connection() as conn:
+        total = conn.execute(
+            "SELECT count(*) FROM vms WHERE created_ts BETWEEN ? AND ?", (start_ts, end_ts)
+        ).fetchone()[0]
+        rows = conn.execute('''
+            SELECT v.*, h.ip AS host_ip
+            FROM vms v
+            JOIN hosts h ON v.host_id = h.id
+            WHERE v.created_ts BETWEEN ? AND ?
+            ORDER BY v.created_ts DESC, v.id
+            LIMIT ? OFFSET ?
+        ''', (start_ts, end_ts, limit, offset)).fetchall()
+        return attach_vm_children(conn, rows), total
+
+# --- Read Queries ---
+# Shared by the dashboard fetchers and the JSON API (api_server.py).
+
+def hosts_with_metrics(ip=None):
+    """Hosts (without credentials) joined with their latest metrics, in insertion order.
+    Pass `ip` for a single host."""
+    where, params = ("WHERE h.ip = ?", (ip,)) if ip is not None else ("", ())
+    with read_connection() as conn:
+        return conn.execute(f'''
+            SELECT h.id, h.ip, h.group_name, hm.cpu_usage, hm.used_cpu_ghz, hm.total_cpu_ghz,
+                   hm.mem_usage, hm.used_mem_gb, hm.total_mem_gb,
+                   hm.storage_usage, hm.used_storage_gb, hm.total_storage_gb, hm.last_updated
+            FROM hosts h
+            LEFT JOIN host_metrics hm ON h.id = hm.host_id
+            {where}
+            ORDER BY h.id
+        ''', params).fetchall()
 
+def host_vms(host_ip, limit=-1, offset=0):
+    """VMs of one host ordered by name, with their IPs and disks. Returns (vms, total);
+    the default limit of -1 returns all of them."""
+    with read_connection() as conn:
+        total = conn.execute(
+            "SELECT count(*) FROM vms v JOIN hosts h ON v.host_id = h.id WHERE h.ip = ?", (host_ip,)
+        ).fetchone()[0]
+        rows = conn.execute('''
+            SELECT v.*
+            FROM vms v
+            JOIN hosts h ON v.host_id = h.id
+            WHERE h.ip = ?
+            ORDER BY v.name, v.id
+            LIMIT ? OFFSET ?
+        ''', (host_ip, limit, offset)).fetchall()
+        return attach_vm_children(conn, rows), total
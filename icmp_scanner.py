@@ -0,0 +1,218 @@
+import asyncio
+import itertools
+import os
+import socket
+import struct
+import time
+
+# --- ICMP Sweep Engine ---
+# Sends ICMP echo requests for many targets over ONE socket and matches replies
+# as they arrive, instead of forking a `ping` process per address.
+# Prefers unprivileged datagram ICMP (Linux: net.ipv4.ping_group_range) and falls
+# back to a raw socket (root / CAP_NET_RAW). Loopback (127.0.0.0/8) answers to any
+# address, which makes it a convenient fake responder for local checks.
+
+ICMP_ECHO_REPLY = 0
+ICMP_ECHO_REQUEST = 8
+
+DEFAULT_TIMEOUT = 1.0         # Seconds to wait for each target's reply
+DEFAULT_RATE_LIMIT = 2000     # Echo requests per second (0 = unlimited)
+DEFAULT_MAX_IN_FLIGHT = 1024  # Outstanding probes at any moment
+DEFAULT_RETRIES = 0           # Extra attempts for targets that did not answer
+
+
+def _checksum(data):
+    """RFC 1071 internet checksum."""
+    if len(data) % 2:
+        data += b'\x00'
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+
+def build_echo_request(ident, seq, payload=b'esxi-monitor-scan'):
+    """Builds an ICMP echo request packet."""
+    header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, 0, ident, seq)
+    checksum = _checksum(header + payload)
+    return struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, checksum, ident, seq) + payload
+
+
+def parse_echo_reply(packet, raw):
+    """Returns (ident, seq) for an echo reply, or None for anything else.
+    Raw sockets deliver the IP header too; datagram ICMP sockets do not."""
+    if raw:
+        if not packet:
+            return None
+        packet = packet[(packet[0] & 0x0f) * 4:]
+    if len(packet) < 8:
+        return None
+    icmp_type, _code, _checksum_val, ident, seq = struct.unpack('!BBHHH', packet[:8])
+    if icmp_type != ICMP_ECHO_REPLY:
+        return None
+    return ident, seq
+
+
+def open_icmp_socket():
+    """Opens a non-blocking ICMP socket. Returns (sock, is_raw)."""
+    try:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+        raw = False
+    except (PermissionError, OSError):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+        raw = True
+    # A large receive buffer keeps bursts of replies from being dropped
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+    except OSError:
+        pass
+    sock.setblocking(False)
+    return sock, raw
+
+
+class ICMPSweeper:
+    """Probes many addresses concurrently over a single ICMP socket.
+
+    `sock_factory` returns (sock, is_raw) and can be swapped for a fake transport.
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, rate_limit=DEFAULT_RATE_LIMIT,
+                 max_in_flight=DEFAULT_MAX_IN_FLIGHT, retries=DEFAULT_RETRIES,
+                 sock_factory=open_icmp_socket):
+        self.timeout = timeout
+        self.rate_limit = rate_limit
+        self.max_in_flight = max_in_flight
+        self.retries = retries
+        self.sock_factory = sock_factory
+        # Per-sweep state
+        self._sock = None
+        self._raw = False
+        self._ident = (os.getpid() ^ id(self)) & 0xffff
+        self._seq = itertools.count()
+        self._pending = {}
+        self._next_send = 0.0
+        self._pace_lock = None
+        self._budget = None
+
+    def _on_readable(self):
+        while True:
+            try:
+                packet, addr = self._sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+            reply = parse_echo_reply(packet, self._raw)
+            if reply is None:
+                continue
+            ident, seq = reply
+            # Datagram ICMP sockets rewrite the identifier, the kernel already
+            # filters replies for us there.
+            if self._raw and ident != self._ident:
+                continue
+            fut = self._pending.get((addr[0], seq))
+            if fut is not None and not fut.done():
+                fut.set_result(True)
+
+    async def _pace(self):
+        """Spaces out sends so we never exceed `rate_limit` packets per second."""
+        if not self.rate_limit:
+            return
+        async with self._pace_lock:
+            now = time.monotonic()
+            if self._next_send > now:
+                await asyncio.sleep(self._next_send - now)
+                now = self._next_send
+            self._next_send = now + 1.0 / self.rate_limit
+
+    async def _send(self, packet, ip):
+        while True:
+            try:
+                self._sock.sendto(packet, (ip, 0))
+                return True
+            except (BlockingIOError, InterruptedError):
+                await asyncio.sleep(0.001)
+            except OSError:
+                # Unreachable network, invalid address, etc. -> treat as no reply
+                return False
+
+    async def _probe(self, ip, share, on_result):
+        loop = asyncio.get_running_loop()
+        is_active = False
+        async with share, self._budget:
+            for _ in range(self.retries + 1):
+                await self._pace()
+                seq = next(self._seq) & 0xffff
+                key = (ip, seq)
+                fut = loop.create_future()
+                self._pending[key] = fut
+                try:
+                    if not await self._send(build_echo_request(self._ident, seq), ip):
+                        continue
+                    await asyncio.wait_for(fut, self.timeout)
+                    is_active = True
+                    break
+                except asyncio.TimeoutError:
+                    pass
+                finally:
+                    self._pending.pop(key, None)
+        if on_result:
+            on_result(ip, is_active)
+        return ip, is_active
+
+    async def open(self):
+        """Opens the shared socket. `max_in_flight` then caps every concurrent
+        sweep running on this sweeper, not just each one on its own.
+        Raises OSError if no ICMP socket can be opened or watched."""
+        loop = asyncio.get_running_loop()
+        self._sock, self._raw = self.sock_factory()
+        self._pace_lock = asyncio.Lock()
+        self._budget = asyncio.Semaphore(self.max_in_flight)
+        try:
+            loop.add_reader(self._sock.fileno(), self._on_readable)
+        except NotImplementedError as e:
+            # Loops without socket readiness callbacks (the Windows Proactor loop):
+            # surface it like a missing ICMP permission, so callers fall back
+            self._sock.close()
+            self._sock = None
+            raise OSError(f"{type(loop).__name__} cannot watch the ICMP socket") from e
+
+    async def close(self):
+        if self._sock is not None:
+            asyncio.get_running_loop().remove_reader(self._sock.fileno())
+            self._sock.close()
+            self._sock = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def sweep_async(self, ips, share=None, on_result=None):
+        """Probes every address in `ips`. Returns {ip: is_active}.
+
+        `share` is an optional asyncio.Semaphore bounding this sweep's slice of the
+        sweeper-wide budget; `on_result(ip, is_active)` fires as each probe settles.
+        """
+        owns_socket = self._sock is None
+        if owns_socket:
+            await self.open()
+        if share is None:
+            share = asyncio.Semaphore(self.max_in_flight)
+        try:
+            results = await asyncio.gather(*(self._probe(ip, share, on_result) for ip in ips))
+        finally:
+            if owns_socket:
+                await self.close()
+        return dict(results)
+
+    def sweep(self, ips):
+        """Blocking wrapper around `sweep_async` for thread-based callers."""
+        return asyncio.run(self.sweep_async(ips))
+
+
+def sweep(ips, **kwargs):
+    """Convenience helper: probes `ips` with a fresh ICMPSweeper."""
+    return ICMPSweeper(**kwargs).sweep(ips)
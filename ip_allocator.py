@@ -0,0 +1,251 @@
+import ipaddress
+import time
+import db_manager
+
+# --- Free-IP Allocator ---
+# Answers "give me N free IPs in subnet X" without reading network_scans rows.
+#   subnet_bitmaps   one bitmap per subnet of the addresses the last scan found
+#                    taken (bit i = i-th address of the subnet: 32 bytes for a /24,
+#                    8 KB for a /16). Updated in the same transaction as every scan
+#                    result write.
+#   ip_reservations  addresses handed out but not yet seen by a scan, each with a
+#                    TTL; expired rows are ignored, and purged by the next allocation
+#                    or by sweep_expired() (which bumps the collection generation,
+#                    so cached free lists and ETags don't outlive a reservation)
+# An address is free if it is not in the bitmap, not reported by any VM (vm_ips)
+# and not reserved. Allocation runs in one write transaction (BEGIN IMMEDIATE), so
+# concurrent callers, in this process or another, never get the same address.
+# Addresses are integers internally and dotted strings at the API boundary.
+
+RESERVATION_TTL_SECONDS = 600
+MAX_ALLOCATION = 64         # Addresses per request
+
+
+def create_schema(c):
+    """Tables used by the allocator (called by db_manager.init_db)."""
+    exists = c.execute("SELECT 1 FROM sqlite_master WHERE name = 'subnet_bitmaps'").fetchone()
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS subnet_bitmaps (
+            subnet TEXT PRIMARY KEY,
+            taken BLOB NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS ip_reservations (
+            ip INTEGER PRIMARY KEY,
+            subnet TEXT NOT NULL,
+            owner TEXT,
+            expires_at INTEGER NOT NULL
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_ip_reservations_subnet ON ip_reservations (subnet, expires_at)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_ip_reservations_expiry ON ip_reservations (expires_at)')
+    if not exists:
+        # New or migrated DB: build bitmaps from the stored scan results
+        rebuild_bitmaps(c, [row[0] for row in c.execute('SELECT cidr FROM subnets')])
+
+
+def _network(subnet):
+    return ipaddress.IPv4Network(subnet)
+
+
+def _empty_bitmap(network):
+    return bytearray((network.num_addresses + 7) // 8)
+
+
+def _set_bit(bitmap, offset, value=True):
+    if value:
+        bitmap[offset >> 3] |= 1 << (offset & 7)
+    else:
+        bitmap[offset >> 3] &= ~(1 << (offset & 7)) & 0xFF
+
+
+def _offsets(bitmap, size):
+    """Offsets of the set bits, skipping fully clear bytes."""
+    for index, byte in enumerate(bitmap):
+        if byte:
+            for bit in range(8):
+                if byte >> bit & 1 and index * 8 + bit < size:
+                    yield index * 8 + bit
+
+
+def rebuild_bitmaps(conn, subnets):
+    """Recomputes the taken-bitmap of each subnet from network_scans."""
+    for subnet in set(subnets):
+        network = _network(subnet)
+        first, last = int(network.network_address), int(network.broadcast_address)
+        bitmap = _empty_bitmap(network)
+        for row in conn.execute(
+            "SELECT ip FROM network_scans WHERE ip BETWEEN ? AND ? AND status = 'taken'", (first, last)
+        ):
+            _set_bit(bitmap, row[0] - first)
+        conn.execute('INSERT OR REPLACE INTO subnet_bitmaps (subnet, taken) VALUES (?, ?)', (subnet, bytes(bitmap)))
+
+
+def update_bitmaps(conn, rows):
+    """Applies written scan rows (ip as integer, status, ...) to the bitmaps of the
+    subnets that contain them."""
+    rows = [row for row in rows if row[0] is not None]
+    if not rows:
+        return
+    low, high = min(row[0] for row in rows), max(row[0] for row in rows)
+    subnets = conn.execute(
+        'SELECT cidr, first_ip, last_ip FROM subnets WHERE first_ip <= ? AND last_ip >= ?', (high, low)
+    ).fetchall()
+    for cidr, first, last in subnets:
+        stored = conn.execute('SELECT taken FROM subnet_bitmaps WHERE subnet = ?', (cidr,)).fetchone()
+        if stored is None:
+            rebuild_bitmaps(conn, [cidr])
+            continue
+        bitmap = bytearray(stored[0])
+        for ip, status, *_ in rows:
+            if first <= ip <= last:
+                _set_bit(bitmap, ip - first, status == 'taken')
+        conn.execute('UPDATE subnet_bitmaps SET taken = ? WHERE subnet = ?', (bytes(bitmap), cidr))
+
+
+def drop_subnet(conn, subnet, moved_to=None):
+    """Removes a subnet's bitmap; its reservations move to `moved_to` (a subnet that
+    absorbed it) or are dropped."""
+    conn.execute('DELETE FROM subnet_bitmaps WHERE subnet = ?', (subnet,))
+    if moved_to:
+        conn.execute('UPDATE ip_reservations SET subnet = ? WHERE subnet = ?', (moved_to, subnet))
+    else:
+        conn.execute('DELETE FROM ip_reservations WHERE subnet = ?', (subnet,))
+
+
+def _scan_bitmap(conn, subnet, network):
+    row = conn.execute('SELECT taken FROM subnet_bitmaps WHERE subnet = ?', (subnet,)).fetchone()
+    return bytearray(row[0]) if row else _empty_bitmap(network)
+
+
+def _used_bitmap(conn, subnet, network, now):
+    """Bitmap of scan-taken, VM-reported and reserved addresses."""
+    first, last = int(network.network_address), int(network.broadcast_address)
+    bitmap = _scan_bitmap(conn, subnet, network)
+    for row in conn.execute('SELECT ip_num FROM vm_ips WHERE ip_num BETWEEN ? AND ?', (first, last)):
+        _set_bit(bitmap, row[0] - first)
+    for row in conn.execute('SELECT ip FROM ip_reservations WHERE subnet = ? AND expires_at > ?', (subnet, now)):
+        _set_bit(bitmap, row[0] - first)
+    return bitmap
+
+
+def _free_offsets(bitmap, network, limit=None):
+    """Clear bits, skipping the network and broadcast addresses and full bytes."""
+    size = network.num_addresses
+    free = []
+    for index, byte in enumerate(bitmap):
+        if byte == 0xFF:
+            continue
+        for bit in range(8):
+            offset = index * 8 + bit
+            if not byte >> bit & 1 and 0 < offset < size - 1:
+                free.append(offset)
+                if limit is not None and len(free) >= limit:
+                    return free
+    return free
+
+
+def scan_taken(subnet, within=None):
+    """Addresses of a subnet that the last scan found in use (the IP map's red
+    boxes), optionally only those inside the network `within`."""
+    network = _network(subnet)
+    first = int(network.network_address)
+    with db_manager.read_connection() as conn:
+        bitmap = _scan_bitmap(conn, subnet, network)
+    if within is not None:
+        start = int(within.network_address) - first
+        return {db_manager.int_to_ip(first + offset) for offset in _offsets(bitmap, network.num_addresses)
+                if start <= offset < start + within.num_addresses}
+    return {db_manager.int_to_ip(first + offset) for offset in _offsets(bitmap, network.num_addresses)}
+
+
+def scan_status(subnet, within=None):
+    """Compact status array for rendering: one character per address of `within`
+    (default: the whole subnet), '1' if the last scan found it taken, else '0'."""
+    network = _network(subnet)
+    within = within or network
+    start = int(within.network_address) - int(network.network_address)
+    with db_manager.read_connection() as conn:
+        bitmap = _scan_bitmap(conn, subnet, network)
+    return ''.join('1' if bitmap[offset >> 3] >> (offset & 7) & 1 else '0'
+                   for offset in range(start, start + within.num_addresses))
+
+
+def block_usage(subnet, new_prefix=24):
+    """(block CIDR, taken, size) for each /new_prefix block of the subnet, counted
+    straight from the scan bitmap."""
+    network = _network(subnet)
+    if network.prefixlen >= new_prefix:
+        return [(str(network), scan_status(subnet).count('1'), network.num_addresses)]
+    with db_manager.read_connection() as conn:
+        bitmap = _scan_bitmap(conn, subnet, network)
+    size = 2 ** (32 - new_prefix)
+    width = size // 8
+    return [(str(block), sum(bin(byte).count('1') for byte in bitmap[i * width:(i + 1) * width]), size)
+            for i, block in enumerate(network.subnets(new_prefix=new_prefix))]
+
+
+def free_ips(subnet):
+    """Addresses not taken per the last scan, not reported by a VM and not reserved."""
+    network = _network(subnet)
+    first = int(network.network_address)
+    with db_manager.read_connection() as conn:
+        bitmap = _used_bitmap(conn, subnet, network, int(time.time()))
+    return [db_manager.int_to_ip(first + offset) for offset in _free_offsets(bitmap, network)]
+
+
+def allocate(subnet, count=1, owner=None, ttl=RESERVATION_TTL_SECONDS, exclude=()):
+    """Reserves `count` free addresses of a subnet for `ttl` seconds.
+
+    `exclude` lists further addresses the caller knows are in use. Returns the
+    reserved IPs, or None (reserving nothing) if fewer than `count` are free.
+    """
+    if not 1 <= count <= MAX_ALLOCATION:
+        raise ValueError(f"count must be 1-{MAX_ALLOCATION}")
+    if ttl <= 0:
+        raise ValueError("ttl must be a positive number of seconds")
+    network = _network(subnet)
+    first, last = int(network.network_address), int(network.broadcast_address)
+    now = int(time.time())
+    with db_manager.connection(bump_generation=True) as conn:
+        conn.execute('DELETE FROM ip_reservations WHERE subnet = ? AND expires_at <= ?', (subnet, now))
+        bitmap = _used_bitmap(conn, subnet, network, now)
+        for ip in exclude:
+            value = db_manager.ip_to_int(ip)
+            if value is not None and first <= value <= last:
+                _set_bit(bitmap, value - first)
+        free = _free_offsets(bitmap, network, count)
+        if len(free) < count:
+            return None
+        conn.executemany('INSERT INTO ip_reservations (ip, subnet, owner, expires_at) VALUES (?, ?, ?, ?)',
+                         [(first + offset, subnet, owner, now + ttl) for offset in free])
+    return [db_manager.int_to_ip(first + offset) for offset in free]
+
+
+def sweep_expired(now=None):
+    """Purges lapsed reservations of every subnet. Costs one indexed read when none
+    have lapsed. Returns how many were purged."""
+    now = int(time.time()) if now is None else now
+    with db_manager.read_connection() as conn:
+        if not conn.execute('SELECT 1 FROM ip_reservations WHERE expires_at <= ? LIMIT 1', (now,)).fetchone():
+            return 0
+    with db_manager.connection(bump_generation=True) as conn:
+        return conn.execute('DELETE FROM ip_reservations WHERE expires_at <= ?', (now,)).rowcount
+
+
+def release(ips):
+    """Drops reservations early (e.g. provisioning failed). Returns how many existed."""
+    with db_manager.connection(bump_generation=True) as conn:
+        return sum(conn.execute('DELETE FROM ip_reservations WHERE ip = ?', (db_manager.ip_to_int(ip),)).rowcount
+                   for ip in ips)
+
+
+def reservations(subnet):
+    """Active reservations of a subnet as dicts (ip, owner, expires_at)."""
+    with db_manager.read_connection() as conn:
+        rows = conn.execute('''
+            SELECT ip, owner, expires_at FROM ip_reservations
+            WHERE subnet = ? AND expires_at > ? ORDER BY ip
+        ''', (subnet, int(time.time()))).fetchall()
+    return [dict(row, ip=db_manager.int_to_ip(row['ip'])) for row in rows]
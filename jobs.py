@@ -0,0 +1,186 @@
+import json
+import time
+import db_manager
+
+# --- Background Job Queue ---
+# Long collection work (a full host refresh, a sweep of every subnet) used to run
+# inside the Streamlit script thread, freezing that session and letting several
+# users start the same cycle at once. The dashboard now enqueues a job row and
+# polls it; background_job.py claims and runs jobs (see run_pending).
+#   - one active (queued or running) job per kind, enforced by a partial unique
+#     index, so a second click joins the job already in flight
+#   - claiming is one BEGIN IMMEDIATE transaction, so two workers never run the
+#     same job
+#   - running jobs heartbeat through their progress updates; a job whose worker
+#     stopped updating for JOB_STALE_SECONDS is failed, freeing its kind
+
+JOB_KINDS = ('refresh_hosts', 'scan_subnets')
+JOB_POLL_SECONDS = 2            # Worker poll interval for new jobs
+JOB_STALE_SECONDS = 900         # Running job without a progress update for this long is dead
+PROGRESS_MIN_INTERVAL = 1.0     # Progress writes per job are throttled to one per this many seconds
+JOB_RETENTION_SECONDS = 7 * 86400
+
+
+def create_schema(c):
+    """Jobs table (called by db_manager.init_db)."""
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY,
+            kind TEXT NOT NULL,
+            params TEXT,
+            status TEXT NOT NULL DEFAULT 'queued',
+            requested_by TEXT,
+            progress_done INTEGER NOT NULL DEFAULT 0,
+            progress_total INTEGER NOT NULL DEFAULT 0,
+            message TEXT,
+            detail TEXT,
+            created_at INTEGER NOT NULL,
+            started_at INTEGER,
+            updated_at INTEGER,
+            finished_at INTEGER
+        )
+    ''')
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_active ON jobs (kind) WHERE status IN ('queued', 'running')")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_jobs_queued ON jobs (status, id)")
+    # Per-part progress as JSON, e.g. {subnet: [done, total]} for a bulk scan
+    db_manager._add_column_if_missing(c, 'jobs', 'detail', 'TEXT')
+
+
+def enqueue(kind, params=None, requested_by=None):
+    """Queues a job unless one of the same kind is already queued or running.
+
+    Returns (job id, True if this call created it).
+    """
+    if kind not in JOB_KINDS:
+        raise ValueError(f"unknown job kind {kind}")
+    with db_manager.connection() as conn:
+        created = conn.execute('''
+            INSERT OR IGNORE INTO jobs (kind, params, requested_by, created_at) VALUES (?, ?, ?, ?)
+        ''', (kind, json.dumps(params) if params else None, requested_by, int(time.time()))).rowcount
+        job_id = conn.execute(
+            "SELECT id FROM jobs WHERE kind = ? AND status IN ('queued', 'running')", (kind,)
+        ).fetchone()[0]
+    return job_id, bool(created)
+
+
+def get(job_id):
+    """A job as a dict, or None."""
+    with db_manager.read_connection() as conn:
+        row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    return dict(row) if row else None
+
+
+def active(kind):
+    """The queued or running job of a kind as a dict, or None."""
+    with db_manager.read_connection() as conn:
+        row = conn.execute("SELECT * FROM jobs WHERE kind = ? AND status IN ('queued', 'running')", (kind,)).fetchone()
+    return dict(row) if row else None
+
+
+def _fail_stale(conn, now):
+    conn.execute('''
+        UPDATE jobs SET status = 'failed', message = 'worker stopped responding', finished_at = ?
+        WHERE status = 'running' AND updated_at < ?
+    ''', (now, now - JOB_STALE_SECONDS))
+
+
+def claim_next():
+    """Marks the oldest queued job running and returns it (dict), or None."""
+    now = int(time.time())
+    with db_manager.connection() as conn:
+        _fail_stale(conn, now)
+        row = conn.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1").fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE jobs SET status = 'running', started_at = ?, updated_at = ? WHERE id = ?",
+                     (now, now, row['id']))
+    return dict(row, status='running', started_at=now)
+
+
+def progress(job_id, done, total, message=None, detail=None):
+    """Records a running job's progress. `detail` (JSON-serialisable) replaces the
+    stored per-part progress; see job_detail."""
+    with db_manager.connection() as conn:
+        conn.execute('''
+            UPDATE jobs SET progress_done = ?, progress_total = ?, message = COALESCE(?, message),
+                detail = COALESCE(?, detail), updated_at = ?
+            WHERE id = ? AND status = 'running'
+        ''', (done, total, message, json.dumps(detail) if detail is not None else None, int(time.time()), job_id))
+
+
+def job_detail(job):
+    """The per-part progress stored with a job (dict from get/active), or None."""
+    return json.loads(job['detail']) if job.get('detail') else None
+
+
+def finish(job_id, error=None, message=None):
+    now = int(time.time())
+    with db_manager.connection() as conn:
+        conn.execute('''
+            UPDATE jobs SET status = ?, message = COALESCE(?, message), finished_at = ?, updated_at = ?
+            WHERE id = ?
+        ''', ('failed' if error else 'done', error or message, now, now, job_id))
+        conn.execute('DELETE FROM jobs WHERE finished_at < ?', (now - JOB_RETENTION_SECONDS,))
+
+
+class _Progress:
+    """progress() callable for one job, writing at most every PROGRESS_MIN_INTERVAL."""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self._last = 0.0
+
+    def __call__(self, done, total, message=None, detail=None):
+        now = time.monotonic()
+        if done < total and now - self._last < PROGRESS_MIN_INTERVAL:
+            return
+        self._last = now
+        progress(self.job_id, done, total, message, detail)
+
+
+def _run_refresh_hosts(report):
+    import data_collector
+    totals = data_collector.update_all_hosts(progress_callback=lambda done, total: report(done, total))
+    message = (f"{totals['inserted']} VMs added, {totals['updated']} changed, {totals['deleted']} removed")
+    if totals['timed_out']:
+        message += f"; timed out: {', '.join(totals['timed_out'])}"
+    return message
+
+
+def _run_scan_subnets(report):
+    import data_collector
+    zones = {subnet: [0, 0] for subnet in db_manager.get_all_subnets()}   # [0, 0]: not started
+
+    def on_zone(subnet, done, total):
+        zones[subnet] = [done, total]
+        report(sum(d for d, _ in zones.values()), sum(t for _, t in zones.values()), detail=zones)
+
+    stats = data_collector.scan_all_subnets(progress_callback=on_zone)
+    return f"{stats['probed']} addresses probed, {stats['written']} rows written"
+
+
+HANDLERS = {
+    'refresh_hosts': _run_refresh_hosts,
+    'scan_subnets': _run_scan_subnets,
+}
+
+
+def run_pending(handlers=None):
+    """Runs queued jobs until none is left (background_job.py's job task).
+    `handlers` overrides HANDLERS per kind (the scheduler routes refreshes through
+    its host tasks). Returns the number of jobs run."""
+    handlers = {**HANDLERS, **(handlers or {})}
+    count = 0
+    while True:
+        job = claim_next()
+        if job is None:
+            return count
+        count += 1
+        print(f"Running job {job['id']} ({job['kind']})")
+        try:
+            message = handlers[job['kind']](_Progress(job['id']))
+        except Exception as e:
+            print(f"Job {job['id']} ({job['kind']}) failed: {e}")
+            finish(job['id'], error=str(e) or type(e).__name__)
+        else:
+            finish(job['id'], message=message)
@@ -0,0 +1,154 @@
+import time
+from datetime import datetime
+import db_manager
+
+# --- Host Metrics History ---
+# host_metrics only holds the latest sample per host; trends live here.
+#   metrics_raw     append-only samples (host, epoch seconds, cpu/mem/storage %)
+#   metrics_rollup  per-tier buckets with sample count and min/sum/max per metric,
+#                   kept current by an insert trigger on metrics_raw (no batch rollup jobs)
+# Range queries pick the finest tier that still covers the range within
+# max_points buckets, so a year-long chart reads ~365 daily rows, not every sample.
+# Timestamps are epoch seconds (UTC); buckets are aligned to the tier width.
+
+RAW_RETENTION_SECONDS = 2 * 86400
+TIERS = [                      # (bucket seconds, retention seconds)
+    (300, 14 * 86400),         # 5 minutes, kept 14 days
+    (3600, 90 * 86400),        # hourly, kept 90 days
+    (86400, 5 * 365 * 86400),  # daily, kept 5 years
+]
+METRICS = ('cpu', 'mem', 'storage')
+PRUNE_INTERVAL_SECONDS = 3600  # record_samples prunes expired rows at most this often
+
+_last_prune = 0.0
+
+
+def to_epoch(value):
+    """Epoch seconds from a datetime, ISO string or number."""
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return int(value.timestamp())
+
+
+def create_schema(c):
+    """Tables plus the insert trigger that maintains the rollups (called by db_manager.init_db)."""
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS metrics_raw (
+            host_id INTEGER NOT NULL,
+            ts INTEGER NOT NULL,
+            cpu_usage REAL,
+            mem_usage REAL,
+            storage_usage REAL,
+            PRIMARY KEY (host_id, ts)
+        ) WITHOUT ROWID
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS metrics_rollup (
+            tier INTEGER NOT NULL,
+            host_id INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            samples INTEGER NOT NULL,
+            cpu_min REAL, cpu_sum REAL, cpu_max REAL,
+            mem_min REAL, mem_sum REAL, mem_max REAL,
+            storage_min REAL, storage_sum REAL, storage_max REAL,
+            PRIMARY KEY (tier, host_id, bucket)
+        ) WITHOUT ROWID
+    ''')
+    # Rebuilt on every init so it always matches TIERS. Duplicate samples are
+    # dropped by INSERT OR IGNORE before the trigger fires, so nothing counts twice.
+    upserts = "".join(f'''
+            INSERT INTO metrics_rollup VALUES (
+                {tier}, NEW.host_id, NEW.ts - NEW.ts % {tier}, 1,
+                NEW.cpu_usage, NEW.cpu_usage, NEW.cpu_usage,
+                NEW.mem_usage, NEW.mem_usage, NEW.mem_usage,
+                NEW.storage_usage, NEW.storage_usage, NEW.storage_usage
+            ) ON CONFLICT (tier, host_id, bucket) DO UPDATE SET
+                samples = samples + 1,
+                cpu_min = min(cpu_min, excluded.cpu_min), cpu_sum = cpu_sum + excluded.cpu_sum,
+                cpu_max = max(cpu_max, excluded.cpu_max),
+                mem_min = min(mem_min, excluded.mem_min), mem_sum = mem_sum + excluded.mem_sum,
+                mem_max = max(mem_max, excluded.mem_max),
+                storage_min = min(storage_min, excluded.storage_min),
+                storage_sum = storage_sum + excluded.storage_sum,
+                storage_max = max(storage_max, excluded.storage_max);''' for tier, _ in TIERS)
+    c.execute("DROP TRIGGER IF EXISTS metrics_raw_rollup")
+    c.execute(f"CREATE TRIGGER metrics_raw_rollup AFTER INSERT ON metrics_raw BEGIN {upserts}\n        END")
+
+
+def record_samples(samples, conn=None, prune=True):
+    """Appends samples; the rollup tiers are updated in the same transaction.
+
+    `samples` are (host_id, timestamp, cpu_usage, mem_usage, storage_usage). A
+    sample already stored for the same (host, second) is ignored.
+    """
+    def write(conn):
+        before = conn.total_changes
+        conn.executemany('''
+            INSERT OR IGNORE INTO metrics_raw (host_id, ts, cpu_usage, mem_usage, storage_usage)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [(host_id, to_epoch(ts), cpu, mem, storage) for host_id, ts, cpu, mem, storage in samples])
+        return (conn.total_changes - before) // (1 + len(TIERS))   # Trigger writes count too
+
+    written = db_manager._run_batch(conn, write)
+    if prune and time.monotonic() - _last_prune > PRUNE_INTERVAL_SECONDS:
+        prune_expired()
+    return written
+
+
+def prune_expired(now=None, conn=None):
+    """Deletes raw rows and rollup buckets older than their tier's retention."""
+    global _last_prune
+    now = to_epoch(now) if now is not None else int(time.time())
+
+    def write(conn):
+        deleted = conn.execute("DELETE FROM metrics_raw WHERE ts < ?", (now - RAW_RETENTION_SECONDS,)).rowcount
+        for tier, retention in TIERS:
+            deleted += conn.execute("DELETE FROM metrics_rollup WHERE tier = ? AND bucket < ?",
+                                    (tier, now - retention)).rowcount
+        return deleted
+
+    _last_prune = time.monotonic()
+    return db_manager._run_batch(conn, write)
+
+
+def choose_tier(start, end, max_points, now=None):
+    """0 (raw) or the bucket width to answer [start, end] with at most max_points rows."""
+    now = to_epoch(now) if now is not None else int(time.time())
+    if start >= now - RAW_RETENTION_SECONDS and (end - start) / 60 <= max_points:
+        return 0   # Short recent range: raw samples (collected at most ~once a minute)
+    for tier, retention in TIERS:
+        if start >= now - retention and (end - start) / tier <= max_points:
+            return tier
+    return TIERS[-1][0]
+
+
+def query_range(host_id, start, end, max_points=500, tier=None, now=None):
+    """Points for a host between start and end, oldest first.
+
+    Each point is a dict with 'ts', 'samples' and '<metric>_min/avg/max' for cpu,
+    mem and storage. Raw samples have min == avg == max.
+    """
+    start, end = to_epoch(start), to_epoch(end)
+    tier = choose_tier(start, end, max_points, now) if tier is None else tier
+    with db_manager.read_connection() as conn:
+        if tier == 0:
+            rows = conn.execute('''
+                SELECT ts, cpu_usage, mem_usage, storage_usage FROM metrics_raw
+                WHERE host_id = ? AND ts BETWEEN ? AND ? ORDER BY ts
+            ''', (host_id, start, end)).fetchall()
+            return [dict(ts=r['ts'], samples=1, **{
+                f"{m}_{agg}": r[f"{m}_usage"] for m in METRICS for agg in ('min', 'avg', 'max')
+            }) for r in rows]
+        rows = conn.execute('''
+            SELECT * FROM metrics_rollup
+            WHERE tier = ? AND host_id = ? AND bucket BETWEEN ? AND ? ORDER BY bucket
+        ''', (tier, host_id, start - start % tier, end)).fetchall()
+    return [dict(ts=r['bucket'], samples=r['samples'], **{
+        key: value for m in METRICS for key, value in (
+            (f"{m}_min", r[f"{m}_min"]),
+            (f"{m}_avg", round(r[f"{m}_sum"] / r['samples'], 2) if r['samples'] else None),
+            (f"{m}_max", r[f"{m}_max"]),
+        )
+    }) for r in rows]
@@ -1,4 +1,5 @@
-import re
+import ipaddress
+from urllib.parse import quote
 import streamlit as st
 import requests
 import streamlit_authenticator as stauth
@@ -7,13 +8,15 @@ import platform
 from concurrent.futures import ThreadPoolExecutor
 import time
 import os
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import pandas as pd # Added for easier DB to DF conversion
 
 
 # --- New Modules ---
 import db_manager
-import data_collector
+import dashboard_cache
+import ip_allocator
+import jobs
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -139,7 +142,15 @@ def get_theme_css(mode):
         border-radius: 4px;
         border: 1px solid #ccc;
     }
-    .ip-link { text-decoration: none; }
+    .ip-link, a.ip-box { text-decoration: none; }
+    a.ip-box { display: block; }
+    .ip-zone-grid {
+        grid-template-columns: repeat(auto-fill, minmax(44px, 1fr));
+        gap: 4px;
+        padding: 12px;
+    }
+    .ip-zone { padding: 6px 0; font-size: 0.8rem; }
+    .ip-current { outline: 3px solid #1565c0; outline-offset: 1px; }
     
     .ip-box {
         padding: 12px 0;
@@ -433,6 +444,22 @@ def get_server_os_info():
     """Detects the underlying OS of the Streamlit server."""
     return f"{platform.system()} {platform.release()}"
 
+def format_ips(ips):
+    return ", ".join(ips) if ips else "N/A"
+
+def format_ram(used_mb, total_mb):
+    if not total_mb:
+        return "N/A"
+    return f"{used_mb or 0} / {total_mb} MB ({round((used_mb or 0) / total_mb * 100, 1)}%)"
+
+def format_disks(disks):
+    return ", ".join(f"{d['label']} ({d['capacity_gb']}GB)" for d in disks) if disks else "N/A"
+
+def format_created(created_ts):
+    if created_ts is None:
+        return None
+    return datetime.fromtimestamp(created_ts, timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
+
 def get_color_from_percentage(percentage):
     """Returns a color based on the resource usage percentage."""
     if percentage > 90:
@@ -442,60 +469,109 @@ def get_color_from_percentage(percentage):
     return "green"
 
 # --- DB Fetchers (Read-Only wrappers) ---
+# Cached per collection generation (see dashboard_cache.py); results are shared
+# between sessions, so copy before modifying them.
+@dashboard_cache.cached
 def fetch_hosts_with_metrics():
-    conn = db_manager.get_db_connection()
-    # Left join to get all hosts even if no metrics yet
-    query = """
-    SELECT h.id, h.ip, hm.cpu_usage, hm.used_cpu_ghz, hm.total_cpu_ghz, 
-           hm.mem_usage, hm.used_mem_gb, hm.total_mem_gb, 
-           hm.storage_usage, hm.used_storage_gb, hm.total_storage_gb, hm.last_updated
-    FROM hosts h
-    LEFT JOIN host_metrics hm ON h.id = hm.host_id
-    """
-    hosts = conn.execute(query).fetchall()
-    conn.close()
-    return hosts
+    # All hosts, even those without metrics yet
+    return db_manager.hosts_with_metrics()
 
+@dashboard_cache.cached
 def fetch_vms_for_host(host_ip):
-    conn = db_manager.get_db_connection()
-    # Join to find host_id from ip
-    query = """
-    SELECT v.* 
-    FROM vms v
-    JOIN hosts h ON v.host_id = h.id
-    WHERE h.ip = ?
-    ORDER BY v.name
-    """
-    vms = conn.execute(query, (host_ip,)).fetchall()
-    conn.close()
-    return vms
-
-def fetch_all_vms(search_query=None, search_by="Name"):
-    conn = db_manager.get_db_connection()
-    base_query = """
-    SELECT v.*, h.ip as host_ip 
-    FROM vms v
-    JOIN hosts h ON v.host_id = h.id
-    """
-    vms = conn.execute(base_query).fetchall()
-    conn.close()
-    
-    results = []
-    for vm in vms:
-        match = False
-        if not search_query:
-            match = True
-        elif search_by == "Name" and search_query.lower() in vm['name'].lower():
-            match = True
-        elif search_by == "IP":
-             # Split stored IPs and check for exact match
-             stored_ips = [ip.strip() for ip in vm['ip'].split(',')]
-             if search_query in stored_ips:
-                 match = True
-        
-        if match:
-            results.append(dict(vm))
-    return results
+    return db_manager.host_vms(host_ip)[0]
+
+@dashboard_cache.cached
+def fetch_all_vms(search_query=None, search_by="Name", page=0):
+    """One page of VMs matching the search (see db_manager.search_vms) and the total match count."""
+    rows, total = db_manager.search_vms(search_query, search_by,
+                                        limit=db_manager.SEARCH_PAGE_SIZE, offset=page * db_manager.SEARCH_PAGE_SIZE)
+    return rows, total
+
+@dashboard_cache.cached
+def fetch_block_status(subnet, block):
+    """'1'/'0' per address of one /24 (or smaller) block: taken per the last scan."""
+    return ip_allocator.scan_status(subnet, ipaddress.IPv4Network(block))
+
+@dashboard_cache.cached
+def fetch_block_usage(subnet):
+    return tuple(ip_allocator.block_usage(subnet))
+
+@dashboard_cache.memoized
+def render_ip_grid(block, status, link_prefix):
+    """HTML of the IP grid for a block from its status array (one link per address)."""
+    first = int(ipaddress.IPv4Network(block).network_address)
+    cells = []
+    for offset, taken in enumerate(status):
+        ip = db_manager.int_to_ip(first + offset)
+        cells.append(f'<a href="{link_prefix}{ip}" target="_self" class="ip-box {"ip-taken" if taken == "1" else "ip-free"}" '
+                     f'title="{ip}">{ip.rsplit(".", 1)[1]}</a>')
+    return f'<div class="ip-grid">{"".join(cells)}</div>'
+
+@dashboard_cache.memoized
+def render_block_overview(usage, current_block, link_base):
+    """Zoomed-out grid for subnets larger than a /24: one cell per /24, green to red by use."""
+    cells = []
+    for block, taken, size in usage:
+        hue = round(120 * (1 - taken / size))
+        current = " ip-current" if block == current_block else ""
+        cells.append(f'<a href="{link_base}&block={quote(block, safe="")}" target="_self" class="ip-box ip-zone{current}" '
+                     f'style="background-color:hsl({hue},60%,35%)" title="{block}: {taken}/{size} taken">'
+                     f'{block.split(".")[2]}</a>')
+    return f'<div class="ip-grid ip-zone-grid">{"".join(cells)}</div>'
+
+# --- Background Jobs ---
+# Refreshes and bulk scans are queued (jobs.py) and run by background_job.py, so a
+# click returns at once and a second click, from any session, joins the job in flight.
+
+def start_job(kind, state_key, requested_by=None):
+    job_id, created = jobs.enqueue(kind, requested_by=requested_by)
+    st.session_state[state_key] = job_id
+    if not created:
+        st.toast("Already in progress, following the running job")
+
+def follow_job(kind, state_key, label):
+    """Shows the result of a finished job once, or the live status of the session's
+    (or anyone's) active job of this kind."""
+    result = st.session_state.pop(f"{state_key}_result", None)
+    if result:
+        status, message = result
+        if status == 'done':
+            st.success(f"{label} complete: {message}")
+        else:
+            st.error(f"{label} failed: {message}")
+    if state_key not in st.session_state:
+        job = jobs.active(kind)
+        if job is None:
+            return
+        st.session_state[state_key] = job['id']
+    job_status(state_key, label)
+
+@st.fragment(run_every=jobs.JOB_POLL_SECONDS)
+def job_status(state_key, label):
+    # Re-runs on its own every JOB_POLL_SECONDS without rerunning the page
+    job_id = st.session_state.get(state_key)
+    job = jobs.get(job_id) if job_id else None
+    if job is None or job['status'] in ('done', 'failed'):
+        st.session_state.pop(state_key, None)
+        if job is not None:
+            st.session_state[f"{state_key}_result"] = (job['status'], job['message'])
+            dashboard_cache.CACHE.clear()
+        st.rerun()
+    if job['status'] == 'queued':
+        st.info(f"{label} queued...")
+        if time.time() - job['created_at'] > 10:
+            st.warning("No worker has picked the job up yet; is background_job.py running?")
+        return
+    zones = jobs.job_detail(job)
+    if zones:
+        # Bulk scan: all zones run in parallel, one progress bar per zone
+        for subnet, (done, total) in zones.items():
+            state = "queued" if not total else "done" if done == total else f"{done}/{total} probed"
+            st.progress(done / total if total else 0.0, text=f"{subnet} — {state}")
+        return
+    done, total = job['progress_done'], job['progress_total']
+    text = f"{label}: {done}/{total}" + (f" — {job['message']}" if job['message'] else "")
+    st.progress(done / total if total else 0.0, text=text)
 
 def render_ip_map_page():
     st.title("IP Address Management")
@@ -506,26 +582,28 @@ def render_ip_map_page():
         st.info("🟢 Green = Available | 🔴 Red = Taken (In Use)")
     with col2:
         if st.button("🔄 Scan ALL Zones", key="refresh_all_ips"):
-            with st.spinner("Scanning ALL configured subnets... This may take a while."):
-                data_collector.scan_all_subnets()
-            st.success("Bulk scan complete!")
-            st.rerun()
+            start_job('scan_subnets', 'scan_job', st.session_state.get('username'))
+
+    # The scan runs in background_job.py; this only follows it
+    follow_job('scan_subnets', 'scan_job', "Bulk scan")
 
     # --- Subnet Management ---
     with st.expander("⚙️ Manage Subnets"):
         m_col1, m_col2 = st.columns([1, 2])
         with m_col1:
             with st.form("add_subnet_form", clear_on_submit=True):
-                new_subnet = st.text_input("Add Subnet (e.g., 192.168.50)", help="Enter the first 3 octets")
+                new_subnet = st.text_input("Add Subnet (e.g., 10.20.0.0/22)",
+                                           help=f"CIDR from /{db_manager.MIN_SUBNET_PREFIX} to /{db_manager.MAX_SUBNET_PREFIX}; "
+                                                "three octets (x.x.x) mean a /24")
                 if st.form_submit_button("Add"):
-                    if new_subnet and re.match(r"^\d{1,3}\.\d{1,3}\.\d{1,3}$", new_subnet):
+                    try:
                         if db_manager.add_subnet(new_subnet):
-                            st.success(f"Added {new_subnet}")
+                            st.success(f"Added {db_manager.parse_subnet(new_subnet)}")
                             st.rerun()
                         else:
-                            st.error("Subnet already exists.")
-                    else:
-                        st.error("Invalid format. Use x.x.x")
+                            st.error("Subnet already exists or lies inside a configured subnet.")
+                    except ValueError as e:
+                        st.error(f"Invalid subnet: {e}")
         
         with m_col2:
             st.write("Configured Subnets:")
@@ -570,31 +648,48 @@ def render_ip_map_page():
     # Check if subnet changed
     if selected_subnet != st.session_state.selected_subnet:
         st.session_state.selected_subnet = selected_subnet
-        if "inspect_ip" in st.query_params:
-            del st.query_params["inspect_ip"]
+        st.query_params.pop("inspect_ip", None)
+        st.query_params.pop("block", None)
         st.query_params["subnet"] = selected_subnet
         st.rerun()
     
     if st.query_params.get("subnet") != selected_subnet:
         st.query_params["subnet"] = selected_subnet
 
-    # --- Load Data from DB ---
-    conn = db_manager.get_db_connection()
-    rows = conn.execute("SELECT ip, status FROM network_scans WHERE subnet = ?", (selected_subnet,)).fetchall()
-    conn.close()
-    
-    active_ips = {row['ip'] for row in rows if row['status'] == 'taken'}
-
-    # --- Inspection Logic (Triggered by URL) ---
+    # Subnets larger than a /24 are shown one /24 block at a time
+    network = db_manager.parse_subnet(selected_subnet)
+    blocks = list(network.subnets(new_prefix=24)) if network.prefixlen < 24 else [network]
+    block_names = [str(b) for b in blocks]
     inspect_ip = query_params.get("inspect_ip", None)
+    if len(blocks) > 1:
+        block_key = f"block_selector_{selected_subnet}"
+        # Follow the URL: the block of the inspected IP, else the block of the clicked grid
+        url_block = next((name for name, b in zip(block_names, blocks) if db_manager.ip_to_int(inspect_ip or '') is not None
+                          and ipaddress.IPv4Address(inspect_ip) in b), query_params.get("block"))
+        if url_block in block_names and (inspect_ip or block_key not in st.session_state):
+            st.session_state[block_key] = url_block
+
+        def on_block_change():
+            st.query_params.pop("inspect_ip", None)
+            st.query_params["block"] = st.session_state[block_key]
+
+        block = blocks[block_names.index(st.selectbox(
+            f"Block ({len(blocks)} × /24):", block_names, key=block_key, on_change=on_block_change
+        ))]
+    else:
+        block = blocks[0]
+
+    # --- Load Data from DB (precomputed scan bitmap) ---
+    status = fetch_block_status(selected_subnet, str(block))
 
+    # --- Inspection Logic (Triggered by URL) ---
     if inspect_ip:
-        if inspect_ip.startswith(selected_subnet):
+        if db_manager.ip_to_int(inspect_ip) is not None and ipaddress.IPv4Address(inspect_ip) in block:
             st.divider()
             st.subheader(f"Details for {inspect_ip}")
             
             # DB Search
-            found_vms = fetch_all_vms(inspect_ip, "IP")
+            found_vms, _ = fetch_all_vms(inspect_ip, "IP")
             
             if found_vms:
                 for vm in found_vms:
@@ -611,11 +706,11 @@ def render_ip_map_page():
                     with col1:
                         st.write(f"**OS:** {vm['os']}")
                         st.write(f"**CPU:** {vm['cpu_count']} vCPUs")
-                        st.write(f"**RAM:** {vm['ram_info']}")
+                        st.write(f"**RAM:** {format_ram(vm['ram_used_mb'], vm['ram_total_mb'])}")
                     with col2:
                         st.write(f"**Host:** {vm['host_ip']}")
                         st.write(f"**Disks:**")
-                        st.text(vm['disk_info'])
+                        st.text(format_disks(vm['disks']))
                     
                     if st.button(f"Go to Host {vm['host_ip']}", key=f"btn_host_{inspect_ip}"):
                         st.session_state.host = vm['host_ip']
@@ -623,7 +718,7 @@ def render_ip_map_page():
                         st.query_params["page"] = "dashboard"
                         st.rerun()
             else:
-                if inspect_ip in active_ips:
+                if status[int(ipaddress.IPv4Address(inspect_ip)) - int(block.network_address)] == '1':
                     st.warning(f"IP {inspect_ip} is active (pingable) but no VM was found with this IP in the DB.")
                 else:
                     st.info(f"IP {inspect_ip} is available (no ping response).")
@@ -639,24 +734,23 @@ def render_ip_map_page():
             st.rerun()
 
     # --- HTML/CSS Grid Rendering ---
-    grid_html = '<div class="ip-grid">'
-    for i in range(256):
-        current_ip = f"{selected_subnet}.{i}"
-        
-        if current_ip in active_ips:
-            status_class = "ip-taken"
-            tooltip = f"{current_ip} (Taken)"
-        else:
-            status_class = "ip-free"
-            tooltip = f"{current_ip} (Available)"
-            
-        # Ensure theme is preserved in the link
-        current_theme = st.session_state.get('theme', 'Light')
-        link = f"?page=ip_management&subnet={selected_subnet}&inspect_ip={current_ip}&theme={current_theme}"
-        grid_html += f'<a href="{link}" target="_self" class="ip-link"><div class="ip-box {status_class}" title="{tooltip}">{i}</div></a>'
-    
-    grid_html += '</div>'
-    st.markdown(grid_html, unsafe_allow_html=True)
+    # Built once per distinct status array and link target; reruns reuse the fragment
+    current_theme = st.session_state.get('theme', 'Light')
+    link_base = f"?page=ip_management&subnet={quote(selected_subnet, safe='')}&theme={current_theme}"
+    if len(blocks) > 1:
+        st.caption("Zone overview: one cell per /24, redder = more addresses taken. Click a cell to zoom in.")
+        st.markdown(render_block_overview(fetch_block_usage(selected_subnet), str(block), link_base),
+                    unsafe_allow_html=True)
+    st.markdown(render_ip_grid(str(block), status, f"{link_base}&block={quote(str(block), safe='')}&inspect_ip="),
+                unsafe_allow_html=True)
+
+@dashboard_cache.cached
+def fetch_recent_vms(start_date, end_date, page=0):
+    """One page of VMs created between the two dates (whole UTC days) and the total count."""
+    start_ts = int(datetime.combine(start_date, datetime.min.time(), timezone.utc).timestamp())
+    end_ts = int(datetime.combine(end_date + timedelta(days=1), datetime.min.time(), timezone.utc).timestamp()) - 1
+    return db_manager.recent_vms(start_ts, end_ts, limit=db_manager.SEARCH_PAGE_SIZE,
+                                 offset=page * db_manager.SEARCH_PAGE_SIZE)
 
 def render_recent_vms_page():
     st.title("🕒 Recently Created VMs")
@@ -671,34 +765,23 @@ def render_recent_vms_page():
         st.error("Error: End date must fall after start date.")
         return
 
-    # Fetch from DB
-    conn = db_manager.get_db_connection()
-    # SQLite stores dates as strings usually, need to be careful with comparison
-    # Ideally stored as ISO8601 strings YYYY-MM-DD...
-    # We will fetch all and filter in python for flexibility with string formats or do exact range query if formats align
-    query = """
-    SELECT v.*, h.ip as host_ip 
-    FROM vms v
-    JOIN hosts h ON v.host_id = h.id
-    WHERE v.created_date IS NOT NULL
-    """
-    vms = conn.execute(query).fetchall()
-    conn.close()
+    if st.session_state.get("recent_vms_key") != (start_date, end_date):
+        st.session_state.recent_vms_key = (start_date, end_date)
+        st.session_state.recent_vms_page = 0
+        st.session_state.pop("recent_vms_page_input", None)
+    page = st.session_state.get("recent_vms_page", 0)
+    found_vms, total_found = fetch_recent_vms(start_date, end_date, page)
+    page_count = max(1, -(-total_found // db_manager.SEARCH_PAGE_SIZE))
 
-    found_vms = []
-    for vm in vms:
-        c_date_str = vm['created_date']
-        if not c_date_str: continue
-        try:
-            # Handle potential 'Z' or offsets
-            dt = datetime.fromisoformat(c_date_str.replace('Z', '+00:00'))
-            if start_date <= dt.date() <= end_date:
-                found_vms.append(dict(vm))
-        except ValueError:
-            pass
-    
     if found_vms:
-        st.success(f"Found {len(found_vms)} VMs created in the selected period (Data from DB).")
+        shown = len(found_vms)
+        st.success(f"Found {total_found} VMs created in the selected period"
+                   f"{f' (showing {shown}, newest first)' if shown < total_found else ''} (Data from DB).")
+        if page_count > 1:
+            st.number_input(f"Page (of {page_count})", min_value=1, max_value=page_count,
+                            value=min(page, page_count - 1) + 1, key="recent_vms_page_input",
+                            on_change=lambda: st.session_state.update(
+                                recent_vms_page=st.session_state.recent_vms_page_input - 1))
         display_data = []
         for vm in found_vms:
             state_raw = vm['power_state']
@@ -710,13 +793,13 @@ def render_recent_vms_page():
                 state_display = f"⚪ {state_raw}"
 
             display_data.append({
-                "VM IP": vm['ip'],
+                "VM IP": format_ips(vm['ips']),
                 "ESXi Host": vm['host_ip'],
                 "Name": vm['name'],
-                "Created": vm['created_date'],
-                "RAM": vm['ram_info'],
+                "Created": format_created(vm['created_ts']),
+                "RAM": format_ram(vm['ram_used_mb'], vm['ram_total_mb']),
                 "CPU": vm['cpu_count'],
-                "Storage": vm['disk_info'],
+                "Storage": format_disks(vm['disks']),
                 "State": state_display
             })
         st.dataframe(display_data, use_container_width=True)
@@ -762,8 +845,7 @@ def display_host_details(host_ip):
 
     if vms:
         search_query = st.text_input("Search for a VM by name:", key=f"search_{host_ip}")
-        # Convert sqlite rows to dicts for filtering
-        vms_list = [dict(vm) for vm in vms]
+        vms_list = vms
         if search_query:
             vms_list = [vm for vm in vms_list if search_query.lower() in vm["name"].lower()]
         
@@ -781,11 +863,11 @@ def display_host_details(host_ip):
             display_vms.append({
                 "Name": vm['name'],
                 "OS": vm['os'],
-                "IP": vm['ip'],
+                "IP": format_ips(vm['ips']),
                 "CPU (vCPUs)": vm['cpu_count'],
-                "RAM": vm['ram_info'],
-                "Disks": vm['disk_info'],
-                "Created": vm['created_date'],
+                "RAM": format_ram(vm['ram_used_mb'], vm['ram_total_mb']),
+                "Disks": format_disks(vm['disks']),
+                "Created": format_created(vm['created_ts']),
                 "State": state_display
             })
             
@@ -966,16 +1048,16 @@ def main():
                 st.query_params["theme"] = st.session_state.theme
                 st.rerun()
         
+            with st.expander("Cache stats"):
+                st.json(dashboard_cache.cache_stats())
+
         st.divider()
         authenticator.logout('🚪 LOGOUT', location='sidebar')
         st.divider()
         
         if st.button("🔄 Refresh Data", use_container_width=True):
-             with st.spinner("Refreshing..."):
-                 data_collector.update_all_hosts()
-             st.success("Refreshed!")
-             time.sleep(0.5)
-             st.rerun()
+            start_job('refresh_hosts', 'refresh_job', username)
+        follow_job('refresh_hosts', 'refresh_job', "Refresh")
              
 
 
@@ -997,18 +1079,33 @@ def main():
             search_by = st.selectbox("Search by:", ["Name", "IP"], key="search_by")
             query = st.text_input(f"Enter VM {search_by} to find its ESXi host:", key="vm_search")
 
-            # Local search in DB
+            # Indexed search in DB, one page at a time
+            total_found = 0
             if query:
-                st.session_state.found_vms = fetch_all_vms(query, search_by)
+                if st.session_state.get("vm_search_key") != (query, search_by):
+                    st.session_state.vm_search_key = (query, search_by)
+                    st.session_state.vm_search_page = 0
+                    st.session_state.pop("vm_search_page_input", None)
+                search_page = st.session_state.get("vm_search_page", 0)
+                st.session_state.found_vms, total_found = fetch_all_vms(query, search_by, search_page)
+                page_count = max(1, -(-total_found // db_manager.SEARCH_PAGE_SIZE))
+                if page_count > 1:
+                    st.number_input(f"Page (of {page_count})", min_value=1, max_value=page_count,
+                                    value=min(search_page, page_count - 1) + 1, key="vm_search_page_input",
+                                    on_change=lambda: st.session_state.update(
+                                        vm_search_page=st.session_state.vm_search_page_input - 1))
             else:
                 st.session_state.found_vms = None
+                st.session_state.vm_search_page = 0
 
             if st.session_state.found_vms:
-                st.success(f"Found {len(st.session_state.found_vms)} VMs matching your query:")
+                shown = len(st.session_state.found_vms)
+                st.success(f"Found {total_found} VMs matching your query"
+                           f"{f' (showing {shown})' if shown < total_found else ''}:")
                 for i, vm in enumerate(st.session_state.found_vms):
                     col1, col2 = st.columns([3, 1])
                     with col1:
-                        st.write(f"**VM Name:** {vm['name']} | **VM IP:** {vm['ip']} | **ESXi Host:** {vm['host_ip']}")
+                        st.write(f"**VM Name:** {vm['name']} | **VM IP:** {format_ips(vm['ips'])} | **ESXi Host:** {vm['host_ip']}")
                     with col2:
                         if st.button("View Host", key=f"view_host_{i}_{vm['name']}"):
                             st.session_state.host = vm['host_ip']
@@ -0,0 +1,312 @@
+import heapq
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import data_collector
+import db_manager
+import jobs
+import telemetry
+
+# --- Adaptive Collection Scheduler ---
+# Replaces "collect every host, then sleep an hour". Each host is its own task with
+# its own next-run time:
+#   - normal hosts are collected every HOST_INTERVAL_SECONDS
+#   - hosts near the CPU/memory thresholds every HOT_HOST_INTERVAL_SECONDS
+#   - unreachable hosts back off exponentially up to BACKOFF_MAX_SECONDS
+#   - every delay gets +/- JITTER_FRACTION, and first runs are spread over
+#     STARTUP_SPREAD_SECONDS, so hosts don't all hit the network at once
+# Subnet scans are separate tasks in their own lane, so a long scan never holds a
+# host collection slot. Time comes from an injectable clock (see FakeClock).
+
+HOST_INTERVAL_SECONDS = 3600       # Cadence for healthy hosts (the old fixed loop)
+HOT_HOST_INTERVAL_SECONDS = 300    # Cadence for hosts near a threshold
+HOT_THRESHOLD_PERCENT = 70         # CPU or memory usage that counts as "near" (dashboard turns orange)
+BACKOFF_BASE_SECONDS = 120         # First retry delay for an unreachable host, doubled per failure
+BACKOFF_MAX_SECONDS = 4 * 3600
+JITTER_FRACTION = 0.1
+STARTUP_SPREAD_SECONDS = 60
+SCAN_INTERVAL_SECONDS = 900        # Incremental sweep of all subnets
+HOST_REFRESH_SECONDS = 300         # Re-read the hosts table for added/removed hosts
+LANE_LIMITS = {'collect': 10, 'scan': 1, 'control': 1, 'jobs': 1}   # Concurrent tasks per lane
+TELEMETRY_FLUSH_SECONDS = 60       # Write per-host phase timings to last_cycle_stats
+PROGRESS_POLL_SECONDS = 1.0        # Refresh jobs re-check their host tasks this often
+
+
+class FakeClock:
+    """Manual clock for exercising the scheduler without waiting: pass
+    `clock=fake.now, sleep=fake.sleep` and run with `inline=True`."""
+
+    def __init__(self, start=0.0):
+        self.t = start
+
+    def now(self):
+        return self.t
+
+    def sleep(self, seconds):
+        self.t += max(0.0, seconds)
+
+
+class Task:
+    """A schedulable unit. `fn()` runs the work and returns the delay (seconds)
+    until the next run, or None to drop the task."""
+
+    def __init__(self, key, fn, lane, next_run):
+        self.key = key
+        self.fn = fn
+        self.lane = lane
+        self.next_run = next_run
+        self.running = False
+        self.runs = 0
+
+
+class Scheduler:
+    """Runs due tasks with per-lane concurrency caps."""
+
+    def __init__(self, clock=time.monotonic, sleep=None, lane_limits=None, inline=False, rng=None):
+        self.clock = clock
+        self.lane_limits = dict(lane_limits or LANE_LIMITS)
+        self.inline = inline                  # Run tasks in the caller (fake-clock runs)
+        self.rng = rng or random.Random()
+        self.tasks = {}
+        self._heap = []                       # (next_run, seq, key)
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._finished = threading.Condition(self._lock)   # Notified whenever a task run ends
+        self._wakeup = threading.Event()
+        self._sleep = sleep or (lambda seconds: self._wakeup.wait(seconds))
+        self._executor = None if inline else ThreadPoolExecutor(max_workers=sum(self.lane_limits.values()))
+
+    def jittered(self, delay):
+        return delay * (1 + self.rng.uniform(-JITTER_FRACTION, JITTER_FRACTION))
+
+    def add(self, key, fn, lane='collect', delay=0.0):
+        with self._lock:
+            if key in self.tasks:
+                return
+            task = self.tasks[key] = Task(key, fn, lane, self.clock() + delay)
+            self._push(task)
+
+    def remove(self, key):
+        with self._lock:
+            self.tasks.pop(key, None)       # Stale heap entries are skipped when popped
+
+    def _push(self, task):
+        self._seq += 1
+        heapq.heappush(self._heap, (task.next_run, self._seq, task.key))
+
+    def _running(self, lane):
+        return sum(1 for t in self.tasks.values() if t.running and t.lane == lane)
+
+    def _finish(self, task, delay):
+        with self._lock:
+            task.running = False
+            task.runs += 1
+            if delay is None:
+                self.tasks.pop(task.key, None)
+            elif self.tasks.get(task.key) is task:   # Not removed while it ran
+                task.next_run = self.clock() + self.jittered(delay)
+                self._push(task)
+            self._finished.notify_all()
+        self._wakeup.set()
+
+    def _execute(self, task):
+        try:
+            delay = task.fn()
+        except Exception as e:
+            print(f"[{datetime.now()}] Task {task.key} failed: {e}")
+            delay = BACKOFF_BASE_SECONDS
+        self._finish(task, delay)
+
+    def run_pending(self):
+        """Starts every due task its lane has room for. Returns the number started."""
+        now = self.clock()
+        due, deferred = [], []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                run_at, _, key = heapq.heappop(self._heap)
+                task = self.tasks.get(key)
+                if task is None or task.running or run_at != task.next_run:
+                    continue                  # Removed, running, or rescheduled (run_now)
+                if self._running(task.lane) >= self.lane_limits.get(task.lane, 1):   # Counts `due` too
+                    deferred.append(task)     # Lane full: stays due, retried on the next completion
+                    continue
+                task.running = True
+                due.append(task)
+            for task in deferred:
+                self._push(task)
+        for task in due:
+            if self.inline:
+                self._execute(task)
+            else:
+                self._executor.submit(self._execute, task)
+        return len(due)
+
+    def run_now(self, keys):
+        """Makes the given tasks due immediately, still subject to their lane limits.
+        A task that is running right now is not queued again: its current run counts.
+        Returns a token for runs_done / wait_for_runs."""
+        targets = {}
+        with self._lock:
+            now = self.clock()
+            for key in keys:
+                task = self.tasks.get(key)
+                if task is None:
+                    continue
+                targets[key] = (task, task.runs + 1)
+                if not task.running and task.next_run > now:
+                    task.next_run = now
+                    self._push(task)
+        self._wakeup.set()
+        return targets
+
+    def runs_done(self, targets):
+        """Keys of a run_now token whose run has finished (or whose task was removed)."""
+        with self._lock:
+            return [key for key, (task, runs) in targets.items()
+                    if self.tasks.get(key) is not task or task.runs >= runs]
+
+    def wait_for_runs(self, targets, timeout):
+        """Blocks until every run of a run_now token finished or `timeout` seconds
+        passed (wall time, for threaded schedulers). Returns runs_done."""
+        with self._finished:
+            self._finished.wait_for(lambda: all(
+                self.tasks.get(key) is not task or task.runs >= runs for key, (task, runs) in targets.items()
+            ), timeout)
+        return self.runs_done(targets)
+
+    def seconds_until_next(self):
+        """Time until the next task that could start; tasks in a full lane wait for a completion."""
+        with self._lock:
+            full = {lane for lane, limit in self.lane_limits.items() if self._running(lane) >= limit}
+            idle = [t.next_run for t in self.tasks.values() if not t.running and t.lane not in full]
+        return max(0.0, min(idle) - self.clock()) if idle else None
+
+    def run_until(self, deadline=None, stop_event=None):
+        """Main loop. Returns at `deadline` (clock time) or when `stop_event` is set."""
+        while not (stop_event and stop_event.is_set()):
+            self._wakeup.clear()
+            self.run_pending()
+            wait = self.seconds_until_next()
+            if deadline is not None:
+                remaining = deadline - self.clock()
+                if remaining <= 0:
+                    break
+                wait = remaining if wait is None else min(wait, remaining)
+            # A completion sets _wakeup, freeing a lane slot or rescheduling a task
+            self._sleep(60.0 if wait is None else wait)
+
+    def shutdown(self):
+        if self._executor:
+            self._executor.shutdown(wait=True)
+
+
+# --- Host / Scan Policies ---
+
+def next_host_delay(collected, failures, metrics):
+    """Delay until a host's next collection. `failures` counts consecutive misses."""
+    if not collected:
+        return min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (failures - 1))
+    if metrics and max(metrics['cpu_usage'] or 0, metrics['mem_usage'] or 0) >= HOT_THRESHOLD_PERCENT:
+        return HOT_HOST_INTERVAL_SECONDS
+    return HOST_INTERVAL_SECONDS
+
+
+def _latest_metrics(host_id):
+    with db_manager.read_connection() as conn:
+        return conn.execute(
+            "SELECT cpu_usage, mem_usage FROM host_metrics WHERE host_id = ? ORDER BY id DESC LIMIT 1", (host_id,)
+        ).fetchone()
+
+
+def host_task(host_row, collect=None, metrics=None):
+    """Task function for one host. `collect`/`metrics` default to the real collector and DB."""
+    collect = collect or (lambda row: data_collector.collect_host_data(
+        row, time.monotonic() + data_collector.HOST_DEADLINE_SECONDS))
+    metrics = metrics or _latest_metrics
+    state = {'failures': 0}
+
+    def run():
+        collected = collect(host_row) is not None
+        state['collected'] = collected
+        telemetry.end_cycle([host_row['ip']])   # Written by the next telemetry-flush task
+        state['failures'] = 0 if collected else state['failures'] + 1
+        delay = next_host_delay(collected, state['failures'], metrics(host_row['id']) if collected else None)
+        if state['failures']:
+            print(f"[{datetime.now()}] Host {host_row['ip']} unreachable ({state['failures']}x), retrying in {delay:.0f}s")
+        return delay
+    run.state = state     # Outcome of the latest run, read by refresh_job
+    return run
+
+
+def scan_task(scan=None):
+    scan = scan or (lambda: data_collector.scan_all_subnets(incremental=True))
+
+    def run():
+        scan()
+        return SCAN_INTERVAL_SECONDS
+    return run
+
+
+def sync_host_tasks(scheduler, hosts, collect=None, metrics=None):
+    """Adds tasks for new hosts (first runs spread over STARTUP_SPREAD_SECONDS) and
+    drops tasks of hosts that are gone."""
+    keys = set()
+    for host_row in hosts:
+        key = f"host:{host_row['ip']}"
+        keys.add(key)
+        scheduler.add(key, host_task(host_row, collect, metrics), 'collect',
+                      delay=scheduler.rng.uniform(0, STARTUP_SPREAD_SECONDS))
+    for key in [k for k in scheduler.tasks if k.startswith("host:") and k not in keys]:
+        scheduler.remove(key)
+
+
+def refresh_job(scheduler):
+    """Handler for the dashboard's refresh_hosts job in scheduled mode. Instead of a
+    separate full cycle (its own thread pool, racing the host tasks for the same
+    hosts), it makes every host task due now, so the collections go through the
+    collect lane, and reports as they finish."""
+    def run(report):
+        targets = scheduler.run_now([key for key in list(scheduler.tasks) if key.startswith("host:")])
+        while True:
+            done = scheduler.wait_for_runs(targets, timeout=PROGRESS_POLL_SECONDS)
+            report(len(done), len(targets))    # Also the job's heartbeat while hosts wait for a slot
+            if len(done) == len(targets):
+                break
+        failed = [key[len("host:"):] for key, (task, _) in targets.items()
+                  if not getattr(task.fn, 'state', {}).get('collected', True)]
+        message = f"{len(targets) - len(failed)} of {len(targets)} hosts collected"
+        return message + (f"; unreachable: {', '.join(failed)}" if failed else "")
+    return run
+
+
+def build_scheduler(**kwargs):
+    """Scheduler with one task per host in the DB, the subnet scan, a host-list
+    refresh, the telemetry flush and the dashboard's job queue."""
+    scheduler = Scheduler(**kwargs)
+
+    def refresh_hosts():
+        with db_manager.read_connection() as conn:
+            hosts = conn.execute("SELECT * FROM hosts").fetchall()
+        sync_host_tasks(scheduler, hosts)
+        return HOST_REFRESH_SECONDS
+
+    refresh_hosts()
+    scheduler.add("refresh-hosts", refresh_hosts, 'control', delay=HOST_REFRESH_SECONDS)
+    scheduler.add("scan:all", scan_task(), 'scan', delay=scheduler.rng.uniform(0, STARTUP_SPREAD_SECONDS))
+
+    def flush_telemetry():
+        telemetry.flush()
+        return TELEMETRY_FLUSH_SECONDS
+
+    scheduler.add("telemetry-flush", flush_telemetry, 'control', delay=TELEMETRY_FLUSH_SECONDS)
+
+    handlers = {'refresh_hosts': refresh_job(scheduler)}
+
+    def run_jobs():
+        jobs.run_pending(handlers)
+        return jobs.JOB_POLL_SECONDS
+
+    scheduler.add("jobs", run_jobs, 'jobs')
+    return scheduler
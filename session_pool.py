@@ -0,0 +1,259 @@
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pyVim import connect
+from pyVmomi import vim
+import telemetry
+
+# --- ESXi Session Pool ---
+# Keeps one logged-in ServiceInstance per host IP across collection cycles instead of
+# a SmartConnect (TLS handshake + login + RetrieveContent) and Disconnect per cycle.
+# A daemon thread pings idle sessions with CurrentTime so they don't hit the ESXi
+# session timeout (30 min by default), and an expired session is logged back in
+# transparently. ServiceContent and container views are cached per session.
+
+SESSION_KEEPALIVE_SECONDS = 600   # Ping sessions idle for longer than this
+SESSION_MAX_RETRIES = 1           # Re-login attempts per call after NotAuthenticated
+
+
+def is_auth_error(error):
+    """True if `error` means the session is gone (expired, logged out, host rebooted)."""
+    return isinstance(error, (vim.fault.NotAuthenticated, ConnectionError))
+
+
+class HostSession:
+    """One pooled, logged-in ServiceInstance with its cached content and views."""
+
+    def __init__(self, ip, user, password, connector):
+        self.ip = ip
+        self.user = user
+        self.password = password
+        self._connector = connector
+        self.si = None
+        self._content = None
+        self._views = {}
+        self.lock = threading.Lock()       # One caller at a time per session
+        self.connect_seconds = 0.0         # Cost of the last full connect
+        self.last_used = 0.0
+        self.reused = False                # Current caller skipped the connect
+        self.round_trips = 0               # SOAP requests sent over this session
+        self.abandoned = False             # Dropped from the pool while in use (host timed out)
+        self._in_flight = set()            # HTTP connections checked out of the stub's pool
+
+    def login(self):
+        """(Re)connects; returns False if the host refused or was unreachable."""
+        self.logout()
+        start = time.perf_counter()
+        self.si = self._connector(self.ip, self.user, self.password)
+        self.connect_seconds = time.perf_counter() - start
+        self.last_used = time.monotonic()
+        telemetry.observe('host_connect', self.ip, self.connect_seconds)
+        if self.si is not None:
+            self._count_round_trips(self.si._stub)
+            self._track_connections(self.si._stub)
+        return self.si is not None
+
+    def _count_round_trips(self, stub):
+        """Wraps the stub's two request entry points (method calls and lazy property
+        reads); every SOAP request of this session goes through one of them."""
+        def counted(invoke):
+            def wrapper(*args, **kwargs):
+                self.round_trips += 1
+                return invoke(*args, **kwargs)
+            return wrapper
+        stub.InvokeMethod = counted(stub.InvokeMethod)
+        stub.InvokeAccessor = counted(stub.InvokeAccessor)
+
+    def _track_connections(self, stub):
+        """Records the HTTP connections requests are using right now, which the
+        stub's DropConnections() doesn't reach (it only closes idle ones)."""
+        if not hasattr(stub, 'GetConnection'):
+            return
+        get_connection, return_connection = stub.GetConnection, stub.ReturnConnection
+
+        def checked_out():
+            conn = get_connection()
+            # Connections closed on an error path are never returned: forget them here
+            self._in_flight = {c for c in self._in_flight if c.sock is not None}
+            self._in_flight.add(conn)
+            return conn
+
+        def returned(conn):
+            self._in_flight.discard(conn)
+            return return_connection(conn)
+        stub.GetConnection = checked_out
+        stub.ReturnConnection = returned
+
+    def interrupt(self):
+        """Unblocks a request stuck waiting on the host: shuts down the sockets of
+        in-flight requests (they fail with a connection error) and drops idle ones."""
+        for conn in list(self._in_flight):
+            try:
+                if conn.sock is not None:
+                    conn.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        stub = getattr(self.si, '_stub', None)
+        try:
+            if hasattr(stub, 'DropConnections'):
+                stub.DropConnections()
+        except Exception:
+            pass
+
+    def logout(self, remote=True):
+        """Ends the session. With remote=False nothing is sent to the host (one that
+        stopped answering); its server side expires on the ESXi session timeout."""
+        if self.si is not None:
+            try:
+                if remote:
+                    connect.Disconnect(self.si)
+                else:
+                    self.interrupt()
+            except Exception:
+                pass
+        self.si = None
+        self._content = None
+        self._views = {}
+
+    @property
+    def content(self):
+        if self._content is None:
+            self._content = self.si.RetrieveContent()
+        return self._content
+
+    def view(self, obj_type):
+        """Cached recursive ContainerView of `obj_type` under the root folder.
+        Container views track inventory changes, so they stay valid for the session."""
+        key = getattr(obj_type, '_wsdlName', None) or str(obj_type)
+        if key not in self._views:
+            self._views[key] = self.content.viewManager.CreateContainerView(self.content.rootFolder, [obj_type], True)
+        return self._views[key]
+
+    def keepalive(self):
+        """Cheap round trip that resets the server-side idle timer."""
+        try:
+            self.si.CurrentTime()
+            self.last_used = time.monotonic()
+        except Exception as e:
+            if not is_auth_error(e):
+                raise
+            print(f"[{datetime.now()}] Session for {self.ip} expired, logging in again.")
+            self.login()
+
+
+class SessionPool:
+    """Sessions keyed by host IP. Use `run(ip, user, password, fn)` to call fn(session)."""
+
+    def __init__(self, connector, keepalive_seconds=SESSION_KEEPALIVE_SECONDS):
+        self._connector = connector
+        self.keepalive_seconds = keepalive_seconds
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._keepalive_thread = None
+        self._stop = threading.Event()
+        self.saved_seconds = 0.0           # Connect time avoided by reusing sessions
+
+    def _get(self, ip, user, password):
+        with self._lock:
+            session = self._sessions.get(ip)
+            if session is None or (session.user, session.password) != (user, password):
+                if session is not None:
+                    session.logout()
+                session = self._sessions[ip] = HostSession(ip, user, password, self._connector)
+            return session
+
+    @contextmanager
+    def session(self, ip, user, password):
+        """Yields a logged-in HostSession (or None if login failed), held exclusively."""
+        session = self._get(ip, user, password)
+        with session.lock:
+            session.reused = session.si is not None
+            if session.reused:
+                print(f"Reusing session for {ip} (saves ~{session.connect_seconds * 1000:.0f} ms connect)")
+            elif session.login():
+                print(f"Connected to {ip} in {session.connect_seconds * 1000:.0f} ms (new pooled session)")
+                self._start_keepalive()
+            try:
+                yield session if session.si is not None else None
+            finally:
+                session.last_used = time.monotonic()
+                if session.abandoned:
+                    session.logout(remote=False)    # The pool already has a fresh session for this host
+
+    def run(self, ip, user, password, fn):
+        """Calls fn(session), logging in again and retrying once if the session expired.
+        Returns None if the host can't be logged into."""
+        for attempt in range(SESSION_MAX_RETRIES + 1):
+            with self.session(ip, user, password) as session:
+                if session is None:
+                    return None
+                try:
+                    result = fn(session)
+                    if session.reused:
+                        with self._lock:
+                            self.saved_seconds += session.connect_seconds
+                    return result
+                except Exception as e:
+                    # An abandoned session was interrupted on purpose: don't log in again
+                    if session.abandoned or not is_auth_error(e) or attempt == SESSION_MAX_RETRIES:
+                        raise
+                    print(f"Session for {ip} was no longer valid ({e}); logging in again.")
+                    session.logout()
+
+    def abandon(self, ip):
+        """Drops a host's session without waiting for its current user (a call
+        stuck past its deadline). The stuck call's socket is shut down, so it fails
+        instead of holding its collector thread until the host answers. The next
+        caller logs in on a new session; the old one is dropped, without a Logout
+        round trip, when the stuck call returns."""
+        with self._lock:
+            session = self._sessions.pop(ip, None)
+        if session is None:
+            return
+        session.abandoned = True
+        session.interrupt()
+
+    def keepalive_once(self):
+        """Pings every idle session; busy sessions are in use and skipped."""
+        now = time.monotonic()
+        with self._lock:
+            sessions = list(self._sessions.values())
+        for session in sessions:
+            if session.si is None or now - session.last_used < self.keepalive_seconds:
+                continue
+            if not session.lock.acquire(blocking=False):
+                continue
+            try:
+                session.keepalive()
+            except Exception as e:
+                print(f"Keepalive for {session.ip} failed: {e}")
+                session.logout()
+            finally:
+                session.lock.release()
+
+    def _keepalive_loop(self, stop):
+        while not stop.wait(self.keepalive_seconds / 2):
+            self.keepalive_once()
+
+    def _start_keepalive(self):
+        with self._lock:
+            if self._keepalive_thread is None:
+                self._keepalive_thread = threading.Thread(target=self._keepalive_loop, args=(self._stop,), name="esxi-keepalive", daemon=True)
+                self._keepalive_thread.start()
+
+    def take_saved_seconds(self):
+        """Returns and resets the connect time saved since the last call."""
+        with self._lock:
+            saved, self.saved_seconds = self.saved_seconds, 0.0
+        return saved
+
+    def close_all(self):
+        self._stop.set()
+        with self._lock:
+            sessions, self._sessions = list(self._sessions.values()), {}
+            self._keepalive_thread, self._stop = None, threading.Event()
+        for session in sessions:
+            with session.lock:
+                session.logout()
@@ -0,0 +1,205 @@
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import db_manager
+
+# --- Collector Telemetry ---
+# Timing spans and counters for the collector's hot path, each tagged with a phase
+# and a scope (host IP, subnet CIDR, or "cycle" for whole-cycle totals).
+#   host_connect / host_retrieve / host_process / host_db_write   per host
+#   subnet_sweep / subnet_db_write                                 per subnet
+#   counters: soap_round_trips, vm_rows_written, host_failures, probes, scan_rows_written
+# Recording is a perf_counter pair plus a dict update under a lock (about a
+# microsecond), and there is one span per phase, never one per VM or per probe.
+# Totals since process start are served as Prometheus text by serve_metrics().
+# The collector calls end_cycle(scopes) when a host's or subnet's collection is
+# complete; that snapshots the scope's values for that one cycle, and flush()
+# replaces the scope's rows in last_cycle_stats with the snapshot, so the DB always
+# shows each host's and subnet's most recent complete collection.
+
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108
+METRIC_PREFIX = "esxi_collector"
+
+_lock = threading.Lock()
+_spans = {}       # (phase, scope) -> [count, total seconds, max seconds]
+_counters = {}    # (name, scope) -> total
+_pending = {}     # (scope, phase) -> [count, seconds], since the scope's last end_cycle
+_finished = {}    # scope -> {phase: [count, seconds]}, its latest complete cycle not yet flushed
+
+
+def create_schema(c):
+    """Stats of each scope's latest complete cycle, per phase (called by db_manager.init_db)."""
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS last_cycle_stats (
+            scope TEXT NOT NULL,
+            phase TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            seconds REAL,
+            recorded_at INTEGER NOT NULL,
+            PRIMARY KEY (scope, phase)
+        ) WITHOUT ROWID
+    ''')
+
+
+def observe(phase, scope, seconds, count=1):
+    with _lock:
+        stats = _spans.get((phase, scope))
+        if stats is None:
+            _spans[(phase, scope)] = [count, seconds, seconds]
+        else:
+            stats[0] += count
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+        pending = _pending.setdefault((scope, phase), [0, 0.0])
+        pending[0] += count
+        pending[1] += seconds
+
+
+@contextmanager
+def span(phase, scope=""):
+    """Times the block as one `phase` sample for `scope` (recorded on errors too)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(phase, scope, time.perf_counter() - start)
+
+
+def incr(name, scope="", value=1):
+    with _lock:
+        _counters[(name, scope)] = _counters.get((name, scope), 0) + value
+        pending = _pending.setdefault((scope, name), [0, None])
+        pending[0] += value
+
+
+def take_pending():
+    """Returns and clears what was recorded since the last call (or end_cycle), as
+    (scope, phase, count, seconds) rows; seconds is None for counters."""
+    with _lock:
+        rows = [(scope, phase, count, seconds) for (scope, phase), (count, seconds) in _pending.items()]
+        _pending.clear()
+    return rows
+
+
+def merge(rows):
+    """Adds rows from take_pending() of another process (collector_pool workers)."""
+    for scope, phase, count, seconds in rows:
+        if seconds is None:
+            incr(phase, scope, count)
+        else:
+            observe(phase, scope, seconds, count)
+
+
+def end_cycle(scopes):
+    """Closes the current cycle of each scope: what it recorded since its last
+    end_cycle becomes its last-cycle snapshot, replacing an unflushed older one.
+    Scopes that recorded nothing keep their previous snapshot."""
+    with _lock:
+        for scope in scopes:
+            phases = {phase: _pending.pop((s, phase)) for s, phase in list(_pending) if s == scope}
+            if phases:
+                _finished[scope] = phases
+
+
+def flush(conn=None):
+    """Writes the snapshots of cycles ended since the last flush into
+    last_cycle_stats, replacing each scope's previous rows. Returns rows written."""
+    with _lock:
+        finished = dict(_finished)
+        _finished.clear()
+    if not finished:
+        return 0
+    now = int(time.time())
+    rows = [(scope, phase, count, seconds, now)
+            for scope, phases in finished.items() for phase, (count, seconds) in phases.items()]
+
+    def write(conn):
+        conn.executemany('DELETE FROM last_cycle_stats WHERE scope = ?', [(scope,) for scope in finished])
+        conn.executemany('''
+            INSERT INTO last_cycle_stats (scope, phase, count, seconds, recorded_at) VALUES (?, ?, ?, ?, ?)
+        ''', rows)
+        return len(rows)
+    return db_manager._run_batch(conn, write, bump_generation=False)   # Bookkeeping, not collected data
+
+
+def last_cycle_stats(scope=None):
+    """Rows of last_cycle_stats as dicts, optionally for one scope."""
+    with db_manager.read_connection() as conn:
+        if scope is None:
+            rows = conn.execute('SELECT * FROM last_cycle_stats ORDER BY scope, phase').fetchall()
+        else:
+            rows = conn.execute('SELECT * FROM last_cycle_stats WHERE scope = ? ORDER BY phase', (scope,)).fetchall()
+    return [dict(row) for row in rows]
+
+
+# --- Prometheus Text Format ---
+
+def _labels(**labels):
+    escaped = {key: str(value).replace('\\', '\\\\').replace('"', '\\"') for key, value in labels.items()}
+    return ",".join(f'{key}="{value}"' for key, value in escaped.items())
+
+
+def render_prometheus():
+    """Totals since process start in the Prometheus text exposition format."""
+    with _lock:
+        spans = sorted((key, list(stats)) for key, stats in _spans.items())
+        counters = sorted(_counters.items())
+    lines = [
+        f"# HELP {METRIC_PREFIX}_phase_seconds Time spent per collector phase and scope.",
+        f"# TYPE {METRIC_PREFIX}_phase_seconds summary",
+    ]
+    for (phase, scope), (count, total, _) in spans:
+        labels = _labels(phase=phase, scope=scope)
+        lines.append(f"{METRIC_PREFIX}_phase_seconds_count{{{labels}}} {count}")
+        lines.append(f"{METRIC_PREFIX}_phase_seconds_sum{{{labels}}} {total:.6f}")
+    lines.append(f"# HELP {METRIC_PREFIX}_phase_seconds_max Slowest single sample per phase and scope.")
+    lines.append(f"# TYPE {METRIC_PREFIX}_phase_seconds_max gauge")
+    for (phase, scope), (_, _, longest) in spans:
+        lines.append(f"{METRIC_PREFIX}_phase_seconds_max{{{_labels(phase=phase, scope=scope)}}} {longest:.6f}")
+    for name in sorted({name for (name, _), _ in counters}):
+        lines.append(f"# TYPE {METRIC_PREFIX}_{name}_total counter")
+        for (counter, scope), value in counters:
+            if counter == name:
+                lines.append(f"{METRIC_PREFIX}_{name}_total{{{_labels(scope=scope)}}} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def render_last_cycle(rows):
+    """last_cycle_stats rows (dicts) as Prometheus gauges."""
+    lines = [f"# TYPE {METRIC_PREFIX}_last_cycle_seconds gauge"]
+    lines += [f"{METRIC_PREFIX}_last_cycle_seconds{{{_labels(phase=r['phase'], scope=r['scope'])}}} {r['seconds']:.6f}"
+              for r in rows if r['seconds'] is not None]
+    lines.append(f"# TYPE {METRIC_PREFIX}_last_cycle_count gauge")
+    lines += [f"{METRIC_PREFIX}_last_cycle_count{{{_labels(phase=r['phase'], scope=r['scope'])}}} {r['count']}"
+              for r in rows]
+    lines.append(f"# TYPE {METRIC_PREFIX}_last_cycle_timestamp_seconds gauge")
+    lines += [f"{METRIC_PREFIX}_last_cycle_timestamp_seconds{{{_labels(phase=r['phase'], scope=r['scope'])}}} "
+              f"{r['recorded_at']}" for r in rows]
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass    # Scrapes every few seconds would drown the collector's log
+
+
+def serve_metrics(host=METRICS_HOST, port=METRICS_PORT):
+    """Serves GET /metrics from a daemon thread; returns the server (call shutdown() to stop)."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    print(f"Serving collector metrics on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the repository root, next to this directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db_manager
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """Points db_manager at a fresh, initialised database instead of monitoring.db."""
+    monkeypatch.setattr(db_manager, "DB_FILE", str(tmp_path / "test.db"))
+    db_manager.init_db()
+    yield db_manager.DB_FILE
+    db_manager.close_thread_connections()
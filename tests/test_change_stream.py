@@ -0,0 +1,119 @@
+import time
+
+import pytest
+
+import change_stream
+import data_collector
+import db_manager
+from vsphere_simulator import VSphereSimulator
+
+HOST = "10.0.0.1"
+
+
+@pytest.fixture
+def sim(db):
+    sim = VSphereSimulator()
+    sim.add_host(HOST, datastores=[(2048, 1024), (1024, 256)])
+    for i in range(5):
+        sim.add_vm(HOST, f"vm-{i}", ips=[f"10.1.0.{i + 1}"])
+    db_manager.bulk_upsert_hosts([(HOST, "root", "x", "test")])
+    return sim
+
+
+@pytest.fixture
+def stream(sim):
+    with db_manager.read_connection() as conn:
+        host_row = conn.execute("SELECT * FROM hosts WHERE ip = ?", (HOST,)).fetchone()
+    stream = change_stream.HostChangeStream(host_row, sim.connect(HOST))
+    stream.start()
+    assert stream.poll(0)
+    assert stream.flush()['inserted'] == 5
+    yield stream
+    stream.stop()
+
+
+def _vm(name):
+    with db_manager.read_connection() as conn:
+        return conn.execute("SELECT * FROM vms WHERE name = ?", (name,)).fetchone()
+
+
+def _vm_ips(name):
+    with db_manager.read_connection() as conn:
+        return [row['ip'] for row in conn.execute(
+            "SELECT i.ip FROM vm_ips i JOIN vms v ON v.id = i.vm_id WHERE v.name = ? ORDER BY i.ip", (name,))]
+
+
+def test_initial_sync_writes_inventory_and_host_metrics(stream):
+    assert _vm("vm-3")['ram_used_mb'] == 1024
+    assert _vm_ips("vm-3") == ["10.1.0.4"]
+    with db_manager.read_connection() as conn:
+        metrics = conn.execute("SELECT * FROM host_metrics").fetchone()
+    assert metrics['total_storage_gb'] == 3072
+
+
+def test_vm_change_writes_only_that_vm(sim, stream):
+    mo_id = next(iter(sim.hosts[HOST].vms))
+    sim.update_vm(HOST, mo_id, summary__quickStats__guestMemoryUsage=3000)
+    with db_manager.read_connection() as conn:
+        before = dict(conn.execute("SELECT name, last_updated FROM vms").fetchall())
+
+    assert stream.poll(0)
+    changes = stream.flush()
+    assert (changes['inserted'], changes['updated'], changes['deleted']) == (0, 1, 0)
+    assert _vm("vm-0")['ram_used_mb'] == 3000
+    with db_manager.read_connection() as conn:
+        untouched = conn.execute("SELECT name, last_updated FROM vms WHERE name != 'vm-0'").fetchall()
+    assert all(before[row['name']] == row['last_updated'] for row in untouched)
+
+
+def test_added_and_removed_vms(sim, stream):
+    first = next(iter(sim.hosts[HOST].vms))
+    sim.add_vm(HOST, "vm-new", ips=["10.1.0.99"])
+    sim.remove_vm(HOST, first)
+
+    assert stream.poll(0)
+    changes = stream.flush()
+    assert (changes['inserted'], changes['deleted']) == (1, 1)
+    assert _vm("vm-0") is None
+    assert _vm_ips("vm-new") == ["10.1.0.99"]
+
+
+def test_host_change_updates_metrics(sim, stream):
+    sim.update_host(HOST, summary__quickStats__overallCpuUsage=41600)   # Half of 32 x 2600 MHz
+    assert stream.poll(0)
+    stream.flush()
+    with db_manager.read_connection() as conn:
+        assert conn.execute("SELECT cpu_usage FROM host_metrics").fetchone()[0] == 50.0
+
+
+def test_truncated_batches_are_drained_in_one_poll(sim, stream, monkeypatch):
+    monkeypatch.setattr(change_stream, "STREAM_MAX_OBJECT_UPDATES", 2)
+    for mo_id in sim.hosts[HOST].vms:
+        sim.update_vm(HOST, mo_id, summary__config__numCpu=8)
+    sim.calls.clear()
+
+    assert stream.poll(0)
+    assert sim.calls['WaitForUpdatesEx'] == 3
+    assert stream.flush()['updated'] == 5
+
+
+def test_poll_without_changes_returns_false(stream):
+    assert not stream.poll(0)
+
+
+def test_stream_host_applies_changes_until_stopped(sim, stream, monkeypatch):
+    monkeypatch.setattr(data_collector, "connect_host", sim.connect)
+    threads, stop = change_stream.run_change_streams(max_wait_seconds=1)
+    try:
+        mo_id = list(sim.hosts[HOST].vms)[2]
+        deadline = time.monotonic() + 10
+        while _vm("vm-2")['ram_used_mb'] != 2048 and time.monotonic() < deadline:
+            sim.update_vm(HOST, mo_id, summary__quickStats__guestMemoryUsage=2048)
+            time.sleep(0.05)
+        assert _vm("vm-2")['ram_used_mb'] == 2048
+    finally:
+        stop.set()
+        for t in threads:
+            t.join(timeout=5)
+    assert not any(t.is_alive() for t in threads)
+    assert sim.calls['Logout'] >= 1
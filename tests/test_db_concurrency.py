@@ -0,0 +1,77 @@
+import threading
+from datetime import datetime
+
+import db_manager
+import jobs
+
+WRITERS = 4
+WRITES = 20
+VMS = 50
+READERS = 4
+
+
+def _vm_rows(host_id, round_no):
+    now = datetime.now()
+    return [
+        (host_id, f"uuid-{host_id}-{i}", f"vm-{host_id}-{i}-r{round_no}", "Ubuntu Linux (64-bit)", 4, 2048, 8192,
+         int(now.timestamp()), "poweredOn", now, (f"10.{host_id}.0.{i}",), (("Hard disk 1", 40.0),))
+        for i in range(VMS)
+    ]
+
+
+def test_concurrent_writers_and_readers_never_lock(db):
+    db_manager.bulk_upsert_hosts([(f"10.0.0.{i}", "root", "x", "g") for i in range(1, WRITERS + 1)])
+    job_id, _ = jobs.enqueue('refresh_hosts')
+    before = db_manager.get_generation()
+    stop = threading.Event()
+    errors, reads = [], []
+
+    def guarded(fn):
+        def run(*args):
+            try:
+                fn(*args)
+            except Exception as e:    # "database is locked" is an OperationalError
+                errors.append(e)
+            finally:
+                db_manager.close_thread_connections()
+        return run
+
+    @guarded
+    def writer(host_id):
+        for round_no in range(WRITES):
+            db_manager.bulk_replace_vms(host_id, _vm_rows(host_id, round_no))
+
+    @guarded
+    def job_writer():
+        for done in range(WRITES):
+            jobs.progress(job_id, done, WRITES)
+
+    @guarded
+    def reader():
+        while not stop.is_set():
+            with db_manager.read_connection() as conn:
+                reads.append(conn.execute(
+                    "SELECT COUNT(*) FROM vms v JOIN vm_ips i ON i.vm_id = v.id").fetchone()[0])
+
+    readers = [threading.Thread(target=reader) for _ in range(READERS)]
+    writers = [threading.Thread(target=writer, args=(i,)) for i in range(1, WRITERS + 1)]
+    writers.append(threading.Thread(target=job_writer))
+    for t in readers + writers:
+        t.start()
+    for t in writers:
+        t.join()
+    stop.set()
+    for t in readers:
+        t.join()
+
+    assert errors == []
+    assert reads
+    # Every snapshot landed as one transaction (one bump each), the last one is stored
+    assert db_manager.get_generation() == before + WRITERS * WRITES
+    with db_manager.read_connection() as conn:
+        for host_id in range(1, WRITERS + 1):
+            names = {row[0] for row in conn.execute("SELECT name FROM vms WHERE host_id = ?", (host_id,))}
+            assert names == {f"vm-{host_id}-{i}-r{WRITES - 1}" for i in range(VMS)}
+        assert conn.execute("SELECT COUNT(*) FROM vm_ips").fetchone()[0] == WRITERS * VMS
+    # Readers only ever saw whole snapshots
+    assert all(count % VMS == 0 for count in reads)
@@ -0,0 +1,30 @@
+import db_manager
+import jobs
+
+
+def test_job_bookkeeping_keeps_the_generation(db):
+    before = db_manager.get_generation()
+    job_id, created = jobs.enqueue('refresh_hosts')
+    assert created
+    assert jobs.claim_next()['id'] == job_id
+    jobs.progress(job_id, 1, 2, "halfway")
+    jobs.finish(job_id)
+    assert db_manager.get_generation() == before
+
+
+def test_collected_data_bumps_once_per_transaction(db):
+    before = db_manager.get_generation()
+    db_manager.bulk_upsert_hosts([("10.0.0.1", "root", "x", "g"), ("10.0.0.2", "root", "x", "g")])
+    assert db_manager.get_generation() == before + 1
+
+    # Nothing changed: no bump
+    db_manager.bulk_upsert_scan_results([])
+    assert db_manager.get_generation() == before + 1
+
+    # A nested block asking for the bump applies it to the enclosing transaction
+    with db_manager.connection() as conn:
+        jobs.enqueue('scan_subnets')
+        db_manager.bulk_upsert_hosts([("10.0.0.3", "root", "x", "g")], conn=conn)
+        with db_manager.connection(bump_generation=True):
+            pass
+    assert db_manager.get_generation() == before + 2
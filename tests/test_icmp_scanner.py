@@ -0,0 +1,97 @@
+import asyncio
+import collections
+import socket
+import struct
+
+import pytest
+
+import data_collector
+import db_manager
+import icmp_scanner
+
+
+class FakeResponder:
+    """Datagram-ICMP-like socket: addresses in `alive` answer each echo request
+    `answers` times. A socketpair provides the readiness the event loop watches."""
+
+    def __init__(self, alive, answers=1):
+        self.alive = alive
+        self.answers = answers
+        self.sent = collections.Counter()
+        self._replies = collections.deque()
+        self._wake, self._ready = socket.socketpair()
+        self._ready.setblocking(False)
+
+    def fileno(self):
+        return self._ready.fileno()
+
+    def sendto(self, packet, addr):
+        ip = addr[0]
+        self.sent[ip] += 1
+        _type, _code, _checksum, ident, seq = struct.unpack('!BBHHH', packet[:8])
+        if ip in self.alive:
+            reply = struct.pack('!BBHHH', icmp_scanner.ICMP_ECHO_REPLY, 0, 0, ident, seq) + packet[8:]
+            for _ in range(self.answers):
+                self._replies.append((reply, (ip, 0)))
+                self._wake.send(b'x')
+        return len(packet)
+
+    def recvfrom(self, size):
+        self._ready.recv(1)     # BlockingIOError once every reply was read
+        return self._replies.popleft()
+
+    def close(self):
+        self._wake.close()
+        self._ready.close()
+
+
+def _sweeper(responder, **kwargs):
+    return icmp_scanner.ICMPSweeper(timeout=0.2, rate_limit=0, sock_factory=lambda: (responder, False), **kwargs)
+
+
+def test_sweep_matches_replies_to_targets():
+    ips = [f"10.0.0.{i}" for i in range(1, 21)]
+    responder = FakeResponder(alive={"10.0.0.2", "10.0.0.17"}, answers=2)   # Duplicate replies are ignored
+    settled = []
+    results = asyncio.run(_sweeper(responder).sweep_async(ips, on_result=lambda ip, up: settled.append(ip)))
+    assert results == {ip: ip in responder.alive for ip in ips}
+    assert sorted(settled) == sorted(ips)
+    assert set(responder.sent.values()) == {1}
+
+
+def test_silent_targets_are_retried():
+    responder = FakeResponder(alive={"10.0.0.1"})
+    results = _sweeper(responder, retries=2).sweep(["10.0.0.1", "10.0.0.9"])
+    assert results == {"10.0.0.1": True, "10.0.0.9": False}
+    assert responder.sent == {"10.0.0.1": 1, "10.0.0.9": 3}
+
+
+class _NoReaderLoop(asyncio.SelectorEventLoop):
+    """Stands in for the Windows Proactor loop, which has no add_reader."""
+
+    def add_reader(self, fd, callback, *args):
+        raise NotImplementedError
+
+
+def test_loop_without_add_reader_raises_oserror():
+    responder = FakeResponder(alive=set())
+    loop = _NoReaderLoop()
+    try:
+        with pytest.raises(OSError):
+            loop.run_until_complete(_sweeper(responder).sweep_async(["10.0.0.1"]))
+    finally:
+        loop.close()
+    assert responder._ready.fileno() == -1     # Socket closed
+
+
+def test_scan_falls_back_to_ping_when_icmp_is_unavailable(db, monkeypatch):
+    async def unavailable(self):
+        raise NotImplementedError
+    monkeypatch.setattr(icmp_scanner.ICMPSweeper, 'open', unavailable)
+    monkeypatch.setattr(data_collector, 'scan_ip', lambda ip: (ip, ip.endswith('.3')))
+    db_manager.add_subnet("10.7.0.0/28")
+
+    stats = data_collector.scan_subnets(["10.7.0.0/28"])
+    assert stats['probed'] == 14
+    history = db_manager.get_scan_history("10.7.0.0/28")
+    assert [ip for ip, row in history.items() if row['status'] == 'taken'] == ["10.7.0.3"]
@@ -0,0 +1,28 @@
+import data_collector
+import db_manager
+import jobs
+
+
+def test_scan_job_keeps_progress_per_zone(db, monkeypatch):
+    for subnet in ("10.1.0.0/28", "10.2.0.0/28"):
+        db_manager.add_subnet(subnet)
+    seen = []
+
+    def fake_scan(progress_callback=None, incremental=False):
+        progress_callback("10.1.0.0/28", 7, 14)
+        seen.append(jobs.job_detail(jobs.get(job_id)))
+        progress_callback("10.1.0.0/28", 14, 14)
+        progress_callback("10.2.0.0/28", 14, 14)
+        seen.append(jobs.job_detail(jobs.get(job_id)))
+        return {'probed': 28, 'skipped': 0, 'written': 28}
+    monkeypatch.setattr(data_collector, 'scan_all_subnets', fake_scan)
+    monkeypatch.setattr(jobs, 'PROGRESS_MIN_INTERVAL', 0)
+
+    job_id, _ = jobs.enqueue('scan_subnets')
+    assert jobs.run_pending() == 1
+    assert seen == [
+        {"10.1.0.0/28": [7, 14], "10.2.0.0/28": [0, 0]},
+        {"10.1.0.0/28": [14, 14], "10.2.0.0/28": [14, 14]},
+    ]
+    job = jobs.get(job_id)
+    assert (job['status'], job['progress_done'], job['progress_total']) == ('done', 28, 28)
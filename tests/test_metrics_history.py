@@ -0,0 +1,21 @@
+import metrics_history
+
+DAY = 86400
+NOW = 1_700_000_000
+
+
+def test_ranges_beyond_the_raw_window_read_rollups():
+    assert metrics_history.choose_tier(NOW - 3600, NOW, 500, now=NOW) == 0
+    assert metrics_history.choose_tier(NOW - DAY, NOW, 500, now=NOW) == 300
+    assert metrics_history.choose_tier(NOW - 7 * DAY, NOW, 500, now=NOW) == 3600
+    assert metrics_history.choose_tier(NOW - 30 * DAY, NOW, 500, now=NOW) == 86400
+    assert metrics_history.choose_tier(NOW - 365 * DAY, NOW, 500, now=NOW) == 86400
+
+
+def test_week_query_stays_within_max_points(db):
+    samples = [(1, ts, 50.0 + ts % 7, 40.0, 30.0) for ts in range(NOW - 7 * DAY, NOW + 1, 300)]
+    metrics_history.record_samples(samples, prune=False)
+    points = metrics_history.query_range(1, NOW - 7 * DAY, NOW, max_points=500, now=NOW)
+    assert len(points) <= 500
+    assert sum(point['samples'] for point in points) == len(samples)
+    assert all(p['cpu_min'] <= p['cpu_avg'] <= p['cpu_max'] for p in points)
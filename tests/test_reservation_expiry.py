@@ -0,0 +1,39 @@
+import time
+
+import pytest
+
+import api_server
+import db_manager
+import ip_allocator
+
+SUBNET = "10.9.0.0/28"
+
+
+def test_lapsed_reservation_changes_the_etag(db, monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(time, 'time', lambda: now[0])
+    db_manager.add_subnet(SUBNET)
+    client = api_server.app.test_client()
+    url = f"/api/subnets/{SUBNET}/free?limit=100"
+
+    reserved = client.post(f"/api/subnets/{SUBNET}/allocate?count=2&ttl=60").get_json()['items']
+    first = client.get(url)
+    assert not set(reserved) & {row['ip'] for row in first.get_json()['items']}
+    assert client.get(url, headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+
+    now[0] += 61
+    after = client.get(url, headers={'If-None-Match': first.headers['ETag']})
+    assert after.status_code == 200
+    assert after.headers['ETag'] != first.headers['ETag']
+    assert set(reserved) <= {row['ip'] for row in after.get_json()['items']}
+    assert ip_allocator.sweep_expired() == 0
+
+
+def test_non_positive_ttl_is_rejected(db):
+    db_manager.add_subnet(SUBNET)
+    for ttl in (0, -5):
+        with pytest.raises(ValueError):
+            ip_allocator.allocate(SUBNET, ttl=ttl)
+    assert ip_allocator.reservations(SUBNET) == []
+    response = api_server.app.test_client().post(f"/api/subnets/{SUBNET}/allocate?count=1&ttl=0")
+    assert response.status_code == 400
@@ -0,0 +1,141 @@
+import random
+
+import pytest
+
+import background_job
+import scheduler
+from scheduler import FakeClock, Scheduler
+
+
+class NoJitter(random.Random):
+    def uniform(self, a, b):
+        return 0.0
+
+
+def _scheduler(clock, rng=None, lane_limits=None):
+    return Scheduler(clock=clock.now, sleep=clock.sleep, inline=True, rng=rng or NoJitter(),
+                     lane_limits=lane_limits)
+
+
+def test_lane_limits_cap_tasks_started_together():
+    clock = FakeClock()
+    sched = _scheduler(clock, lane_limits={'collect': 2, 'scan': 1})
+    started = []
+    for i in range(5):
+        sched.add(f"host-{i}", lambda i=i: started.append(f"host-{i}") or 60)
+    sched.add("scan", lambda: started.append("scan") or 60, 'scan')
+
+    assert sched.run_pending() == 3      # Two collect slots plus the scan lane
+    assert sorted(started) == ["host-0", "host-1", "scan"]
+    assert sched.run_pending() == 2      # Deferred hosts stay due
+    assert sched.run_pending() == 1
+    assert sched.run_pending() == 0
+    assert sched.seconds_until_next() == 60
+
+
+def test_jitter_spreads_runs_around_the_delay():
+    clock = FakeClock()
+    sched = _scheduler(clock, rng=random.Random(7))
+    runs = []
+    sched.add("host", lambda: runs.append(clock.now()) or 100)
+    sched.run_until(deadline=100 * 50)
+
+    gaps = [b - a for a, b in zip(runs, runs[1:])]
+    assert len(gaps) > 40
+    assert all(100 * (1 - scheduler.JITTER_FRACTION) <= gap <= 100 * (1 + scheduler.JITTER_FRACTION) for gap in gaps)
+    assert len({round(gap, 6) for gap in gaps}) > 1
+
+
+def test_unreachable_host_backs_off_then_recovers():
+    clock = FakeClock()
+    sched = _scheduler(clock)
+    outcomes = iter([None] * 8 + [{'inserted': 0}] * 2)
+    runs = []
+
+    def collect(row):
+        runs.append(clock.now())
+        return next(outcomes)
+    host = {'id': 1, 'ip': '10.0.0.1'}
+    sched.add("host:10.0.0.1", scheduler.host_task(host, collect, metrics=lambda host_id: {'cpu_usage': 90, 'mem_usage': 10}))
+    sched.run_until(deadline=20 * 3600)
+
+    gaps = [b - a for a, b in zip(runs, runs[1:])]
+    base = scheduler.BACKOFF_BASE_SECONDS
+    # Failures 1-7 double the wait up to the cap; the first success reschedules as a hot host
+    assert gaps[:8] == [min(base * 2 ** n, scheduler.BACKOFF_MAX_SECONDS) for n in range(8)]
+    assert gaps[8] == scheduler.HOT_HOST_INTERVAL_SECONDS
+
+
+def test_failing_task_is_retried_after_the_base_backoff():
+    clock = FakeClock()
+    sched = _scheduler(clock)
+    runs = []
+
+    def broken():
+        runs.append(clock.now())
+        raise RuntimeError("boom")
+    sched.add("broken", broken)
+    sched.run_until(deadline=2.5 * scheduler.BACKOFF_BASE_SECONDS)
+    assert runs == [0.0, scheduler.BACKOFF_BASE_SECONDS, 2 * scheduler.BACKOFF_BASE_SECONDS]
+
+
+def test_background_job_flags():
+    args = background_job.parse_args(["--once", "--processes", "4", "--metrics-port", "9200", "--async"])
+    assert (args.once, args.stream, args.processes, args.metrics_port, args.use_async) == (True, False, 4, 9200, True)
+    defaults = background_job.parse_args([])
+    assert (defaults.processes, defaults.no_metrics, defaults.use_async) == (0, False, False)
+    for argv in (["--metrics-port"], ["--processes"], ["--processes", "x"], ["--once", "--stream"]):
+        with pytest.raises(SystemExit):
+            background_job.parse_args(argv)
+
+
+def test_refresh_job_collects_through_the_collect_lane():
+    import threading
+    import time
+
+    sched = Scheduler(lane_limits={'collect': 2})
+    lock = threading.Lock()
+    running, peak, collected = [0], [0], []
+
+    def collect(row):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+            collected.append(row['ip'])
+        return None if row['ip'] == '10.0.0.3' else {'inserted': 0}
+    hosts = [{'id': i, 'ip': f'10.0.0.{i}'} for i in range(1, 7)]
+    scheduler.sync_host_tasks(sched, hosts, collect, metrics=lambda host_id: None)
+    stop = threading.Event()
+    loop = threading.Thread(target=sched.run_until, kwargs={'stop_event': stop})
+    loop.start()
+    try:
+        reports = []
+        message = scheduler.refresh_job(sched)(lambda done, total: reports.append((done, total)))
+    finally:
+        stop.set()
+        sched._wakeup.set()
+        loop.join()
+        sched.shutdown()
+
+    # Every host once, never more than the lane allows at a time, well before the startup spread
+    assert sorted(collected) == sorted(host['ip'] for host in hosts)
+    assert peak[0] <= 2
+    assert reports[-1] == (6, 6)
+    assert message == "5 of 6 hosts collected; unreachable: 10.0.0.3"
+
+
+def test_run_now_replaces_the_pending_run():
+    clock = FakeClock()
+    sched = _scheduler(clock)
+    runs = []
+    sched.add("host", lambda: runs.append(clock.now()) or 500, delay=100)
+    clock.sleep(10)
+    targets = sched.run_now(["host"])
+    assert sched.runs_done(targets) == []
+    sched.run_until(deadline=400)
+    # The originally planned run at t=100 is gone, the next one follows the forced run
+    assert runs == [10.0]
+    assert sched.runs_done(targets) == ["host"]
@@ -0,0 +1,56 @@
+import socket
+import threading
+import time
+
+import pytest
+from pyVmomi import SoapStubAdapter, vim
+
+import session_pool
+
+
+@pytest.fixture
+def silent_host():
+    """TCP endpoint that accepts connections and never answers."""
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen()
+    accepted = []
+
+    def accept():
+        while True:
+            try:
+                accepted.append(server.accept()[0])
+            except OSError:
+                return
+    threading.Thread(target=accept, daemon=True).start()
+    yield server.getsockname()[1]
+    server.close()
+    for conn in accepted:
+        conn.close()
+
+
+def test_abandon_interrupts_the_in_flight_request(silent_host):
+    def connector(ip, user, password):
+        stub = SoapStubAdapter(host=ip, port=-silent_host, version='vim.version.version8')   # Negative port: plain HTTP
+        return vim.ServiceInstance('ServiceInstance', stub)
+    pool = session_pool.SessionPool(connector)
+    outcome = {}
+
+    def stuck_call():
+        start = time.monotonic()
+        try:
+            pool.run('127.0.0.1', 'root', 'x', lambda session: session.si.CurrentTime())
+        except Exception as e:
+            outcome['error'] = e
+        outcome['seconds'] = time.monotonic() - start
+    thread = threading.Thread(target=stuck_call)
+    thread.start()
+    time.sleep(0.3)
+    assert thread.is_alive()
+
+    pool.abandon('127.0.0.1')
+    thread.join(5)
+    assert not thread.is_alive()
+    assert isinstance(outcome['error'], ConnectionError)
+    assert outcome['seconds'] < 3
+    pool.close_all()
@@ -0,0 +1,98 @@
+import pytest
+from pyVmomi import vim
+
+import data_collector
+import db_manager
+import session_pool
+from vsphere_simulator import SimulatedFarm, VSphereSimulator
+
+# Collection against vsphere_simulator, through real pyVmomi objects
+
+
+@pytest.fixture
+def farm(db, monkeypatch):
+    farm = SimulatedFarm(page_size=25, hosts=4, vms_per_host=30, datastores=2, nics_per_vm=2)
+    monkeypatch.setattr(data_collector, "connect_host", farm)
+    db_manager.bulk_upsert_hosts([(ip, "root", "x", "test") for ip in farm.host_ips()])
+    yield farm
+    data_collector.SESSION_POOL.close_all()
+
+
+def _row_counts():
+    with db_manager.read_connection() as conn:
+        return {table: conn.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+                for table in ("host_metrics", "vms", "vm_ips", "vm_disks")}
+
+
+def test_cycle_collects_every_simulated_host(farm):
+    totals = data_collector.update_all_hosts()
+    assert totals['inserted'] == 120
+    assert totals['timed_out'] == {}
+    assert _row_counts() == {'host_metrics': 4, 'vms': 120, 'vm_ips': 240, 'vm_disks': 240}
+
+    with db_manager.read_connection() as conn:
+        vm = conn.execute("SELECT * FROM vms WHERE name = 'vm-0-0'").fetchone()
+    assert (vm['os'], vm['cpu_count'], vm['ram_total_mb'], vm['power_state']) == \
+        ("Ubuntu Linux (64-bit)", 1, 1024, "poweredOn")
+
+
+def test_second_cycle_reuses_sessions_and_writes_only_changes(farm):
+    data_collector.update_all_hosts()
+    ip = farm.host_ips()[0]
+    farm.sim.update_vm(ip, next(iter(farm.sim.hosts[ip].vms)), summary__config__numCpu=16)
+    farm.sim.calls.clear()
+
+    totals = data_collector.update_all_hosts()
+    assert (totals['updated'], totals['unchanged']) == (1, 119)
+    assert farm.sim.calls['Login'] == 0
+    assert farm.sim.calls['RetrievePropertiesEx'] == 4
+
+
+def test_expired_sessions_log_in_again(farm):
+    data_collector.update_all_hosts()
+    farm.sim.expire_sessions()
+    farm.sim.calls.clear()
+
+    totals = data_collector.update_all_hosts()
+    assert totals['unchanged'] == 120
+    assert farm.sim.calls['Login'] == 4
+
+
+def _fetch_round_trips(datastores, vms, page_size):
+    sim = VSphereSimulator(page_size=page_size)
+    sim.add_host("10.0.0.1", datastores=[(1024, 512)] * datastores)
+    for i in range(vms):
+        sim.add_vm("10.0.0.1", f"vm-{i}", ips=[f"10.1.{i // 256}.{i % 256}"])
+    session = session_pool.HostSession("10.0.0.1", "root", "x", sim.connect)
+    session.login()
+    session.view(vim.VirtualMachine)
+    session.view(vim.HostSystem)
+    start = session.round_trips
+    metrics_row, vm_rows = data_collector._fetch_host_inventory(session, 1)
+    assert metrics_row[9] == datastores * 1024
+    assert len(vm_rows) == vms
+    return session.round_trips - start
+
+
+@pytest.mark.parametrize("datastores, vms", [(1, 10), (16, 10), (256, 10), (1, 400), (256, 400)])
+def test_host_fetch_round_trips_do_not_grow_with_inventory(db, datastores, vms):
+    assert _fetch_round_trips(datastores, vms, page_size=1000) == 1
+
+
+def test_host_fetch_only_adds_continuation_pages(db):
+    # 1 host + 64 datastores + 300 VMs = 365 objects: 4 pages of 100
+    assert _fetch_round_trips(64, 300, page_size=100) == 4
+
+
+def test_collector_pool_workers_collect_simulated_hosts(farm):
+    import collector_pool
+    with db_manager.read_connection() as conn:
+        hosts = conn.execute("SELECT * FROM hosts").fetchall()
+    pool = collector_pool.CollectorPool(2, 2, connect=farm)
+    try:
+        results, _, timed_out = pool.collect(hosts)
+    finally:
+        pool.close()
+    assert [r['inserted'] for r in results] == [30] * 4
+    assert timed_out == {}
+    assert _row_counts()['vms'] == 120
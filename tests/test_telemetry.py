@@ -0,0 +1,59 @@
+import pytest
+
+import db_manager
+import telemetry
+
+
+@pytest.fixture(autouse=True)
+def fresh_telemetry(monkeypatch):
+    monkeypatch.setattr(telemetry, '_pending', {})
+    monkeypatch.setattr(telemetry, '_finished', {})
+
+
+def _stats(scope):
+    return {row['phase']: (row['count'], row['seconds']) for row in telemetry.last_cycle_stats(scope)}
+
+
+def test_last_cycle_holds_one_cycle_per_scope(db):
+    telemetry.observe('host_retrieve', '10.0.0.1', 2.0)
+    telemetry.incr('soap_round_trips', '10.0.0.1', 3)
+    telemetry.end_cycle(['10.0.0.1'])
+    telemetry.observe('host_retrieve', '10.0.0.1', 1.0)
+    telemetry.incr('host_failures', '10.0.0.1')
+    telemetry.end_cycle(['10.0.0.1'])
+    # Still collecting: not part of any finished cycle yet
+    telemetry.observe('subnet_sweep', '10.1.0.0/24', 5.0)
+
+    before = db_manager.get_generation()
+    assert telemetry.flush() == 2
+    assert db_manager.get_generation() == before
+    # Two cycles ended before one flush: only the later one is kept, not their sum
+    assert _stats('10.0.0.1') == {'host_retrieve': (1, 1.0), 'host_failures': (1, None)}
+    assert _stats('10.1.0.0/24') == {}
+
+    # The next cycle replaces the scope's rows, dropping phases it did not record
+    telemetry.observe('host_retrieve', '10.0.0.1', 0.5)
+    telemetry.end_cycle(['10.0.0.1', '10.1.0.0/24'])
+    assert telemetry.flush() == 2
+    assert _stats('10.0.0.1') == {'host_retrieve': (1, 0.5)}
+    assert _stats('10.1.0.0/24') == {'subnet_sweep': (1, 5.0)}
+    assert telemetry.flush() == 0
+
+
+def test_metrics_endpoint_bypasses_the_generation_etag(db, monkeypatch):
+    import api_server
+    import ip_allocator
+
+    def no_sweep():
+        raise AssertionError("scrapes must not write")
+    monkeypatch.setattr(ip_allocator, 'sweep_expired', no_sweep)
+    client = api_server.app.test_client()
+    generation = f'W/"{db_manager.get_generation()}"'
+
+    telemetry.observe('host_connect', '10.0.0.1', 0.25)
+    telemetry.end_cycle(['10.0.0.1'])
+    telemetry.flush()
+    response = client.get('/metrics', headers={'If-None-Match': generation})
+    assert response.status_code == 200
+    assert 'ETag' not in response.headers
+    assert 'phase="host_connect",scope="10.0.0.1"} 0.250000' in response.get_data(as_text=True)
@@ -0,0 +1,31 @@
+from datetime import datetime
+
+import db_manager
+
+
+def _vm(uuid, name, ips=("10.0.0.1",)):
+    return (1, uuid, name, "Ubuntu Linux (64-bit)", 2, 1024, 4096, 0, "poweredOn", datetime(2026, 1, 1),
+            tuple(ips), (("Hard disk 1", 40.0),))
+
+
+def _names(query):
+    vms, total = db_manager.search_vms(query)
+    return sorted(vm['name'] for vm in vms)
+
+
+def test_bulk_replace_keeps_ids_and_the_name_index_in_step(db):
+    db_manager.bulk_upsert_hosts([("172.16.0.1", "root", "x", "g")])
+    db_manager.bulk_replace_vms(1, [_vm("a", "web-alpha"), _vm("b", "web-beta"), _vm("c", "db-gamma")])
+    with db_manager.read_connection() as conn:
+        ids = dict(conn.execute("SELECT vm_uuid, id FROM vms").fetchall())
+
+    db_manager.bulk_replace_vms(1, [_vm("a", "web-alpha", ips=("10.0.0.9",)), _vm("b", "api-beta"), _vm("d", "web-delta")])
+    with db_manager.read_connection() as conn:
+        after = dict(conn.execute("SELECT vm_uuid, id FROM vms").fetchall())
+    assert set(after) == {"a", "b", "d"}
+    assert after["a"] == ids["a"] and after["b"] == ids["b"]
+
+    assert _names("web") == ["web-alpha", "web-delta"]
+    assert _names("beta") == ["api-beta"]
+    assert _names("gamma") == []
+    assert [vm['name'] for vm in db_manager.search_vms("10.0.0.9", by="IP")[0]] == ["web-alpha"]
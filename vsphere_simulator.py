@@ -0,0 +1,748 @@
+import asyncio
+import itertools
+import threading
+import time
+import xml.etree.ElementTree as ET
+from collections import Counter
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+from pyVmomi import vim, vmodl
+
+# --- Offline vSphere Stand-In ---
+# Fakes vSphere below pyVmomi instead of beside it: the client gets real pyVmomi
+# objects (vim.ServiceInstance, vim.VirtualMachine, vmodl.query.PropertyCollector,
+# ...) bound to a _FakeStub in place of pyVmomi's SoapStubAdapter, so pyVmomi's own
+# argument checks (e.g. ObjectSpec.obj must be a ManagedObject) run as they would
+# against a real host. The stub answers the requests the collector sends from an
+# in-memory inventory: RetrieveServiceContent, container views, lazy property
+# reads, RetrievePropertiesEx paging and the CreateFilter / WaitForUpdatesEx
+# change stream. Results are real vmodl data objects.
+# Every request goes through VSphereSimulator._call, which counts it (one SOAP
+# round trip) and applies the injected latency.
+#
+# Usage:
+#   sim = VSphereSimulator()
+#   sim.add_host("10.0.0.1")
+#   vm = sim.add_vm("10.0.0.1", "web-01", ips=["10.1.0.5"])
+#   data_collector.connect_host = sim.connect
+# or a generated inventory (N hosts, M VMs each, K datastores, multi-IP NICs):
+#   farm = SimulatedFarm(hosts=50, vms_per_host=200, datastores=4, nics_per_vm=2, latency=0.002)
+#   data_collector.connect_host = farm      # farm.sim.calls counts the round trips
+# or over SOAP/HTTP for async_collector.py:
+#   endpoint = SoapEndpoint(farm.sim); endpoint.start()
+#   async_collector.host_endpoint = endpoint.address
+
+PC = vmodl.query.PropertyCollector
+
+
+def _type_name(type_or_obj):
+    """'VirtualMachine' for vim.VirtualMachine, a VM reference, a SimulatedObject or the string itself."""
+    if isinstance(type_or_obj, str):
+        return type_or_obj
+    if isinstance(type_or_obj, SimulatedObject):
+        return type_or_obj.type_name
+    return getattr(type_or_obj, '_wsdlName', None) or getattr(type_or_obj, '__name__', str(type_or_obj))
+
+
+class SimulatedObject:
+    """Server-side state of one managed object, its properties kept as a flat
+    {path: value} dict. Clients only see it as a vim.* reference to `mo_id`."""
+
+    def __init__(self, type_name, mo_id, props=None, refs=None):
+        self.type_name = type_name
+        self.mo_id = mo_id
+        self.props = props or {}
+        self.refs = refs or {}    # Reference properties, e.g. {'datastore': [ds, ...]}
+
+    def __repr__(self):
+        return f"'vim.{self.type_name}:{self.mo_id}'"
+
+
+class _PropertyNode:
+    """Nested data object view over a flat property dict. A lazy read of a
+    top-level property (`host.summary`) costs one round trip and returns this;
+    nested attributes are then local."""
+
+    def __init__(self, props, path):
+        self._props = props
+        self._path = path
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        path = f"{self._path}.{name}"
+        if path in self._props:
+            return self._props[path]
+        if any(key.startswith(path + '.') for key in self._props):
+            return _PropertyNode(self._props, path)
+        return None
+
+
+def make_nic(ips, network="VM Network"):
+    """guest.net entry with the given IP addresses."""
+    return vim.vm.GuestInfo.NicInfo(network=network, ipConfig=vim.net.IpConfigInfo(ipAddress=[
+        vim.net.IpConfigInfo.IpAddress(ipAddress=ip, prefixLength=24) for ip in ips
+    ]))
+
+
+def make_disk(label, capacity_gb):
+    """config.hardware.device entry for a virtual disk."""
+    disk = vim.vm.device.VirtualDisk()
+    disk.deviceInfo = vim.Description(label=label, summary=f"{capacity_gb} GB")
+    disk.capacityInKB = int(capacity_gb * 1024 * 1024)
+    return disk
+
+
+class _SimulatedHost:
+    def __init__(self, ip):
+        self.ip = ip
+        self.host = SimulatedObject('HostSystem', f"host-{ip}")
+        self.root = SimulatedObject('Folder', 'ha-folder-root')
+        self.datastores = []
+        self.vms = {}   # moId -> SimulatedObject
+
+    def objects_of(self, type_name):
+        if type_name == 'HostSystem':
+            return [self.host]
+        if type_name == 'Datastore':
+            return list(self.datastores)
+        if type_name == 'VirtualMachine':
+            return list(self.vms.values())
+        return []
+
+    def find(self, mo_id):
+        if mo_id in self.vms:
+            return self.vms[mo_id]
+        return next((obj for obj in [self.host, self.root] + self.datastores if obj.mo_id == mo_id), None)
+
+
+class VSphereSimulator:
+    """In-memory inventory of ESXi hosts, reached through pyVmomi objects."""
+
+    def __init__(self, latency=0.0, page_size=100, parse_cost=0.0):
+        self.latency = latency        # Seconds added to every fake round trip
+        self.page_size = page_size    # Default RetrievePropertiesEx page size
+        self.parse_cost = parse_cost  # CPU seconds burned per returned object (stands in for SOAP parsing)
+        self.calls = Counter()        # Round trips by method name
+        self.hosts = {}
+        self._ids = itertools.count(1)
+        self._version = 0
+        self._changes = []            # (version, host ip, kind, object, changed paths)
+        self._cond = threading.Condition()
+        self._stubs = []
+
+    # --- Inventory building / mutation ---
+
+    def add_host(self, ip, cpu_mhz=2600, cpu_threads=32, memory_gb=256,
+                 cpu_used_mhz=20000, mem_used_mb=65536, datastores=((2048, 1024),)):
+        """Adds a host. `datastores` is a list of (capacity_gb, free_gb)."""
+        host = _SimulatedHost(ip)
+        host.host.props.update({
+            "summary.quickStats.overallCpuUsage": cpu_used_mhz,
+            "summary.quickStats.overallMemoryUsage": mem_used_mb,
+            "summary.hardware.cpuMhz": cpu_mhz,
+            "summary.hardware.numCpuThreads": cpu_threads,
+            "summary.hardware.memorySize": memory_gb * 1024**3,
+        })
+        for capacity_gb, free_gb in datastores:
+            host.datastores.append(SimulatedObject('Datastore', f"datastore-{next(self._ids)}", {
+                "summary.capacity": capacity_gb * 1024**3,
+                "summary.freeSpace": free_gb * 1024**3,
+            }))
+        host.host.refs['datastore'] = host.datastores
+        with self._cond:
+            self.hosts[ip] = host
+        return host.host
+
+    def add_vm(self, host_ip, name, ips=(), power_state="poweredOn", num_cpu=2, memory_mb=4096,
+               guest_memory_mb=1024, disks_gb=(40,), guest_id="ubuntu64Guest",
+               guest_full_name="Ubuntu Linux (64-bit)", created=None, nics=None):
+        """Adds a VM and returns its moId. `nics` (list of IP lists) overrides `ips`."""
+        mo_id = f"vm-{next(self._ids)}"
+        nic_list = [make_nic(nic_ips) for nic_ips in (nics if nics is not None else [ips])] if (nics or ips) else []
+        props = {
+            "name": name,
+            "summary.config.name": name,
+            "summary.guest.guestFullName": guest_full_name if power_state == "poweredOn" else None,
+            "summary.guest.guestId": guest_id if power_state == "poweredOn" else None,
+            "config.guestFullName": guest_full_name,
+            "config.guestId": guest_id,
+            "summary.guest.ipAddress": (nic_list[0].ipConfig.ipAddress[0].ipAddress
+                                        if nic_list and nic_list[0].ipConfig.ipAddress else None),
+            "guest.net": vim.vm.GuestInfo.NicInfo.Array(nic_list),
+            "summary.config.memorySizeMB": memory_mb,
+            "summary.quickStats.guestMemoryUsage": guest_memory_mb,
+            "summary.config.numCpu": num_cpu,
+            "config.hardware.device": vim.vm.device.VirtualDevice.Array(
+                [make_disk(f"Hard disk {i + 1}", size) for i, size in enumerate(disks_gb)]),
+            "config.createDate": created or datetime(2024, 1, 1, 12, 0, 0),
+            "runtime.powerState": power_state,
+            "config.instanceUuid": f"5000{int(mo_id.split('-')[1]):028x}",
+        }
+        vm = SimulatedObject('VirtualMachine', mo_id, props)
+        with self._cond:
+            self.hosts[host_ip].vms[mo_id] = vm
+            self._record(host_ip, 'enter', vm, list(props))
+        return mo_id
+
+    def update_vm(self, host_ip, mo_id, **paths):
+        """Changes VM properties; keys are property paths with '.' written as '__'."""
+        with self._cond:
+            vm = self.hosts[host_ip].vms[mo_id]
+            changed = {path.replace('__', '.'): value for path, value in paths.items()}
+            vm.props.update(changed)
+            self._record(host_ip, 'modify', vm, list(changed))
+
+    def remove_vm(self, host_ip, mo_id):
+        with self._cond:
+            vm = self.hosts[host_ip].vms.pop(mo_id)
+            self._record(host_ip, 'leave', vm, [])
+
+    def update_host(self, host_ip, **paths):
+        """Changes HostSystem properties; keys as in update_vm."""
+        with self._cond:
+            host = self.hosts[host_ip].host
+            changed = {path.replace('__', '.'): value for path, value in paths.items()}
+            host.props.update(changed)
+            self._record(host_ip, 'modify', host, list(changed))
+
+    def _record(self, host_ip, kind, obj, paths):
+        self._version += 1
+        self._changes.append((self._version, host_ip, kind, obj, paths))
+        self._cond.notify_all()
+
+    # --- Client surface ---
+
+    def _call(self, method, stub=None):
+        self.calls[method] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if stub is not None and not stub.valid:
+            raise vim.fault.NotAuthenticated(msg="The session is not authenticated.")
+
+    def connect(self, host, user=None, password=None, **kwargs):
+        """Drop-in for data_collector.connect_host: a vim.ServiceInstance on a new session."""
+        self._call('Login')
+        if host not in self.hosts:
+            print(f"Failed to connect to {host}: unknown simulated host")
+            return None
+        stub = _FakeStub(self, self.hosts[host])
+        self._stubs.append(stub)
+        return vim.ServiceInstance('ServiceInstance', stub)
+
+    def expire_sessions(self):
+        """Invalidates every session handed out so far, like an ESXi idle timeout."""
+        for stub in self._stubs:
+            stub.valid = False
+
+    def total_calls(self):
+        return sum(self.calls.values())
+
+
+def _requested_paths(spec_set):
+    """{type name: [paths]} from one or more FilterSpecs."""
+    paths = {}
+    for spec in spec_set:
+        for prop_spec in spec.propSet:
+            paths.setdefault(_type_name(prop_spec.type), []).extend(prop_spec.pathSet or [])
+    return paths
+
+
+class _FakeStub:
+    """Stands in for pyVmomi's SoapStubAdapter on one simulated session.
+
+    Method calls and lazy property reads on the vim/vmodl objects bound to this
+    stub arrive in InvokeMethod and InvokeAccessor, the same two entry points the
+    session pool counts on a real stub; each is one simulated round trip. Container
+    views, property collectors with their filter and RetrievePropertiesEx
+    continuation tokens belong to the session, as on a real host.
+
+    Object selection is simplified: a filter returns every object of the requested
+    types on the simulated host, whatever its object and traversal specs say.
+    """
+
+    def __init__(self, sim, host):
+        self._sim = sim
+        self._host = host
+        self.valid = True
+        self._ids = itertools.count(1)
+        self._views = {}          # ContainerView moId -> type names
+        self._collectors = {}     # PropertyCollector moId -> {'filter', 'paths', 'backlog'}
+        self._pages = {}          # Token -> (remaining (object, paths) pairs, page size)
+        self._methods = {
+            'RetrieveServiceContent': self._service_content,
+            'CurrentTime': lambda mo: datetime.now(),
+            'Logout': self._logout,
+            'CreateContainerView': self._create_view,
+            'DestroyView': lambda mo: self._views.pop(mo._moId, None),
+            'RetrievePropertiesEx': self._retrieve,
+            'ContinueRetrievePropertiesEx': self._continue_retrieve,
+            'CreatePropertyCollector': self._create_collector,
+            'DestroyPropertyCollector': lambda mo: self._collectors.pop(mo._moId, None),
+            'CreateFilter': self._create_filter,
+            'DestroyPropertyFilter': self._destroy_filter,
+            'WaitForUpdatesEx': self._wait_for_updates,
+        }
+
+    def InvokeMethod(self, mo, info, args):
+        self._sim._call(info.wsdlName, self)
+        handler = self._methods.get(info.wsdlName)
+        if handler is None:
+            raise vmodl.fault.NotSupported(msg=f"{info.wsdlName} is not simulated")
+        return handler(mo, *args)
+
+    def InvokeAccessor(self, mo, info):
+        self._sim._call('RetrieveProperty', self)
+        if mo._moId in self._views:
+            return [self._ref(obj) for type_name in self._views[mo._moId] for obj in self._host.objects_of(type_name)]
+        obj = self._host.find(mo._moId)
+        if obj is None:
+            raise vmodl.fault.ManagedObjectNotFound(obj=mo)
+        if info.name in obj.refs:
+            return [self._ref(ref) for ref in obj.refs[info.name]]
+        if info.name in obj.props:
+            return obj.props[info.name]
+        return _PropertyNode(obj.props, info.name)
+
+    def DropConnections(self):
+        """Called by connect.Disconnect; a simulated session holds no sockets."""
+
+    def _ref(self, obj):
+        return getattr(vim, obj.type_name)(obj.mo_id, self)
+
+    def _new_id(self, prefix):
+        return f"{prefix}[{next(self._ids)}]"
+
+    # --- ServiceInstance / SessionManager / ViewManager ---
+
+    def _service_content(self, mo):
+        return vim.ServiceInstanceContent(
+            rootFolder=self._ref(self._host.root),
+            propertyCollector=PC('ha-property-collector', self),
+            viewManager=vim.view.ViewManager('ViewManager', self),
+            sessionManager=vim.SessionManager('ha-sessionmgr', self),
+            about=vim.AboutInfo(name="VMware ESXi (simulated)", apiVersion="6.7"),
+        )
+
+    def _logout(self, mo):
+        self.valid = False
+
+    def _create_view(self, mo, container, type, recursive):
+        view_id = self._new_id('session-view')
+        self._views[view_id] = [_type_name(t) for t in type]
+        return vim.view.ContainerView(view_id, self)
+
+    # --- PropertyCollector: RetrievePropertiesEx paging ---
+
+    def _object_content(self, obj, paths):
+        # Unset (None) properties are left out, as vSphere does
+        return PC.ObjectContent(obj=self._ref(obj), propSet=[
+            vmodl.DynamicProperty(name=path, val=obj.props[path]) for path in paths if obj.props.get(path) is not None
+        ])
+
+    def _page(self, contents, page_size):
+        page, rest = contents[:page_size], contents[page_size:]
+        if self._sim.parse_cost:
+            # Busy loop, so it holds the GIL like pyVmomi's XML deserializer does
+            end = time.perf_counter() + self._sim.parse_cost * len(page)
+            while time.perf_counter() < end:
+                pass
+        token = None
+        if rest:
+            token = f"token-{next(self._ids)}"
+            self._pages[token] = (rest, page_size)
+        return PC.RetrieveResult(objects=[self._object_content(obj, paths) for obj, paths in page], token=token)
+
+    def _retrieve(self, mo, specSet, options):
+        contents = [
+            (obj, paths)
+            for type_name, paths in _requested_paths(specSet).items()
+            for obj in self._host.objects_of(type_name)
+        ]
+        if not contents:
+            return None
+        return self._page(contents, (options and options.maxObjects) or self._sim.page_size)
+
+    def _continue_retrieve(self, mo, token):
+        if token not in self._pages:
+            raise vmodl.fault.InvalidArgument(invalidProperty="token")
+        return self._page(*self._pages.pop(token))
+
+    # --- PropertyCollector: CreateFilter / WaitForUpdatesEx ---
+
+    def _collector(self, mo):
+        return self._collectors.setdefault(mo._moId, {'filter': None, 'paths': {}, 'backlog': None})
+
+    def _create_collector(self, mo):
+        collector = PC(self._new_id('session-collector'), self)
+        self._collector(collector)
+        return collector
+
+    def _create_filter(self, mo, spec, partialUpdates):
+        state = self._collector(mo)
+        state['filter'] = PC.Filter(self._new_id('session-filter'), self)
+        state['paths'] = _requested_paths([spec])
+        return state['filter']
+
+    def _destroy_filter(self, mo):
+        for state in self._collectors.values():
+            if state['filter'] is not None and state['filter']._moId == mo._moId:
+                state['filter'], state['paths'] = None, {}
+
+    def _updates_since(self, wanted, version):
+        """Coalesced ObjectUpdates for this host after `version`."""
+        if version == '':
+            return [
+                PC.ObjectUpdate(kind='enter', obj=self._ref(obj), changeSet=[
+                    PC.Change(name=prop.name, op='assign', val=prop.val)
+                    for prop in self._object_content(obj, paths).propSet
+                ])
+                for type_name, paths in wanted.items()
+                for obj in self._host.objects_of(type_name)
+            ]
+        since = int(version)
+        merged = {}
+        for v, ip, kind, obj, paths in self._sim._changes:
+            if v <= since or ip != self._host.ip or obj.type_name not in wanted:
+                continue
+            entry = merged.setdefault(obj.mo_id, {'obj': obj, 'kind': kind, 'paths': set()})
+            if kind == 'leave':
+                entry['kind'] = 'leave' if entry['kind'] != 'enter' else None
+            elif entry['kind'] != 'enter':
+                entry['kind'] = kind
+            entry['paths'].update(paths)
+        updates = []
+        for entry in merged.values():
+            if entry['kind'] is None:   # Entered and left again since `version`
+                continue
+            obj = entry['obj']
+            paths = [] if entry['kind'] == 'leave' else [p for p in wanted[obj.type_name] if p in entry['paths']]
+            updates.append(PC.ObjectUpdate(kind=entry['kind'], obj=self._ref(obj), changeSet=[
+                PC.Change(name=p, op='assign', val=obj.props.get(p)) for p in paths
+            ]))
+        return updates
+
+    def _wait_for_updates(self, mo, version, options):
+        state = self._collector(mo)
+        version = version or ''
+        max_updates = options.maxObjectUpdates if options else None
+        if state['backlog'] and version == state['backlog'][0]:
+            _, updates, current = state['backlog']
+        else:
+            max_wait = options.maxWaitSeconds if options else None
+            with self._sim._cond:
+                deadline = None if max_wait is None else time.monotonic() + max_wait
+                while True:
+                    updates = self._updates_since(state['paths'], version)
+                    current = str(self._sim._version)
+                    if updates or version == '':
+                        break
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return None
+                    self._sim._cond.wait(remaining)
+
+        state['backlog'] = None
+        truncated = bool(max_updates) and len(updates) > max_updates
+        if truncated:
+            # The rest is handed out on the next call, keyed by an interim version
+            interim = f"{current}.{next(self._ids)}"
+            state['backlog'] = (interim, updates[max_updates:], current)
+            updates, current = updates[:max_updates], interim
+        return PC.UpdateSet(version=current, truncated=truncated, filterSet=[
+            PC.FilterUpdate(filter=state['filter'], objectSet=updates)
+        ])
+
+
+# --- Generated Inventories ---
+
+def farm_host_ips(hosts):
+    """Management IPs of the hosts build_inventory creates (10.0.0.1 upwards)."""
+    return [f"10.0.{i // 250}.{i % 250 + 1}" for i in range(hosts)]
+
+
+def _dotted(address):
+    return f"{address >> 24}.{address >> 16 & 255}.{address >> 8 & 255}.{address & 255}"
+
+
+def build_inventory(sim, hosts=10, vms_per_host=50, datastores=1, nics_per_vm=1, ips_per_nic=1,
+                    disks_per_vm=2, powered_off_every=10):
+    """Fills `sim` with a deterministic inventory and returns the host IPs.
+
+    VM addresses are unique across the farm, counting up from 10.64.0.1. Every
+    `powered_off_every`-th VM is powered off (0 for none).
+    """
+    ips = farm_host_ips(hosts)
+    next_ip = 10 << 24 | 64 << 16 | 1
+    for h, host_ip in enumerate(ips):
+        sim.add_host(host_ip, cpu_used_mhz=10000 + h % 40 * 1000,
+                     datastores=[(2048 + 512 * d, 256 + (h * 37 + d * 101) % 1536) for d in range(datastores)])
+        for v in range(vms_per_host):
+            nics = []
+            for _ in range(nics_per_vm):
+                nics.append([_dotted(address) for address in range(next_ip, next_ip + ips_per_nic)])
+                next_ip += ips_per_nic
+            off = powered_off_every and (h * vms_per_host + v) % powered_off_every == powered_off_every - 1
+            sim.add_vm(host_ip, f"vm-{h}-{v}", nics=nics, power_state="poweredOff" if off else "poweredOn",
+                       num_cpu=1 << v % 4, memory_mb=1024 << v % 4, guest_memory_mb=256 << v % 4,
+                       disks_gb=[40 + 10 * d for d in range(disks_per_vm)])
+    return ips
+
+
+_farm_lock = threading.Lock()
+
+
+class SimulatedFarm:
+    """Picklable stand-in for data_collector.connect_host over a generated inventory.
+
+    The simulator is built on first use in each process, so spawned collector
+    workers (collector_pool.py) serve the same inventory. Keyword arguments are
+    those of build_inventory plus `latency`, `page_size` and `parse_cost`.
+    """
+
+    def __init__(self, latency=0.0, page_size=100, parse_cost=0.0, **inventory):
+        self.config = {'latency': latency, 'page_size': page_size, 'parse_cost': parse_cost}
+        self.inventory = inventory
+        self._sim = None
+
+    def __getstate__(self):
+        return {'config': self.config, 'inventory': self.inventory, '_sim': None}
+
+    @property
+    def sim(self):
+        with _farm_lock:    # Collector threads log in concurrently; build the inventory once
+            if self._sim is None:
+                sim = VSphereSimulator(**self.config)
+                build_inventory(sim, **self.inventory)
+                self._sim = sim
+        return self._sim
+
+    def host_ips(self):
+        return farm_host_ips(self.inventory.get('hosts', 10))
+
+    def __call__(self, host, user=None, password=None, **kwargs):
+        return self.sim.connect(host, user, password)
+
+
+# --- SOAP/HTTP Endpoint ---
+# Serves a simulator's hosts over vSphere's SOAP protocol, as plain HTTP on one
+# local port, for async_collector.py. Requests are routed to a simulated host by
+# their Host header (unknown hosts get the connection dropped, like an unreachable
+# one). The injected latency is awaited, so concurrent slow calls overlap as they
+# would against real hosts. Only the calls the collector makes are implemented,
+# and object selection is as simplified as in _FakeStub.
+
+SOAP_ENV = "http://schemas.xmlsoap.org/soap/envelope/"
+_SERVICE_CONTENT = ('<returnval><rootFolder type="Folder">ha-folder-root</rootFolder>'
+                    '<propertyCollector type="PropertyCollector">ha-property-collector</propertyCollector>'
+                    '<viewManager type="ViewManager">ViewManager</viewManager>'
+                    '<about><name>VMware ESXi (simulated)</name><apiVersion>6.7</apiVersion></about>'
+                    '<sessionManager type="SessionManager">ha-sessionmgr</sessionManager></returnval>')
+
+
+def _local(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def _xml_field(tag, value, declared=None):
+    """A nested data object field. Untyped, as ESXi sends them, unless the value
+    is a subclass of the field's declared type (e.g. VirtualDisk in a
+    VirtualDevice array)."""
+    if value is None:
+        return ""
+    if isinstance(value, (list, tuple)):
+        item_type = getattr(declared, 'Item', None)
+        return "".join(_xml_field(tag, item, item_type) for item in value)
+    if isinstance(value, bool):
+        return f"<{tag}>{'true' if value else 'false'}</{tag}>"
+    if isinstance(value, datetime):
+        return f"<{tag}>{value.isoformat()}</{tag}>"
+    if isinstance(value, (int, float, str)):
+        return f"<{tag}>{escape(str(value))}</{tag}>"
+    attr = f' xsi:type="{value._wsdlName}"' if declared is not None and type(value) is not declared else ""
+    inner = "".join(_xml_field(info.name, getattr(value, info.name), info.type) for info in value._GetPropertyList())
+    return f"<{tag}{attr}>{inner}</{tag}>"
+
+
+def _xml_val(path, value):
+    """A top-level property value with its xsi:type."""
+    if isinstance(value, (list, tuple)):
+        item = value.Item._wsdlName
+        return f'<val xsi:type="ArrayOf{item}">{_xml_field(item, value, type(value))}</val>'
+    if isinstance(value, bool):
+        return f'<val xsi:type="xsd:boolean">{"true" if value else "false"}</val>'
+    if isinstance(value, int):
+        return f'<val xsi:type="xsd:long">{value}</val>'
+    if isinstance(value, float):
+        return f'<val xsi:type="xsd:double">{value}</val>'
+    if isinstance(value, datetime):
+        return f'<val xsi:type="xsd:dateTime">{value.isoformat()}</val>'
+    return f'<val xsi:type="xsd:string">{escape(str(value))}</val>'
+
+
+def _xml_object(obj, paths):
+    props = "".join(f"<propSet><name>{path}</name>{_xml_val(path, obj.props[path])}</propSet>"
+                    for path in paths if obj.props.get(path) is not None)
+    return f'<objects><obj type="{obj.type_name}">{obj.mo_id}</obj>{props}</objects>'
+
+
+def _soap_response(method, result):
+    return (f'<?xml version="1.0" encoding="UTF-8"?><soapenv:Envelope xmlns:soapenv="{SOAP_ENV}" '
+            f'xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'
+            f'<soapenv:Body><{method}Response xmlns="urn:vim25">{result}</{method}Response>'
+            f'</soapenv:Body></soapenv:Envelope>').encode()
+
+
+def _soap_fault(name, message):
+    return (f'<?xml version="1.0" encoding="UTF-8"?><soapenv:Envelope xmlns:soapenv="{SOAP_ENV}" '
+            f'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"><soapenv:Body><soapenv:Fault>'
+            f'<faultcode>ServerFaultCode</faultcode><faultstring>{escape(message)}</faultstring>'
+            f'<detail><{name}Fault xmlns="urn:vim25" xsi:type="{name}"/></detail>'
+            f'</soapenv:Fault></soapenv:Body></soapenv:Envelope>').encode()
+
+
+class SoapEndpoint:
+    """The simulator's hosts behind one HTTP port, speaking vSphere SOAP.
+
+    start() serves from a daemon thread with its own event loop; pass `address` as
+    async_collector.host_endpoint. Calls are counted in sim.calls.
+    """
+
+    def __init__(self, sim):
+        self.sim = sim
+        self.port = None
+        self._sessions = {}        # cookie -> host ip
+        self._pages = {}           # token -> (remaining (object, paths) pairs, page size)
+        self._ids = itertools.count(1)
+        self._loop = None
+        self._server = None
+
+    def address(self, ip):
+        """Drop-in for async_collector.host_endpoint."""
+        return "127.0.0.1", self.port, None
+
+    def expire_sessions(self):
+        """Invalidates every session cookie handed out so far."""
+        self._sessions.clear()
+
+    async def serve(self, host="127.0.0.1", port=0):
+        self._server = await asyncio.start_server(self._handle, host, port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self._server
+
+    def start(self):
+        """Serves from a daemon thread; returns the port."""
+        ready = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self.serve())
+            ready.set()
+            self._loop.run_forever()
+
+        threading.Thread(target=run, name="soap-endpoint", daemon=True).start()
+        ready.wait()
+        return self.port
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._server.close)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                ip = headers.get("host", "").split(":")[0]
+                if ip not in self.sim.hosts:
+                    break
+                status, payload, extra = await self._dispatch(self.sim.hosts[ip], headers, body)
+                writer.write((f"HTTP/1.1 {status} {'OK' if status == 200 else 'Internal Server Error'}\r\n"
+                              f"Content-Type: text/xml; charset=utf-8\r\nContent-Length: {len(payload)}\r\n"
+                              f"{extra}\r\n").encode() + payload)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, host, headers, body):
+        """(HTTP status, response body, extra header lines) for one SOAP request."""
+        request = next(iter(ET.fromstring(body).find(f"{{{SOAP_ENV}}}Body")))
+        method = _local(request.tag)
+        args = {_local(child.tag): child for child in request}
+        self.sim.calls[method] += 1
+        if self.sim.latency:
+            await asyncio.sleep(self.sim.latency)
+
+        if method == "RetrieveServiceContent":
+            return 200, _soap_response(method, _SERVICE_CONTENT), ""
+        if method == "Login":
+            cookie = f'vmware_soap_session="{next(self._ids):032x}"'
+            self._sessions[cookie] = host.ip
+            user = escape(args['userName'].text or "")
+            return 200, _soap_response(method, f"<returnval><userName>{user}</userName></returnval>"), \
+                f"Set-Cookie: {cookie}; Path=/; HttpOnly\r\n"
+        if self._sessions.get(headers.get("cookie", "").split(";")[0]) != host.ip:
+            return 500, _soap_fault("NotAuthenticated", "The session is not authenticated."), ""
+
+        if method == "CreateContainerView":
+            result = f'<returnval type="ContainerView">session[{next(self._ids)}]</returnval>'
+        elif method == "RetrievePropertiesEx":
+            paths = {}
+            for prop_set in args['specSet'].iter():
+                if _local(prop_set.tag) == "propSet":
+                    type_name = next(child.text for child in prop_set if _local(child.tag) == "type")
+                    paths.setdefault(type_name, []).extend(
+                        child.text for child in prop_set if _local(child.tag) == "pathSet")
+            contents = [(obj, type_paths) for type_name, type_paths in paths.items() for obj in host.objects_of(type_name)]
+            max_objects = args['options'].find("{urn:vim25}maxObjects") if 'options' in args else None
+            result = self._page(contents, int(max_objects.text) if max_objects is not None else self.sim.page_size)
+        elif method == "ContinueRetrievePropertiesEx":
+            pending = self._pages.pop(args['token'].text, None)
+            if pending is None:
+                return 500, _soap_fault("InvalidArgument", "unknown token"), ""
+            result = self._page(*pending)
+        elif method == "CurrentTime":
+            result = f"<returnval>{datetime.now().isoformat()}</returnval>"
+        elif method == "Logout":
+            self._sessions.pop(headers.get("cookie", "").split(";")[0], None)
+            result = ""
+        else:
+            return 500, _soap_fault("NotImplemented", f"{method} is not simulated"), ""
+        return 200, _soap_response(method, result), ""
+
+    def _page(self, contents, page_size):
+        if not contents:
+            return ""
+        page, rest = contents[:page_size], contents[page_size:]
+        token = ""
+        if rest:
+            token = f"token-{next(self._ids)}"
+            self._pages[token] = (rest, page_size)
+            token = f"<token>{token}</token>"
+        return f"<returnval>{token}{''.join(_xml_object(obj, paths) for obj, paths in page)}</returnval>"
+
+
+def run_soap_endpoint(farm, ready):
+    """Process entry point: serves `farm` (a SimulatedFarm) over SOAP until killed,
+    after sending the port through the `ready` pipe."""
+    endpoint = SoapEndpoint(farm.sim)
+
+    async def main():
+        await endpoint.serve()
+        ready.send(endpoint.port)
+        await asyncio.Event().wait()
+
+    asyncio.run(main())